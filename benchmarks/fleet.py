@@ -0,0 +1,668 @@
+'''
+End-to-end benchmark of normal_run against a simulated fleet of
+Cisco devices, so that the effect of a change on a whole crawl can be
+measured without touching a real network.
+
+build_fleet() generates a CDP tree of IOS and NX-OS devices, each with
+its own 'show run', 'show inventory', 'show cdp neighbor detail' and
+'show mac address-table' (NX-OS devices answer '| json' as well).
+serve() emulates their CLIs over SSH and telnet, each device on its
+own loopback address (127.10.x.y), with configurable command latency,
+rejected logins and dropped sessions. run() serves the fleet from a
+separate process, crawls it with normal_run from the first device
+into the bench_main and bench_inventory databases, and reports the
+devices crawled per second, CPU time and peak memory.
+
+The same options and seed always generate the same fleet, and the
+same logins and sessions fail.
+
+cli.connect only uses ports 22 and 23, which needs root (or
+CAP_NET_BIND_SERVICE) to listen on. NX-OS devices are always served
+over SSH, since Netmiko has no telnet driver for them. The databases
+are on the Postgres server configured for netcrawl, and are emptied
+at the start of each run.
+
+Usage::
+
+    python -m benchmarks.fleet [-n DEVICES] [--fanout N] [--nxos RATIO]
+        [--macs N] [--latency SECONDS] [--auth-failures RATIO]
+        [--drops RATIO] [--transport {ssh,telnet}] [--seed SEED]
+        [--json PATH] [--keep]
+'''
+
+import argparse, ipaddress, json, logging, multiprocessing, random, re
+import resource, selectors, shutil, socket, tempfile, threading, time
+
+import paramiko
+
+from netcrawl import config, core, io_sql
+from netcrawl.wylog import metrics
+
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+# The first device is at FIRST_IP + 1
+FIRST_IP = ipaddress.IPv4Address('127.10.0.0')
+
+DOMAIN = 'bench.local'
+
+PLATFORMS = {
+    False: ('cisco WS-C3850-48P',
+            'Cisco IOS Software, IOS-XE Software, Catalyst L3 Switch '
+            'Software (CAT3K_CAA-UNIVERSALK9-M), Version 03.06.06E '
+            'RELEASE SOFTWARE (fc1)'),
+    True: ('N9K-C93180YC-EX',
+           'Cisco Nexus Operating System (NX-OS) Software, '
+           'Version 7.0(3)I7(3)'),
+    }
+
+# Devices have this many ports unless sim_device.ports is changed.
+# The first ones link to other devices, and MAC addresses are learned
+# on the rest.
+PORTS = 48
+
+INVALID = {
+    False: "% Invalid input detected at '^' marker.",
+    True: "% Invalid command at '^' marker.",
+    }
+
+# Telnet option negotiation, which is ignored
+IAC = re.compile(rb'\xff[\xfb-\xfe].|\xff[\xf0-\xfa]', re.S)
+
+
+class sim_device():
+    '''One device of a simulated fleet. Its outputs are generated the
+    first time they are asked for.'''
+
+    def __init__(self, index, nxos, auth_fails, serial):
+        self.index = index
+        self.name = 'bench-{:05d}'.format(index)
+        self.ip = str(FIRST_IP + index + 1)
+        self.nxos = nxos
+        self.auth_fails = auth_fails
+        self.serial = serial
+        self.platform, self.version = PLATFORMS[nxos]
+
+        # (local port, neighbor, neighbor port, local ip, neighbor ip)
+        self.links = []
+        self.ports = PORTS
+        self.macs = 0
+
+        self._outputs = None
+
+    def port(self, number, short=False):
+        if self.nxos: return ('Eth' if short else 'Ethernet') + '1/{}'.format(number)
+        return ('Gi' if short else 'GigabitEthernet') + '1/0/{}'.format(number)
+
+    def mac_entries(self):
+        '''Returns (vlan, mac, port number) tuples. MACs are unique in
+        the fleet, and learned on the ports without links.'''
+        first = len(self.links) + 1
+        ports = max(1, self.ports - first + 1)
+
+        output = []
+        for i in range(self.macs):
+            mac = '{:012x}'.format((0x02 << 40) | (self.index << 24) | i)
+            output.append((10 + i % 4,
+                           '.'.join((mac[:4], mac[4:8], mac[8:])),
+                           first + i % ports))
+        return output
+
+    def output(self, command):
+        '''Returns the output of a command, or None if it's invalid'''
+        if self._outputs is None: self._outputs = self._generate()
+        return self._outputs.get(' '.join(command.split()))
+
+    def _generate(self):
+        outputs = {
+            'show running-config': self._config(),
+            'show inventory': self._inventory(),
+            'show cdp neighbors detail': self._cdp(),
+            'show mac address-table': self._mac_table(),
+            }
+        outputs['show run'] = outputs['show running-config']
+        outputs['show cdp neighbor detail'] = outputs['show cdp neighbors detail']
+
+        if self.nxos:
+            for command, data in (
+                    ('show inventory', self._inventory_json()),
+                    ('show interface', self._interfaces_json()),
+                    ('show cdp neighbors detail', self._cdp_json()),
+                    ('show mac address-table', self._mac_table_json())):
+                outputs[command + ' | json'] = json.dumps(data, indent=1)
+        return outputs
+
+    def _config(self):
+        if self.nxos:
+            lines = ['!Command: show running-config',
+                     '!Time: Mon Mar 20 10:12:01 2017', '',
+                     'version 7.0(3)I7(3)',
+                     'hostname ' + self.name, '',
+                     'feature cdp', 'feature interface-vlan', '',
+                     'vlan 1,10-13', '']
+            sep, indent = '', '  '
+        else:
+            lines = ['Building configuration...', '',
+                     'Current configuration : 8192 bytes', '!',
+                     'version 15.2',
+                     'service timestamps debug datetime msec',
+                     'no service password-encryption', '!',
+                     'hostname ' + self.name, '!',
+                     'vtp mode transparent', '!']
+            sep, indent = '!', ' '
+
+        for number, peer, peer_port, ip, peer_ip in self.links:
+            lines += ['interface ' + self.port(number),
+                      indent + 'description Link to {} {}'.format(peer.name, peer_port),
+                      indent + 'no switchport',
+                      indent + 'ip address {} 255.255.255.252'.format(ip),
+                      sep]
+
+        for number in range(len(self.links) + 1, self.ports + 1):
+            lines += ['interface ' + self.port(number),
+                      indent + 'switchport access vlan {}'.format(10 + number % 4),
+                      indent + 'switchport mode access',
+                      sep]
+
+        lines += ['interface Vlan1',
+                  indent + 'description Management',
+                  indent + 'ip address {} 255.255.0.0'.format(self.ip),
+                  sep]
+        for vlan in range(10, 14):
+            lines += ['interface Vlan{}'.format(vlan),
+                      indent + 'ip address 10.{}.{}.1 255.255.255.0'.format(
+                          vlan, self.index % 250),
+                      indent + 'standby {} ip 10.{}.{}.254'.format(
+                          vlan, vlan, self.index % 250),
+                      sep]
+
+        lines += ['line vty 0 4', ' transport input ssh telnet', sep, 'end']
+        return '\n'.join(lines)
+
+    def _modules(self):
+        '''Returns (name, description, pid, serial) tuples'''
+        pid = self.platform.split()[-1]
+        output = [('Chassis', 'Cisco {} chassis'.format(pid), pid, self.serial)]
+        for number, *_ in self.links:
+            output.append((self.port(number), 'SFP-10GBase-SR', 'SFP-10G-SR',
+                           'AVD{:04d}{:04d}'.format(self.index % 10000, number)))
+        return output
+
+    def _inventory(self):
+        return '\n\n'.join(
+            'NAME: "{}", DESCR: "{}"\nPID: {:<18}, VID: V01  , SN: {}'.format(*x)
+            for x in self._modules())
+
+    def _inventory_json(self):
+        return {'TABLE_inv': {'ROW_inv': [
+            {'name': name, 'desc': desc, 'productid': pid, 'vendorid': 'V01',
+             'serialnum': serial}
+            for name, desc, pid, serial in self._modules()]}}
+
+    def _interfaces_json(self):
+        rows = []
+        for number in range(1, self.ports + 1):
+            row = {'interface': self.port(number), 'state': 'up'}
+            for link in self.links:
+                if link[0] == number:
+                    row.update({'desc': 'Link to ' + link[1].name,
+                                'eth_ip_addr': link[3], 'eth_ip_mask': 30})
+            rows.append(row)
+        rows.append({'interface': 'Vlan1', 'svi_desc': 'Management',
+                     'svi_ip_addr': self.ip, 'svi_ip_mask': 16})
+        return {'TABLE_interface': {'ROW_interface': rows}}
+
+    def _cdp(self):
+        entries = []
+        for number, peer, peer_port, ip, peer_ip in self.links:
+            entries.append('\n'.join((
+                '-------------------------',
+                'Device ID: {}.{}'.format(peer.name, DOMAIN),
+                'Entry address(es): ',
+                '  IP address: ' + peer.ip,
+                'Platform: {},  Capabilities: Router Switch IGMP '.format(peer.platform),
+                'Interface: {},  Port ID (outgoing port): {}'.format(
+                    self.port(number), peer_port),
+                'Holdtime : 155 sec', '',
+                'Version :', peer.version, '',
+                'advertisement version: 2',
+                'Native VLAN: 1',
+                'Duplex: full',
+                'Management address(es): ',
+                '  IP address: ' + peer.ip, '')))
+        return '\n'.join(entries) + '\n'
+
+    def _cdp_json(self):
+        return {'TABLE_cdp_neighbor_detail_info': {
+            'ROW_cdp_neighbor_detail_info': [
+                {'device_id': '{}.{}'.format(peer.name, DOMAIN),
+                 'sysname': peer.name,
+                 'v4addr': peer.ip,
+                 'v4mgmtaddr': peer.ip,
+                 'platform_id': peer.platform,
+                 'capability': ['router', 'switch', 'IGMP_cnd_filtering'],
+                 'intf_id': self.port(number),
+                 'port_id': peer_port,
+                 'ttl': '155',
+                 'version': peer.version,
+                 'duplexmode': 'full'}
+                for number, peer, peer_port, ip, peer_ip in self.links]}}
+
+    def _mac_table(self):
+        entries = self.mac_entries()
+        lines = ['          Mac Address Table',
+                 '-------------------------------------------', '',
+                 'Vlan    Mac Address       Type        Ports',
+                 '----    -----------       --------    -----',
+                 ' All    0100.0ccc.cccc    STATIC      CPU',
+                 ' All    ffff.ffff.ffff    STATIC      CPU']
+        for vlan, mac, number in entries:
+            lines.append('{:>4}    {}    DYNAMIC     {}'.format(
+                vlan, mac, self.port(number, short=True)))
+        lines.append('Total Mac Addresses for this criterion: {}'.format(
+            len(entries) + 2))
+        return '\n'.join(lines)
+
+    def _mac_table_json(self):
+        return {'TABLE_mac_address': {'ROW_mac_address': [
+            {'disp_mac_addr': mac, 'disp_type': '* ', 'disp_vlan': str(vlan),
+             'disp_is_static': 'disabled', 'disp_age': '0',
+             'disp_port': self.port(number)}
+            for vlan, mac, number in self.mac_entries()]}}
+
+
+def build_fleet(n, fanout=3, nxos=0.2, macs=50, auth_failures=0, seed=0):
+    '''Generates a fleet of devices linked in a tree. The first device
+    is the root, which is always IOS and always accepts logins.
+
+    Args:
+        n (int): The number of devices
+
+    Keyword Args:
+        fanout (int): Neighbors below each device
+        nxos (float): The share of devices which run NX-OS
+        macs (int): MAC addresses learned on each device
+        auth_failures (float): The share of devices which reject
+            every login. Nothing behind them is discovered.
+        seed (int): Seeds the generator
+
+    Returns:
+        list: Of sim_device
+    '''
+    rng = random.Random(seed)
+
+    fleet = []
+    for i in range(n):
+        fleet.append(sim_device(
+            i,
+            nxos=bool(i) and rng.random() < nxos,
+            auth_fails=bool(i) and rng.random() < auth_failures,
+            serial='FOC{:08X}'.format(rng.getrandbits(32))))
+        fleet[-1].macs = macs
+
+    # Each device links to its parent on its first port, and to its
+    # children on the following ones. Links are /30s in 10.0.0.0/8.
+    for i in range(1, n):
+        child, parent = fleet[i], fleet[(i - 1) // fanout]
+        child_port = len(child.links) + 1
+        parent_port = len(parent.links) + 1
+        subnet = int(ipaddress.IPv4Address('10.0.0.0')) + i * 4
+
+        child_ip = str(ipaddress.IPv4Address(subnet + 2))
+        parent_ip = str(ipaddress.IPv4Address(subnet + 1))
+
+        child.links.append((child_port, parent, parent.port(parent_port),
+                            child_ip, parent_ip))
+        parent.links.append((parent_port, child, child.port(child_port),
+                             parent_ip, child_ip))
+    return fleet
+
+
+def reachable(fleet):
+    '''Returns the number of devices a crawl from the root can log in
+    to, without dropped sessions'''
+    if not fleet: return 0
+
+    seen = {0}
+    stack = [fleet[0]]
+    while stack:
+        device = stack.pop()
+        for _, peer, *_ in device.links:
+            if peer.index in seen or peer.auth_fails: continue
+            seen.add(peer.index)
+            stack.append(peer)
+    return len(seen)
+
+
+class cli_session():
+    '''Emulates the CLI of a device over a connection, which can be a
+    socket or a paramiko channel.'''
+
+    def __init__(self, device, conn, options, rng, login=False):
+        self.device = device
+        self.conn = conn
+        self.options = options
+        self.rng = rng
+        self.login = login
+        self.enabled = device.nxos
+        self.buffer = ''
+        self.skip_lf = False
+
+    @property
+    def prompt(self):
+        return self.device.name + ('#' if self.enabled else '>')
+
+    def write(self, text):
+        self.conn.sendall(text.replace('\n', '\r\n').encode('utf-8'))
+
+    def readline(self, echo=True):
+        '''Returns the next line without its line ending, or None when
+        the client has gone'''
+        while True:
+            if self.skip_lf and self.buffer:
+                if self.buffer[0] == '\n': self.buffer = self.buffer[1:]
+                self.skip_lf = False
+
+            match = re.search('[\r\n]', self.buffer)
+            if match:
+                line = self.buffer[:match.start()]
+                self.buffer = self.buffer[match.end():]
+                self.skip_lf = match.group() == '\r'
+                line = line.replace('\x00', '')
+                if echo: self.write(line + '\n')
+                return line
+
+            try: data = self.conn.recv(4096)
+            except (OSError, EOFError): return None
+            if not data: return None
+            self.buffer += IAC.sub(b'', data).decode('utf-8', 'replace')
+
+    def delay(self):
+        if self.options.latency:
+            time.sleep(self.options.latency * (0.5 + self.rng.random()))
+
+    def run(self):
+        if self.login:
+            self.write('\nUser Access Verification\n\nUsername: ')
+            username = self.readline()
+            if username is None: return
+
+            self.write('Password: ')
+            password = self.readline(echo=False)
+            if password is None: return
+
+            self.delay()
+            if (self.device.auth_fails or
+                (username, password) != (USERNAME, PASSWORD)):
+                self.write('\n% Authentication failed\n')
+                return
+            self.write('\n')
+
+        self.write('\n' + self.prompt)
+
+        while True:
+            line = self.readline()
+            if line is None: return
+
+            command = line.strip()
+            if command in ('exit', 'logout', 'quit'): return
+
+            if not command or command.startswith('terminal '):
+                pass
+
+            elif command in ('enable', 'en'):
+                if not self.enabled:
+                    self.write('Password: ')
+                    secret = self.readline(echo=False)
+                    if secret is None: return
+                    if secret == PASSWORD: self.enabled = True
+                    else: self.write('\n% Access denied\n')
+
+            else:
+                output = self.device.output(command)
+                if output is None: output = INVALID[self.device.nxos]
+                self.delay()
+
+                if self.rng.random() < self.options.drops:
+                    self.write(output[:len(output) // 2])
+                    return
+
+                self.write(output + '\n')
+
+            self.write(self.prompt)
+
+
+class ssh_server(paramiko.ServerInterface):
+    '''Accepts the bench credentials and a shell'''
+
+    def __init__(self, device):
+        self.device = device
+        self.shell = threading.Event()
+
+    def get_allowed_auths(self, username): return 'password'
+
+    def check_auth_password(self, username, password):
+        if (self.device.auth_fails or
+            (username, password) != (USERNAME, PASSWORD)):
+            return paramiko.AUTH_FAILED
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session': return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *args): return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+
+
+def _handle(device, transport, conn, options, host_key, rng):
+    '''Runs one session in its own thread'''
+    ssh = None
+    try:
+        if transport == 'telnet':
+            cli_session(device, conn, options, rng, login=True).run()
+            return
+
+        ssh = paramiko.Transport(conn)
+        ssh.add_server_key(host_key)
+        server = ssh_server(device)
+        ssh.start_server(server=server)
+
+        channel = ssh.accept(30)
+        if channel is None or not server.shell.wait(30): return
+
+        cli_session(device, channel, options, rng).run()
+        channel.close()
+
+    # Clients which only probe the port, or give up, are expected
+    except (OSError, EOFError, paramiko.SSHException): pass
+    finally:
+        if ssh is not None: ssh.close()
+        conn.close()
+
+
+def serve(fleet, options, ready=None, stop=None):
+    '''Serves the devices of a fleet until stop is set.
+
+    Args:
+        fleet (list): Of sim_device, from build_fleet()
+        options (argparse.Namespace): With latency, drops, transport
+            and seed
+
+    Keyword Args:
+        ready (multiprocessing.Event): Set once every device listens
+        stop (multiprocessing.Event): Stops serving when set
+    '''
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    host_key = paramiko.RSAKey.generate(2048)
+
+    selector = selectors.DefaultSelector()
+    listeners = []
+    for device in fleet:
+        transports = ['ssh']
+        if options.transport == 'telnet' and not device.nxos:
+            transports = ['telnet']
+
+        for transport in transports:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((device.ip, 22 if transport == 'ssh' else 23))
+            s.listen(64)
+            selector.register(s, selectors.EVENT_READ, (device, transport))
+            listeners.append(s)
+
+    if ready is not None: ready.set()
+
+    # Sessions fail the same way on each run
+    sessions = {}
+    try:
+        while stop is None or not stop.is_set():
+            for key, _ in selector.select(timeout=0.5):
+                device, transport = key.data
+                try: conn, _ = key.fileobj.accept()
+                except OSError: continue
+
+                number = sessions[device.index] = sessions.get(device.index, 0) + 1
+                rng = random.Random('{}-{}-{}'.format(
+                    options.seed, device.index, number))
+
+                threading.Thread(target=_handle, daemon=True,
+                                 args=(device, transport, conn, options,
+                                       host_key, rng)).start()
+    finally:
+        for s in listeners: s.close()
+        selector.close()
+
+
+def _cpu(usage): return usage.ru_utime + usage.ru_stime
+
+
+def run(options):
+    '''Crawls a simulated fleet with normal_run.
+
+    Args:
+        options (argparse.Namespace): As parsed by main()
+
+    Returns:
+        dict: The results of the run
+    '''
+    config.parse_config()
+
+    # Keep the logs, outputs and databases of the run apart
+    tmp = tempfile.mkdtemp(prefix='netcrawl-bench-')
+    config.cc.run_path = tmp
+    config.cc.devices_path = tmp + '/devices'
+    config.cc.archive_path = tmp + '/archive'
+    config.cc.log_path = tmp + '/log.txt'
+    config.cc.json_log_path = tmp + '/log.jsonl'
+    config.cc.metrics_path = tmp + '/metrics.json'
+    config.cc.profile_path = tmp + '/profile'
+    config.cc.main.name = 'bench_main'
+    config.cc.inventory.name = 'bench_inventory'
+    config.cc.credentials = [{'username': USERNAME, 'password': PASSWORD,
+                              'cred_type': 'bench'}]
+
+    fleet = build_fleet(options.devices, options.fanout, options.nxos,
+                        options.macs, options.auth_failures, options.seed)
+
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, name='fleet', daemon=True,
+                                     args=(fleet, options, ready, stop))
+    server.start()
+    if not ready.wait(120):
+        server.terminate()
+        raise RuntimeError('The fleet did not start listening')
+
+    try:
+        start = time.time()
+        core.normal_run(target=fleet[0].ip, netmiko_platform='cisco_ios',
+                        clean=True)
+        seconds = time.time() - start
+
+        # Reap the crawl processes, so that they count as children
+        for p in multiprocessing.active_children():
+            if p is not server: p.join(30)
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        crawl_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    finally:
+        stop.set()
+        server.join(30)
+        if server.is_alive(): server.terminate()
+
+    fleet_cpu = _cpu(resource.getrusage(resource.RUSAGE_CHILDREN)) - _cpu(crawl_usage)
+
+    device_db = io_sql.device_db()
+    crawled = device_db.count('devices')
+    device_db.close()
+
+    if options.keep: print('Kept the run directory [{}]'.format(tmp))
+    else: shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        'options': vars(options),
+        'devices': len(fleet),
+        'reachable': reachable(fleet),
+        'crawled': crawled,
+        'seconds': round(seconds, 3),
+        'devices_per_second': round(crawled / seconds, 3),
+        'cpu_seconds': {'main': round(_cpu(self_usage), 3),
+                        'children': round(_cpu(crawl_usage), 3),
+                        'fleet': round(fleet_cpu, 3)},
+        # ru_maxrss is in KB, and the largest single child for children
+        'max_rss_mb': {'main': round(self_usage.ru_maxrss / 1024, 1),
+                       'children': round(crawl_usage.ru_maxrss / 1024, 1)},
+        'metrics': metrics.summary(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark normal_run against a simulated fleet')
+    parser.add_argument('-n', type=int, default=50, dest='devices',
+                        help='Devices in the fleet')
+    parser.add_argument('--fanout', type=int, default=3,
+                        help='CDP neighbors below each device')
+    parser.add_argument('--nxos', type=float, default=0.2,
+                        help='Share of NX-OS devices')
+    parser.add_argument('--macs', type=int, default=50,
+                        help='MAC addresses on each device')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Mean seconds before each command returns')
+    parser.add_argument('--auth-failures', type=float, default=0,
+                        help='Share of devices which reject every login')
+    parser.add_argument('--drops', type=float, default=0,
+                        help='Chance of a session being cut at each command')
+    parser.add_argument('--transport', choices=('ssh', 'telnet'), default='ssh',
+                        help='How IOS devices are served')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--keep', action='store_true',
+                        help="Keep the run's logs and outputs")
+    args = parser.parse_args()
+
+    if not 0 < args.devices < 65000: parser.error('-n must be 1 to 64999')
+
+    results = run(args)
+
+    print('{:<24}{:>12}'.format('Devices', results['devices']))
+    print('{:<24}{:>12}'.format('Reachable', results['reachable']))
+    print('{:<24}{:>12}'.format('Crawled', results['crawled']))
+    print('{:<24}{:>12.1f}'.format('Seconds', results['seconds']))
+    print('{:<24}{:>12.2f}'.format('Devices/second', results['devices_per_second']))
+    for k, v in results['cpu_seconds'].items():
+        print('{:<24}{:>12.1f}'.format('CPU seconds, ' + k, v))
+    for k, v in results['max_rss_mb'].items():
+        print('{:<24}{:>12.1f}'.format('Peak RSS (MB), ' + k, v))
+
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(results, outfile, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+'''
+Micro-benchmarks for the functions a crawl spends most of its time
+in: the config, interface, CDP and MAC table parsers, interface
+lookups, the util and MAC tools helpers, and device_db.add_device_nd.
+
+Each case is timed at several scales, where the scale is the number
+of interfaces, MAC addresses, CDP neighbors or calls. The inputs are
+generated with benchmarks.fleet, so a scale always gives the same
+input. Results can be written as JSON, and compared with the results
+of another version.
+
+device_db.add_device_nd writes to the bench_micro database, on the
+Postgres server configured for netcrawl.
+
+Usage::
+
+    python -m benchmarks.micro_bench [--scales 100,1000,10000,100000]
+        [--repeat N] [--cases REGEX] [--json PATH] [--compare PATH]
+'''
+
+import argparse, json, platform, random, re, shutil, tempfile, time
+
+from netcrawl import config, io_sql, util
+from netcrawl.devices import CiscoDevice, IosDevice, NxosDevice
+from netcrawl.tools import mac_audit
+from netcrawl.tools.manuf.manuf import MacParser
+
+from . import fleet
+
+
+SCALES = (100, 1000, 10000, 100000)
+
+
+def _sim(ports=0, macs=0, nxos=False):
+    '''Returns a fleet.sim_device with this many ports and MACs'''
+    device = fleet.sim_device(0, nxos=nxos, auth_fails=False,
+                              serial='FOC00000000')
+    device.ports = ports
+    device.macs = macs
+    return device
+
+
+def _ios_device(ports):
+    device = IosDevice(ip='127.10.0.1')
+    device.config = _sim(ports).output('show run')
+    return device
+
+
+def _ip_pairs(scale):
+    '''Returns (ip, subnet) pairs spread over 256 subnets'''
+    return [('10.{}.{}.{}'.format(i % 256, (i >> 8) % 256, i % 250 + 1),
+             ('255.255.255.0', '/24', '255.255.252.0')[i % 3])
+            for i in range(scale)]
+
+
+def _macs(scale, seed=0):
+    rng = random.Random(seed)
+    output = []
+    for _ in range(scale):
+        mac = '{:012x}'.format(rng.getrandbits(48))
+        output.append('.'.join((mac[:4], mac[4:8], mac[8:])))
+    return output
+
+
+# Each case takes a scale and prepares its input, and returns the
+# function to time, and a function to run after it (or None)
+
+def ios_get_interfaces(scale):
+    device = _ios_device(scale)
+    return device._get_interfaces, None
+
+
+def nxos_parse_interfaces(scale):
+    raw = json.loads(_sim(scale, nxos=True).output('show interface | json'))
+    device = NxosDevice(ip='127.10.0.1')
+    return lambda: device._parse_interfaces(raw), None
+
+
+def nxos_get_interfaces_config(scale):
+    device = NxosDevice(ip='127.10.0.1')
+    device.config = _sim(scale, nxos=True).output('show run')
+    return device.get_interfaces_config, None
+
+
+def parse_mac_address_table(scale):
+    device = _ios_device(fleet.PORTS)
+    device._get_interfaces()
+    raw = _sim(fleet.PORTS, macs=scale).output('show mac address-table')
+    return lambda: device._parse_mac_address_table(raw), None
+
+
+def parse_neighbor(scale):
+    root = fleet.build_fleet(scale + 1, fanout=scale, nxos=0.2)[0]
+    entries = [x for x in re.split(r'-{4,}', root.output('show cdp neighbor detail'))
+               if x.strip()]
+    device = CiscoDevice(ip=root.ip)
+    return lambda: [device.parse_neighbor(x) for x in entries], None
+
+
+def match_partial_to_full_interface(scale):
+    device = _ios_device(scale)
+    device._get_interfaces()
+    sim = _sim(scale)
+    names = [sim.port(i, short=True) for i in range(1, scale + 1)]
+
+    # Time building the lookup index along with the lookups
+    device._interface_index = None
+    return lambda: [device.match_partial_to_full_interface(x) for x in names], None
+
+
+def network_ip(scale):
+    pairs = _ip_pairs(scale)
+    util._subnet_mask.cache_clear()
+    return lambda: [util.network_ip(*x) for x in pairs], None
+
+
+def ucase_letters(scale):
+    macs = _macs(scale)
+    return lambda: [util.ucase_letters(x) for x in macs], None
+
+
+_mac_parser = None
+
+def mac_parser_search(scale):
+    global _mac_parser
+    if _mac_parser is None: _mac_parser = MacParser()
+
+    macs = [x.replace('.', '') for x in _macs(scale)]
+    return lambda: [_mac_parser.search(x) for x in macs], None
+
+
+def evaluate_mac(scale):
+    pairs = list(zip(_macs(scale, seed=1), _macs(scale, seed=2)))
+    return lambda: [mac_audit.evaluate_mac(*x) for x in pairs], None
+
+
+_device_db = None
+
+def add_device_nd(scale):
+    '''A device with scale interfaces, and scale MACs on them'''
+    global _device_db
+    if _device_db is None:
+        config.cc.inventory.name = 'bench_micro'
+        _device_db = io_sql.device_db(clean=True)
+
+    device = _ios_device(scale)
+    device.device_name = 'bench-00000'
+    device._get_interfaces()
+    device._parse_mac_address_table(
+        _sim(scale, macs=scale).output('show mac address-table'))
+
+    ids = []
+    return (lambda: ids.append(_device_db.add_device_nd(device)),
+            lambda: [_device_db.delete_device_record(x) for x in ids])
+
+
+CASES = [
+    ('IosDevice._get_interfaces', ios_get_interfaces),
+    ('NxosDevice._parse_interfaces', nxos_parse_interfaces),
+    ('NxosDevice.get_interfaces_config', nxos_get_interfaces_config),
+    ('CiscoDevice._parse_mac_address_table', parse_mac_address_table),
+    ('CiscoDevice.parse_neighbor', parse_neighbor),
+    ('CiscoDevice.match_partial_to_full_interface', match_partial_to_full_interface),
+    ('util.network_ip', network_ip),
+    ('util.ucase_letters', ucase_letters),
+    ('MacParser.search', mac_parser_search),
+    ('mac_audit.evaluate_mac', evaluate_mac),
+    ('device_db.add_device_nd', add_device_nd),
+    ]
+
+
+def run(scales=SCALES, repeat=3, cases=None):
+    '''Times each case at each scale, preparing its input again for
+    each repetition.
+
+    Keyword Args:
+        scales (tuple): Of int
+        repeat (int): Times each case is run at each scale
+        cases (str): A regex. Only cases whose name matches it run.
+
+    Returns:
+        list: Of dicts with the case, scale, and best and mean time of
+            the case in seconds, and the best time per item in
+            microseconds
+    '''
+    results = []
+    for name, setup in CASES:
+        if cases and not re.search(cases, name): continue
+
+        for scale in scales:
+            times = []
+            for _ in range(repeat):
+                fn, after = setup(scale)
+
+                start = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - start)
+
+                if after: after()
+
+            results.append({'case': name,
+                            'scale': scale,
+                            'best': min(times),
+                            'mean': sum(times) / len(times),
+                            'per_item_us': min(times) / scale * 1e6})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of netcrawl')
+    parser.add_argument('--scales', default=','.join(str(x) for x in SCALES),
+                        help='Comma separated numbers of items')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each case at each scale')
+    parser.add_argument('--cases', help='Only run cases matching this regex')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--compare', help='Results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    config.parse_config()
+    scales = [int(x) for x in args.scales.split(',')]
+
+    # Don't print anything, and write the log lines which are still
+    # written (and anything else a case saves) to a scratch directory
+    # instead of the user's run directory
+    config.cc.verbosity = 0
+    config.cc.timing_logs = False
+
+    tmp = tempfile.mkdtemp(prefix='netcrawl-micro-')
+    config.cc.run_path = tmp
+    config.cc.devices_path = tmp + '/devices'
+    config.cc.archive_path = tmp + '/archive'
+    config.cc.log_path = tmp + '/log.txt'
+    config.cc.json_log_path = tmp + '/log.jsonl'
+    config.cc.metrics_path = tmp + '/metrics.json'
+    config.cc.sql_slow_path = tmp + '/slow_sql.jsonl'
+
+    try: results = run(scales, args.repeat, args.cases)
+    finally: shutil.rmtree(tmp, ignore_errors=True)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as infile:
+            for r in json.load(infile)['results']:
+                baseline[(r['case'], r['scale'])] = r['per_item_us']
+
+    print('{:<46}{:>8}{:>12}{:>12}{:>10}'.format(
+        'case', 'scale', 'best (s)', 'us/item', 'vs old'))
+    for r in results:
+        old = baseline.get((r['case'], r['scale']))
+        print('{:<46}{:>8}{:>12.4f}{:>12.2f}{:>10}'.format(
+            r['case'], r['scale'], r['best'], r['per_item_us'],
+            '{:.2f}x'.format(old / r['per_item_us']) if old else ''))
+
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump({'python': platform.python_version(),
+                       'time': time.strftime(config.cc.pretty_time),
+                       'repeat': args.repeat,
+                       'results': results}, outfile, indent=4)
+
+
+if __name__ == '__main__':
+    main()
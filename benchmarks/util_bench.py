@@ -0,0 +1,108 @@
+'''
+Micro-benchmarks for the normalization functions in netcrawl.util,
+compared with the implementations they replaced.
+
+Usage::
+
+    python -m benchmarks.util_bench [-n NUMBER]
+'''
+
+import argparse, re, timeit
+
+from netaddr import IPNetwork
+
+from netcrawl import util
+
+
+# The previous implementations, kept here for comparison
+def legacy_ucase_letters(raw_input):
+    return ''.join([x.upper() for x in raw_input if re.match(r'\w', x)])
+
+
+def legacy_clean_ip(ip):
+    return ''.join([x for x in ip if re.match(r'[\d\.]', x)])
+
+
+def legacy_is_ip(raw_input):
+    return bool(re.match(r'''
+        (?:
+            (?:
+                25[0-5]|          # Match 250-255
+                2[0-4][0-9]|      # Match 200-249
+                [01]?[0-9][0-9]?  # Match 0-199
+            )
+            (?:\.|\b)             # Followed by a . or a word boundry
+        ){4}                      # Repeat that four times
+        ''', raw_input, re.X))
+
+
+def legacy_parse_ip(raw_input):
+    return re.findall(r'''
+        \b                        # Start at a word boundry
+        (?:
+            (?:
+                25[0-5]|          # Match 250-255
+                2[0-4][0-9]|      # Match 200-249
+                [01]?[0-9][0-9]?  # Match 0-199
+            )
+            (?:\.|\b)             # Followed by a . or a word boundry
+        ){4}                      # Repeat that four times
+        \b                        # End at a word boundry
+        ''', raw_input, re.X)
+
+
+def legacy_network_ip(ip, subnet):
+    if not legacy_is_ip(subnet): subnet = util.cidr_to_netmask(subnet)
+    return str(IPNetwork('{}/{}'.format(ip, subnet)).network)
+
+
+CDP_ENTRY = '''Device ID: core-01.example.com
+Entry address(es):
+  IP address: 10.0.0.1
+Platform: cisco WS-C6509-E,  Capabilities: Router Switch IGMP
+Interface: GigabitEthernet1/0/1,  Port ID (outgoing port): GigabitEthernet4/1
+Management address(es):
+  IP address: 10.0.0.1
+'''
+
+# (name, new function, old function, arguments)
+CASES = [
+    ('ucase_letters', util.ucase_letters, legacy_ucase_letters, ('0011.2233.44aa',)),
+    ('clean_ip', util.clean_ip, legacy_clean_ip, (' 10.20.30.40\t',)),
+    ('is_ip', util.is_ip, legacy_is_ip, ('10.20.30.40',)),
+    ('parse_ip', util.parse_ip, legacy_parse_ip, (CDP_ENTRY,)),
+    ('network_ip', util.network_ip, legacy_network_ip, ('10.20.30.40', '255.255.252.0')),
+    ]
+
+
+def run(number=20000):
+    '''Times each case and returns a list of
+    (name, new seconds, old seconds) tuples'''
+
+    results = []
+    for name, new, old, args in CASES:
+        assert new(*args) == old(*args), name
+
+        t_new = timeit.timeit(lambda: new(*args), number=number)
+        t_old = timeit.timeit(lambda: old(*args), number=number)
+        results.append((name, t_new, t_old))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark netcrawl.util')
+    parser.add_argument('-n', type=int, default=20000, dest='number',
+                        help='Calls per function')
+    args = parser.parse_args()
+
+    print('{:<16}{:>12}{:>12}{:>10}'.format('function', 'new (us)', 'old (us)', 'speedup'))
+    for name, t_new, t_old in run(args.number):
+        print('{:<16}{:>12.2f}{:>12.2f}{:>9.1f}x'.format(
+            name,
+            t_new / args.number * 1e6,
+            t_old / args.number * 1e6,
+            t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
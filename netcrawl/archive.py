@@ -0,0 +1,146 @@
+'''
+Content addressed archive for the raw output collected from devices.
+
+Each crawl used to write the config of every device to a new file,
+even when it hadn't changed since the last crawl. Here every output
+(config, inventory, CDP and MAC table) is stored once as a gzipped
+blob named after the SHA-256 of its text, under
+config.cc.archive_path. Each device has an index file in its
+directory under config.cc.devices_path, with one line per output per
+crawl::
+
+    20170419_031500    config    9f86d081884c7d65...
+
+so an output which hasn't changed only costs an index line.
+'''
+
+from datetime import datetime
+import gzip, hashlib, os, tempfile
+
+from . import config
+from .wylog import log, logging
+
+
+# Name of the index file in each device's directory
+INDEX = 'index.tsv'
+
+
+def digest(text):
+    '''Returns the SHA-256 hex digest which names a blob'''
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def blob_path(key):
+    '''Returns the file that the blob with this digest is stored in.
+    Blobs are spread over 256 directories by their first two characters.'''
+    return os.path.join(config.cc.archive_path, key[:2], key[2:] + '.gz')
+
+
+def put(text):
+    '''Stores text in the archive, unless it is there already.
+
+    Returns:
+        str: The digest of the text, to read it back with get()
+    '''
+    proc = 'archive.put'
+
+    key = digest(text)
+    path = blob_path(key)
+
+    if os.path.exists(path):
+        log('Blob [{}] is already archived', key[:12], proc=proc, v=logging.D)
+        return key
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first, so that a blob is never seen
+    # half written by another process
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(gzip.compress(text.encode('utf-8'),
+                                        config.cc.archive_compression))
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+    log('Archived blob [{}]', key[:12], proc=proc, v=logging.D)
+    return key
+
+
+def get(key):
+    '''Returns the text of an archived blob.
+
+    Raises:
+        FileNotFoundError: If no blob has this digest
+    '''
+    with open(blob_path(key), 'rb') as infile:
+        return gzip.decompress(infile.read()).decode('utf-8')
+
+
+def record(unique_name, outputs, when=None):
+    '''Archives the outputs collected from a device during one crawl,
+    and adds them to the device's index.
+
+    Args:
+        unique_name (str): The device's directory name
+        outputs (dict): Output text by kind, e.g. {'config': ...}.
+            Empty outputs are left out.
+
+    Keyword Args:
+        when (datetime): The time of the crawl. Default is now.
+
+    Returns:
+        dict: The digest of each archived output, by kind
+    '''
+    proc = 'archive.record'
+
+    if when is None: when = datetime.now()
+    stamp = when.strftime(config.cc.file_time)
+
+    keys = {}
+    for kind, text in outputs.items():
+        if text: keys[kind] = put(text)
+
+    path = os.path.join(config.cc.devices_path, unique_name)
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, INDEX), 'a') as outfile:
+        outfile.write(''.join('{}\t{}\t{}\n'.format(stamp, kind, key)
+                              for kind, key in keys.items()))
+
+    log('Recorded [{}] outputs for [{}]', len(keys), unique_name,
+        proc=proc, v=logging.I)
+    return keys
+
+
+def history(unique_name, kind=None):
+    '''Returns the index of a device, oldest first.
+
+    Keyword Args:
+        kind (str): Only return entries for this kind of output
+
+    Returns:
+        list: Of (time, kind, digest) tuples, with the time formatted
+            as config.cc.file_time. Empty if nothing was archived.
+    '''
+    path = os.path.join(config.cc.devices_path, unique_name, INDEX)
+    if not os.path.exists(path): return []
+
+    output = []
+    with open(path) as infile:
+        for line in infile:
+            entry = tuple(line.rstrip('\n').split('\t'))
+            if len(entry) != 3: continue
+            if kind is None or entry[1] == kind: output.append(entry)
+    return output
+
+
+def latest(unique_name, kind):
+    '''Returns the most recently archived output of a kind for a
+    device, or None if there is none.'''
+
+    entries = history(unique_name, kind)
+    if not entries: return None
+    return get(entries[-1][2])
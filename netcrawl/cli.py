@@ -4,19 +4,24 @@ Created on Feb 28, 2017
 @author: Wyko
 '''
 
+import time
+
 from netmiko import NetMikoAuthenticationException
-from netmiko import NetMikoTimeoutException
 
 from netcrawl import config
-from netcrawl.util import port_is_open
-from netcrawl.wylog import log, logging
+from netcrawl.retry import retry_policy, breaker
+from netcrawl.util import port_is_open, step_timer
+from netcrawl.wylog import log, log_snip, logging, metrics
 
 
 def connect(handler=None,
             netmiko_platform=None,
             ip=None,
             cred=None,
-            port=None):
+            port=None,
+            deadline=None,
+            transport=None,
+            history=None):
     """
     Starts a CLI session with a remote device. 
     
@@ -25,6 +30,10 @@ def connect(handler=None,
     will attempt each credential specified in the cred argument (if specified) or the 
     config.cc.credentials list otherwise.
     
+    If the device's history is known, the transport which worked last time is
+    tried first. Ports are only probed right before they are used, so a device
+    which answers on its preferred transport is never probed on the other one.
+    
     Keyword Args:
         cred (dict): If supplied, this method will only use the specified credential. 
             Uses the config.cc.credentials list otherwise. 
@@ -34,6 +43,13 @@ def connect(handler=None,
         handler (ConnectHandler): A Netmiko-type handler to use. Currently using
             one of Netmiko.ConnectHandler, Netmiko.ssh_autodetect.SSHDetect. 
             Uses Netmiko.ConnectHandler by default.
+        deadline (float): A time.time() value after which no more login 
+            attempts will be started
+        transport (str): The transport to try first, 'ssh' or 'telnet'. 
+            Usually the last successful transport from the inventory.
+        history (dict): The last known port states, as {'tcp_22': bool, 
+            'tcp_23': bool}. Used to fill in ports which were not probed, 
+            and to prefer telnet on devices known not to have SSH.
     
     Returns:
         dict: A dict containing:
@@ -44,6 +60,11 @@ def connect(handler=None,
             - **username** (*str*): The first successful credential's username
             - **password** (*str*): The first successful credential's password
             - **cred_type** (*str*): The first successful credential's type 
+            - **transport** (*str*): The transport used, 'ssh' or 'telnet'
+            - **timings** (*dict*): Seconds spent on the 'tcp_probe' and the 'login'.
+              'login' covers the SSH handshake and authentication together:
+              Netmiko opens SSH sessions with a single paramiko 
+              SSHClient.connect() call, which does both before it returns.
             
     Raises:
         IOError: If a connection could not be established
@@ -51,17 +72,24 @@ def connect(handler=None,
     """
     proc = 'cli.connect'
     
-    log('Connecting to %s device %s' % (netmiko_platform, ip), ip=ip, proc=proc, v=logging.I)
+    log('Connecting to {} device {}', netmiko_platform, ip, ip=ip, proc=proc, v=logging.I)
     
     assert isinstance(ip, str), proc + ': Ip [{}] is not a string.'.format(type(ip)) 
     
+    # Don't waste time on a host which keeps failing
+    breaker(ip).check()
+    
+    if not history: history = {}
+    
     result = {
-            'tcp_22': port_is_open(22, ip),
-            'tcp_23': port_is_open(23, ip),
+            'tcp_22': history.get('tcp_22'),
+            'tcp_23': history.get('tcp_23'),
             'connection': None,
             'username': None,
             'password': None,
             'cred_type': None,
+            'transport': None,
+            'timings': {},
             }
     
     # Error checking        
@@ -69,81 +97,112 @@ def connect(handler=None,
         assert isinstance(cred, dict), 'Cred is type [{}]. Should be dict.'.format(type(cred))
     else:
         assert len(config.cc.credentials) > 0, 'No credentials available'
-    if port: assert port is 22 or port is 23, 'Invalid port number [{}]. Should be 22 or 23.'.format(str(port))
+    if port: assert port == 22 or port == 23, 'Invalid port number [{}]. Should be 22 or 23.'.format(str(port))
 
 
     # Switch between global creds or argument creds
-    if cred: _credList = cred
+    if cred: _credList = [cred]
     else: _credList = config.cc.credentials
     
-    # Check to see if SSH (port 22) is open
-    if not result['tcp_22']:
-        log('Port 22 is closed on %s' % ip, ip=ip, proc=proc, v=logging.I)
-    elif port is None or port is 22: 
-        # Try wylog in with each credential we have
-        for cred in _credList:
+    methods = [
+        ('ssh', 22, netmiko_platform, 'SSH'),
+        ('telnet', 23, netmiko_platform + '_telnet', 'Telnet'),
+        ]
+    
+    # Devices which have only ever answered on telnet go telnet first
+    if (transport == 'telnet' or 
+        (transport is None and 
+         history.get('tcp_22') is False and 
+         history.get('tcp_23'))):
+        methods.reverse()
+    
+    for _transport, _port, device_type, method in methods:
+        if port is not None and port != _port: continue
+        
+        # Check to see if the port is open
+        with log_snip('cli.port_is_open'), step_timer(result['timings'], 'tcp_probe'):
+            result['tcp_{}'.format(_port)] = port_is_open(_port, ip)
+        if not result['tcp_{}'.format(_port)]:
+            log('Port {} is closed on {}', _port, ip, ip=ip, proc=proc, v=logging.I)
+            continue
+        
+        # Handshake and authentication can't be timed apart through
+        # Netmiko, so both go in one step
+        with log_snip('cli._login'), step_timer(result['timings'], 'login'):
+            connected = _login(handler, device_type, ip, _credList, result, 
+                               method, deadline)
+        if connected:
+            result['transport'] = _transport
+            return result
+    
+    raise IOError(proc + ': CLI connection to [{}] failed'.format(ip))
+
+
+def _login(handler, device_type, ip, creds, result, method, deadline=None):
+    '''Tries each credential against a device using one connection method.
+    
+    Authentication failures move on to the next credential straight away.
+    Timeouts are retried according to the retry policy, and any other
+    error stops the attempt, since the remaining credentials would
+    fail the same way.
+    
+    Args:
+        handler (ConnectHandler): A Netmiko-type handler to use
+        device_type (str): The Netmiko device type to connect with
+        ip (str): The IP address to connect to
+        creds (list): The credentials to try, in order
+        result (dict): The cli.connect result dict to populate
+        method (str): The name of the connection method, for logging
+        deadline (float): A time.time() value after which no more 
+            attempts will be started
+    
+    Returns:
+        bool: True if a connection was established
+    '''
+    proc = 'cli._login'
+    
+    policy = retry_policy(host=ip, proc=proc, deadline=deadline)
+    
+    for cred in creds:
+        while True:
+            if deadline and time.time() >= deadline:
+                log('Connection deadline reached', ip=ip, proc=proc, v=logging.A)
+                return False
+            
             try:
                 # Establish a connection to the device
                 result['connection'] = handler(
-                    device_type=netmiko_platform,
+                    device_type=device_type,
                     ip=ip,
                     username=cred['username'],
                     password=cred['password'],
                     secret=cred['password'],
                 )
                 
-                result['username'] = cred['username']
-                result['password'] = cred['password']
-                result['cred_type'] = cred['cred_type']
-                
-                log('Successful ssh auth to %s using %s, %s' % (ip, cred['username'], cred['password'][:2]), ip=ip, proc=proc, v=logging.N)
-                
-                return result
-    
             except NetMikoAuthenticationException:
-                log ('SSH auth error to %s using %s, %s' % (ip, cred['username'], cred['password'][:2]), ip=ip, proc=proc, v=logging.A)
-                continue
-            except NetMikoTimeoutException:
-                log('SSH to %s timed out.' % ip, ip=ip, proc=proc, v=logging.A)
-                # If the device is unavailable, don't try any other credentials
+                metrics.count('cli.auth_rejected')
+                log('%s auth error to %s using %s, %s' % (method, ip, cred['username'], cred['password'][:2]), ip=ip, proc=proc, v=logging.A)
                 break
+            
             except Exception as e:
-                log('SSH to [{}] failed due to [{}] error: [{}]'.format(ip, type(e).__name__, str(e)))
-                break
-    
-    # Check to see if port 23 (telnet) is open
-    if not result['tcp_23']:
-        log('Port 23 is closed on %s' % ip, ip=ip, proc=proc, v=logging.I)
-    elif port is None or port is 23:
-        for cred in _credList:
-            try:
-                # Establish a connection to the device
-                result['connection'] = handler(
-                    device_type=netmiko_platform + '_telnet',
-                    ip=ip,
-                    username=cred['username'],
-                    password=cred['password'],
-                    secret=cred['password'],
-                )
+                metrics.count('cli.auth_error')
+                log('{} to [{}] failed due to [{}] error: [{}]'.format(
+                    method, ip, type(e).__name__, str(e)), ip=ip, proc=proc, v=logging.A)
+                
+                # Retry transient errors with the same credential
+                if policy.retry(e): continue
                 
+                # If the device is unavailable, don't try any other credentials
+                return False
+            
+            else:
                 result['username'] = cred['username']
                 result['password'] = cred['password']
                 result['cred_type'] = cred['cred_type']
-                log('Successful ssh auth to %s using %s, %s' % (ip, cred['username'], cred['password'][:2]), ip=ip, proc=proc, v=logging.N)
+                metrics.count('cli.auth_success')
                 
-                return result
-            
-            except NetMikoAuthenticationException:
-                log('Telnet auth error to %s using %s, %s' % 
-                    (ip, cred['username'], cred['password'][:2]), ip=ip, v=logging.A, proc=proc)
-                continue
-            except NetMikoTimeoutException:
-                log('Telnet to %s timed out.' % ip, ip=ip, proc=proc, v=logging.A)
-                # If the device is unavailable, don't try any other credentials
-                break
-            except Exception as e:
-                log('Telnet to [{}] failed due to [{}] error: [{}]'.format(ip, type(e).__name__, str(e)),
-                    ip=ip, proc=proc, v=logging.A)
-                break
+                log('Successful %s auth to %s using %s, %s' % (method, ip, cred['username'], cred['password'][:2]), ip=ip, proc=proc, v=logging.N)
+                breaker(ip).success()
+                return True
     
-    raise IOError(proc + ': CLI connection to [{}] failed'.format(ip))
+    return False
@@ -38,6 +38,46 @@ class Config:
         # Whether or not to process debug messages
         self.debug= False
         
+        # Log lines are written in batches of up to log_batch lines, 
+        # and at least every log_flush_interval seconds, while a log 
+        # sink runs (see wylog.sink)
+        self.log_batch= 256
+        self.log_flush_interval= 1.0
+        
+        # 'text' writes log lines to log_path. 'json' writes one JSON 
+        # object per line to json_log_path instead, with the crawl, 
+        # device and worker each line came from (see wylog.logging).
+        self.log_format= 'text'
+        
+        # Log files are rotated and gzipped once they grow past this
+        # many bytes. 0 never rotates them. Only the log sink (see 
+        # wylog.sink) rotates, so logs written without one, e.g. by
+        # the tools, are never rotated.
+        self.log_max_bytes= 100 * 1024 * 1024
+        
+        # logf and log_snip record how long every call takes (see
+        # wylog.metrics), and the totals of a run are written to 
+        # metrics_path. With timing_logs, each call is logged as well.
+        self.timing_logs= True
+        
+        # normal_run serves its metrics over HTTP on this port while
+        # it runs (see netcrawl.telemetry). None turns it off.
+        self.metrics_port= None
+        self.metrics_host= '127.0.0.1'
+        
+        # Profile every process of a normal_run, and merge the results
+        # into profile_path (see netcrawl.profiling)
+        self.profile= False
+        
+        # Every SQL statement is timed by its template (see 
+        # io_sql.timed_connection). Statements slower than 
+        # sql_slow_threshold seconds are written to sql_slow_path with
+        # their parameters and plan, and normal_run logs the 
+        # sql_summary_size costliest templates when it ends. None and
+        # 0 turn these off.
+        self.sql_slow_threshold= 0.5
+        self.sql_summary_size= 10
+        
         # Raise errors encountered during device processing
         self.raise_exceptions= False
         
@@ -51,7 +91,88 @@ class Config:
 
         # The amount the delay increases on failed attempts
         self.delay_increase= 0.3
-    
+
+        # Number of retries allowed for each class of error
+        # (see netcrawl.retry). Retrying a rejected login won't
+        # fix it, so auth errors get no retries.
+        self.retry_budgets= {
+            'auth': 0,
+            'timeout': 2,
+            'prompt': 2,
+            'empty': 2,
+            'invalid': 1,
+            'unknown': 1,
+            }
+
+        # Jittered exponential backoff between retries, in seconds
+        self.retry_base_delay= 0.5
+        self.retry_max_delay= 8
+
+        # Consecutive failures before a host is given up on, and
+        # the number of seconds before it is tried again
+        self.circuit_threshold= 3
+        self.circuit_reset= 300
+
+        # The most time (in seconds) that may be spent polling one
+        # device, and on each phase of polling it. When time runs out
+        # the session is cut and the device is returned as partial.
+        # 0 or None disables the limit.
+        self.device_timeout= 600
+        self.phase_timeouts= {
+            'connect': 120,
+            'mandatory': 300,
+            'optional': 300,
+            }
+
+        # Which optional collectors run on each device, and every how
+        # many crawls (see netcrawl.devices.profiles). 1 runs the 
+        # collector on every crawl, 0 never runs it.
+        self.collection_profile= 'full'
+        self.collection_profiles= {
+            'full': {'serials': 1, 'other_ips': 1, 'cdp': 1, 'mac': 1},
+            'topology': {'serials': 0, 'other_ips': 1, 'cdp': 1, 'mac': 0},
+            'inventory': {'serials': 1, 'other_ips': 1, 'cdp': 1, 'mac': 0},
+            'nightly': {'serials': 7, 'other_ips': 1, 'cdp': 1, 'mac': 7},
+            }
+        
+        # Per platform or role changes to the profile. Keys are either 
+        # a netmiko_platform or a regex matched against the device name,
+        # e.g. {'cisco_nxos': {'mac': 0}, '-core-': {'mac': 0}}
+        self.collection_overrides= {}
+        
+        # The number of the current crawl, used to schedule collectors
+        # which don't run on every crawl. 0 outside of a crawl, where
+        # every collector which isn't turned off runs.
+        self.run_number= 0
+
+        # Keep the raw output of parsed commands (interface configs,
+        # CDP and MAC tables) on devices, and in the database. Turning
+        # this off makes results smaller to send between processes.
+        self.keep_raw_output= True
+
+        # Processes which parse the output fetched by the crawl workers
+        # (see core.normal_run), so that parsing doesn't compete with
+        # the workers waiting on devices. None starts one per CPU, 0
+        # parses in the crawl workers once their session is closed.
+        self.parse_workers= None
+        
+        # Skip parsing and storing devices whose collected output is 
+        # the same as in the last crawl, and only mark them as seen
+        self.skip_unchanged= True
+
+        # Daemon mode keeps warm sessions to recently polled devices
+        # (see netcrawl.session_pool). pool_max_rss is the process
+        # memory (in MB) above which sessions are evicted; 0 disables it.
+        # pool_keepalive is the idle time in seconds before a keepalive.
+        self.pool_max_sessions= 64
+        self.pool_keepalive= 60
+        self.pool_max_rss= 0
+
+        # Seconds between MAC table refreshes in daemon mode, and the
+        # number of devices refreshed at once
+        self.daemon_interval= 900
+        self.daemon_threads= 16
+
         self.root_path= os.path.join(os.path.expanduser('~'))
             
         self.run_folder= 'netcrawl'
@@ -59,7 +180,16 @@ class Config:
         
         self.devices_path= os.path.join(self.run_path, 'devices')
         
+        # Raw device output is archived here, compressed with this 
+        # gzip level (see netcrawl.archive)
+        self.archive_path= os.path.join(self.run_path, 'archive')
+        self.archive_compression= 6
+        
         self.log_path= os.path.join(self.run_path, 'log.txt')
+        self.json_log_path= os.path.join(self.run_path, 'log.jsonl')
+        self.metrics_path= os.path.join(self.run_path, 'metrics.json')
+        self.profile_path= os.path.join(self.run_path, 'profile')
+        self.sql_slow_path= os.path.join(self.run_path, 'slow_sql.jsonl')
         
         self.vault_path= os.path.join(self.run_path, 'vault')
         
@@ -1,12 +1,17 @@
-import queue, multiprocessing, traceback, json
-import sys, argparse, textwrap 
+import queue, multiprocessing, traceback, json, collections
+import sys, argparse, textwrap, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from prettytable import PrettyTable
 from time import sleep
 
-from . import config, io_sql
+from . import config, io_sql, profiling, telemetry
 from .tools import mac_audit
 from .credentials import menu
-from .device_dispatcher import create_instantiated_device
-from .wylog import logging, log, logf
+from .device_dispatcher import create_instantiated_device, CLASS_MAPPER
+from .devices import profiles
+from .session_pool import session_pool
+from .wylog import logging, log, logf, log_snip, lazy, metrics, sink
+from .wylog import context, set_context, clear_context
 
 
 @logf
@@ -17,6 +22,17 @@ def normal_run(**kwargs):
     # Connect to the databases
     main_db = io_sql.main_db(**kwargs)
     device_db = io_sql.device_db(**kwargs)
+    
+    # Number the crawl so that collectors which don't run every
+    # time can be scheduled. Must be set before the workers start.
+    if kwargs.get('collection_profile'):
+        config.cc.collection_profile = kwargs['collection_profile']
+    
+    # Raises KeyError for an unknown profile before any device is polled
+    profiles.get_profile()
+    config.cc.run_number = device_db.start_run(config.cc.collection_profile)
+    log('Run [{}] using collection profile [{}]'.format(
+        config.cc.run_number, config.cc.collection_profile), proc=proc, v=logging.N)
 
     # Add the seed device if a target was specified  
     if ('target' in kwargs) and (kwargs['target'] is not None):
@@ -28,17 +44,49 @@ def normal_run(**kwargs):
             ip_list=[kwargs['target']],
             netmiko_platform=kwargs.get('netmiko_platform', 'unknown'))
 
+    # Bind the metrics endpoint before any worker starts, so a port
+    # which is in use fails the run without leaving workers behind
+    server = None
+    if config.cc.metrics_port is not None: server = telemetry.start()
+    
+    # All processes log through one writer
+    log_queue = sink.start()
+    
+    # The workers and parse processes profile themselves if this is set
+    if config.cc.profile:
+        profiling.clear()
+        profiling.start('coordinator')
+    
     # Set the number of sub-processes
     num_workers = multiprocessing.cpu_count() * 16
+    parse_workers = config.cc.parse_workers
+    if parse_workers is None: parse_workers = multiprocessing.cpu_count()
         
     # Establish communication queues
     tasks = multiprocessing.JoinableQueue(num_workers * 2)
     results = multiprocessing.Queue()
     
-    # Create workers and start them
-    workers = [worker(tasks, results) for i in range(num_workers)]
+    # Create workers and start them. With a parse pool, the workers
+    # only fetch the raw output and hand it back for parsing.
+    workers = [worker(tasks, results, fetch_only=bool(parse_workers),
+                      log_queue=log_queue) 
+               for i in range(num_workers)]
     for w in workers: w.start()
     
+    parser = None
+    if parse_workers:
+        parser = ProcessPoolExecutor(parse_workers, 
+                                     initializer=_init_parser,
+                                     initargs=(config.cc, log_queue))
+    
+    # Results which are being parsed
+    parsing = set()
+    
+    # Devices handed to the workers and not returned yet, and the 
+    # times at which devices were returned in the last minute
+    in_flight = 0
+    finished = collections.deque()
+    
     try:
         while True: 
     
@@ -75,7 +123,11 @@ def normal_run(**kwargs):
                     pending=main_db.count_pending()),
                     proc=proc, v=logging.H)
                 
+                # Try the transport which worked last time first
+                device_d.update(device_db.get_transport_history(device_d['ip']))
+                
                 tasks.put(device_d)
+                in_flight += 1
             
             ################### Get results from the queue ###################
             results_pool = []
@@ -87,37 +139,45 @@ def normal_run(**kwargs):
                     break
                 else: log('Got a result', proc=proc, v=logging.D)
             
-            log('Got [{}] subprocess results'.format(
-                    len(results_pool)), proc=proc, v=logging.I)
+            log('Got [{}] subprocess results', len(results_pool), 
+                proc=proc, v=logging.I)
             
-            ############# Insert Processed Devices Into Database #############
+            in_flight -= len(results_pool)
+            finished.extend([time.time()] * len(results_pool))
+            metrics.count('crawl.visited', len(results_pool))
+            
+            ###################### Parse Fetched Results #####################
             for result in results_pool:
-                # Record the device as being processed and save it
-                log('Setting result [{}] as processed'.format(result['original']['ip']), proc=proc, v=logging.I)
+                metrics.merge(result.pop('metrics', None))
+                
+                # Record the device as being processed
+                log('Setting result [{}] as processed', result['original']['ip'], proc=proc, v=logging.I)
                 main_db.remove_pending_record(result['original']['pending_id'])
                 
-                log('Adding result [{}] to Visited'.format(result['original']['ip']), proc=proc, v=logging.I)
+                log('Adding result [{}] to Visited', result['original']['ip'], proc=proc, v=logging.I)
                 main_db.add_visited_device_d(result['original'])
-            
+                
                 if ((result['error'] is not None) or 
-                    (result['device'].failed)): continue 
-                    
-                else: 
-                    # Add a successfully polled device to the database
-                    log('Adding result [{}] to Devices'.format(result['original']['ip']), proc=proc, v=logging.I)
-                    device_db.add_device_nd(result['device']) 
-        
-                    # Save the device config and the device neighbors 
-                    log('Saving result [{}] Neighbors'.format(result['original']['ip']), proc=proc, v=logging.I)
-                    main_db.add_device_pending_neighbors(result['device'])
-                    result['device'].save_config()
-                    
-                    log('Successfully processed {}'.format(result['device'].device_name),
-                        proc=proc, v=logging.H)
+                    (result['device'].failed)): continue
+                
+                if _skip_unchanged(result, main_db, device_db): continue
+                
+                if parser is None: _store_result(result, main_db, device_db)
+                else: parsing.add(parser.submit(_parse_result, result))
+            
+            ############# Insert Processed Devices Into Database #############
+            for future in [x for x in parsing if x.done()]:
+                parsing.discard(future)
+                _store_result(future.result(), main_db, device_db)
+            
+            if server: 
+                _update_gauges(workers, tasks, results, remaining, in_flight, 
+                               parsing, finished)
     
                     
             #################### POISION PILL ###############################
-            if (remaining is 0) and tasks.empty():
+            # Count again, since storing results may have added neighbors
+            if tasks.empty() and not parsing and main_db.count_pending() == 0:
                 _kill_workers(tasks, num_workers)
                 break
             
@@ -134,12 +194,407 @@ def normal_run(**kwargs):
     finally:
         # Stop the workers
         _kill_workers(tasks, num_workers)   
+        if parser: parser.shutdown()
+        telemetry.stop(server)
         # Close the connections to the databases
         main_db.close()
         device_db.close() 
+        
+        metrics.dump()
+        log('Wrote timings to [{}]', config.cc.metrics_path, proc=proc, v=logging.N)
+        io_sql.log_statement_summary()
+        
+        # Workers write their profiles and their last log lines as 
+        # they exit, so wait for them before merging or stopping the 
+        # sink
+        for w in workers: w.join(30)
+        if config.cc.profile:
+            profiling.stop()
+            profiling.merge()
+        
+        sink.stop()
+    
+
+
+
+def _refresh_device(pool, target):
+    '''Refreshes the MAC table of one device over a pooled session.
+    Returns the device, or None if it could not be refreshed.'''
+    proc = 'main._refresh_device'
+    
+    # Pool threads are reused, so tag this device's lines only
+    with context(ip=target['ip']):
+        try: session = pool.acquire(**target)
+        except Exception as e:
+            log('Could not open session: {}'.format(str(e)),
+                proc=proc, v=logging.A, ip=target['ip'])
+            return None
+        
+        try: 
+            if session.device.refresh_mac_address_table(): return session.device
+            return None
+        except Exception as e:
+            log('MAC table refresh failed: {}'.format(str(e)),
+                proc=proc, v=logging.A, ip=target['ip'])
+            return None
+        finally: pool.release(session)
+
+
+@logf
+def daemon_run(**kwargs):
+    '''Keeps the MAC tables of every known device up to date, using
+    warm sessions from a session_pool so that each refresh costs one
+    command instead of a full login.
+    
+    Keyword Args:
+        interval (int): Seconds between refreshes. Uses
+            config.cc.daemon_interval by default
+        cycles (int): Stop after this many refreshes. Runs until 
+            interrupted by default
+    '''
+    proc = 'main.daemon_run'
+    log('Starting Daemon Run', proc=proc, v=logging.H)
+    
+    interval = kwargs.get('interval') or config.cc.daemon_interval
+    cycles = kwargs.get('cycles')
+    
+    device_db = io_sql.device_db(**kwargs)
+    pool = session_pool()
+    pool.start()
+    
+    try:
+        with ThreadPoolExecutor(config.cc.daemon_threads) as executor:
+            cycle = 0
+            while cycles is None or cycle < cycles:
+                cycle += 1
+                start = time.time()
+                
+                targets = device_db.get_refresh_targets()
+                log('Refreshing [{}] devices. [{}] warm sessions'.format(
+                    len(targets), len(pool)), proc=proc, v=logging.H)
+                
+                futures = []
+                for t in targets:
+                    device_id = t.pop('device_id')
+                    futures.append((device_id, t['ip'],
+                        executor.submit(_refresh_device, pool, t)))
+                
+                # Write the results from this thread only
+                refreshed = 0
+                for device_id, ip, future in futures:
+                    device = future.result()
+                    if device is None: continue
+                    
+                    count = device_db.update_mac_table(device_id, device)
+                    log('Recorded [{}] MAC addresses', count,
+                        proc=proc, v=logging.I, ip=ip)
+                    refreshed += 1
+                
+                log('Refreshed [{}] of [{}] devices in [{:.1f}] seconds'.format(
+                    refreshed, len(targets), time.time() - start), 
+                    proc=proc, v=logging.H)
+                
+                if cycles is not None and cycle >= cycles: break
+                sleep(max(0, interval - (time.time() - start)))
+    
+    except (KeyboardInterrupt, SystemExit):
+        log('Daemon run cancelled', proc=proc, v= logging.C)
+    
+    finally:
+        pool.close()
+        device_db.close()
+
+
+@logf
+def reparse_run(**kwargs):
+    '''Parses the output stored with every device record again, with
+    the current parsers, and rewrites the interfaces, MAC addresses 
+    and neighbors of the record. No devices are polled. Records are 
+    parsed in a pool of config.cc.parse_workers processes (one per 
+    CPU by default).
+    
+    Returns:
+        dict: The number of records 'parsed', 'failed' and 'skipped'
+    '''
+    proc = 'main.reparse_run'
+    log('Starting Reparse Run', proc=proc, v=logging.H)
+    
+    device_db = io_sql.device_db(**kwargs)
+    log_queue = sink.start()
+    
+    parse_workers = config.cc.parse_workers or multiprocessing.cpu_count()
+    counts = {'parsed': 0, 'failed': 0, 'skipped': 0}
+    
+    device_ids = iter(device_db.get_reparse_ids())
+    pending = set()
+    
+    try:
+        with ProcessPoolExecutor(parse_workers, 
+                                 initializer=_init_parser,
+                                 initargs=(config.cc, log_queue)) as executor:
+            while True:
+                
+                # Keep the pool busy without loading every record at once
+                while len(pending) < parse_workers * 2:
+                    device_id = next(device_ids, None)
+                    if device_id is None: break
+                    
+                    record = device_db.get_stored_output(device_id)
+                    if not _can_reparse(record): 
+                        counts['skipped'] += 1
+                        continue
+                    
+                    pending.add(executor.submit(_reparse_record, record))
+                
+                if not pending: break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                
+                # Database writes stay in this process
+                for future in done:
+                    device_id, device, error = future.result()
+                    if error is not None:
+                        counts['failed'] += 1
+                        continue
+                    
+                    device_db.replace_interface_entries(device_id, device)
+                    counts['parsed'] += 1
+    
+    except (KeyboardInterrupt, SystemExit):
+        log('Reparse cancelled', proc=proc, v=logging.C)
+    
+    finally:
+        device_db.close()
+        sink.stop()
+    
+    log('Reparse complete. Parsed: [{parsed}], Failed: [{failed}], '
+        'Skipped: [{skipped}]'.format(**counts), proc=proc, v=logging.H)
+    return counts
+
+
+def timing_report(limit=20, run_number=None, **kwargs):
+    '''Prints the devices and the steps (commands, parsers etc.) which 
+    took the most time in a crawl, from the timings stored with each
+    device.
+    
+    Keyword Args:
+        limit (int): The number of devices and steps to list
+        run_number (int): The crawl. Default is the latest one.
+    
+    Returns:
+        tuple: The lists returned by device_db.slowest_devices and 
+            device_db.slowest_steps
+    '''
+    device_db = io_sql.device_db(**kwargs)
+    try:
+        devices = device_db.slowest_devices(limit, run_number)
+        steps = device_db.slowest_steps(limit, run_number)
+    finally: device_db.close()
+    
+    def seconds(x): return '' if x is None else '{:.2f}'.format(x)
+    
+    pt = PrettyTable()
+    pt.field_names = ['Device', 'IP', 'Platform', 'Total', 'Connect', 
+                      'Collect', 'Parse', 'DB Write']
+    for d in devices:
+        pt.add_row([d['device_name'], d['ip'], d['system_platform']] + 
+                   [seconds(d[k]) for k in ('seconds', 'connect', 'collect', 
+                                            'parse', 'db_write')])
+    print('Slowest devices (seconds)')
+    print(pt)
+    
+    pt = PrettyTable()
+    pt.field_names = ['Phase', 'Step', 'Devices', 'Total', 'Mean', 'Max']
+    for s in steps:
+        pt.add_row([s['phase'], s['step'], s['devices']] + 
+                   [seconds(s[k]) for k in ('seconds', 'mean', 'max')])
+    print('Slowest steps (seconds)')
+    print(pt)
+    
+    return devices, steps
+
+
+def _can_reparse(record):
+    '''A record can only be parsed again if the output of everything
+    that will be rewritten was stored. Records from before MAC tables
+    were stored, or crawled without config.cc.keep_raw_output, would 
+    otherwise lose their MACs or neighbors.'''
+    proc = 'main._can_reparse'
+    
+    if record is None: return False
+    
+    for key, has_rows in (('raw_mac_address_table', 'has_macs'),
+                          ('raw_cdp', 'has_neighbors')):
+        if record[has_rows] and record[key] is None:
+            log('Record [{}] has no stored [{}]. Skipping.'.format(
+                record['device_id'], key), proc=proc, v=logging.A, 
+                ip=record['ip'])
+            return False
+    
+    return True
+
+
+def _reparse_record(record):
+    '''Runs in the parse pool. Parses the output stored with a device 
+    record (see device_db.get_stored_output).
+    
+    Returns:
+        tuple: (device_id, device, error), where error is None unless 
+            the record couldn't be parsed
+    '''
+    proc = 'main._reparse_record'
+    
+    with context(ip=record['ip'], device=record['device_name']):
+        try:
+            device = CLASS_MAPPER[record['netmiko_platform']](
+                device_id=record['device_id'],
+                device_name=record['device_name'],
+                netmiko_platform=record['netmiko_platform'],
+                system_platform=record['system_platform'],
+                software=record['software'],
+                ip=record['ip'],
+                )
+            device.load_stored_output(record)
+            device.parse_device()
+        
+        except Exception as e:
+            log('Record [{}] could not be parsed: {}'.format(
+                record['device_id'], repr(e)), proc=proc, v=logging.C,
+                ip=record['ip'])
+            return record['device_id'], None, e
+    
+    return record['device_id'], device, None
+
+
+def _store_result(result, main_db, device_db):
+    '''Adds a processed device, its neighbors and its config to the 
+    database. Results which failed are skipped.'''
+    proc = 'main._store_result'
+    
+    # Timings from the parse process
+    metrics.merge(result.pop('metrics', None))
     
+    if ((result['error'] is not None) or 
+        (result['device'].failed)): return
+    
+    # Time the database writes
+    with _result_context(result), log_snip(proc), \
+        result['device'].timed('db_write'):
+        
+        # Add a successfully polled device to the database
+        log('Adding result [{}] to Devices', result['original']['ip'], proc=proc, v=logging.I)
+        device_id = device_db.add_device_nd(result['device']) 
+        
+        # Save the device config and the device neighbors 
+        log('Saving result [{}] Neighbors', result['original']['ip'], proc=proc, v=logging.I)
+        main_db.add_device_pending_neighbors(result['device'])
+        result['device'].save_config()
+    
+    if device_id: device_db.add_device_timings(device_id, result['device'])
+    
+    with _result_context(result):
+        if result['device'].partial:
+            log('Processed {} with partial results'.format(result['device'].device_name),
+                proc=proc, v=logging.A)
+        else:
+            log('Successfully processed {}'.format(result['device'].device_name),
+                proc=proc, v=logging.H)
+
+
+def _result_context(result):
+    '''Returns a log context which tags log lines with the device of
+    a result'''
+    return context(pending_id=result['original'].get('pending_id'),
+                   ip=result['device'].ip,
+                   device=result['device'].device_name)
+
+
+def _update_gauges(workers, tasks, results, pending, in_flight, parsing,
+                   finished):
+    '''Publishes the state of a normal_run to the metrics registry, 
+    for the telemetry endpoint'''
+    
+    while finished and finished[0] < time.time() - 60: finished.popleft()
+    
+    metrics.set_gauge('pending', pending)
+    metrics.set_gauge('in_flight', in_flight)
+    metrics.set_gauge('parsing', len(parsing))
+    metrics.set_gauge('devices_per_minute', len(finished))
+    
+    # Not implemented on some platforms
+    for name, q in (('task_queue_depth', tasks), 
+                    ('result_queue_depth', results)):
+        try: metrics.set_gauge(name, q.qsize())
+        except NotImplementedError: pass
+    
+    for w in workers:
+        for code, state in enumerate(WORKER_STATES):
+            metrics.set_gauge('worker_state', int(w.state.value == code),
+                              worker=w.name, state=state)
+
+
+def _skip_unchanged(result, main_db, device_db):
+    '''If everything collected from a device is the same as in the 
+    last crawl, marks its last record as seen and queues its stored 
+    neighbors, so that it needs no parsing or storing. 
+    
+    Returns:
+        bool: True if the device was unchanged
+    '''
+    proc = 'main._skip_unchanged'
+    
+    device = result['device']
+    if not config.cc.skip_unchanged: return False
+    
+    previous = device_db.get_fingerprints(device.ip, device.device_name)
+    if previous is None or not device.unchanged_since(previous[1]): 
+        return False
+    
+    device_id = previous[0]
+    device_db.set_dependents_as_updated(
+        device_id, 
+        macs_seen='_get_mac_address_table' in device.fingerprints)
+    
+    # The crawl continues through the neighbors
+    device.neighbors = device_db.get_neighbors(device_id)
+    device.interfaces = []
+    main_db.add_device_pending_neighbors(device)
+    
+    log('{} is unchanged since the last crawl'.format(device.device_name),
+        proc=proc, v=logging.H, ip=device.ip)
+    return True
+
+
+def _init_parser(cc, log_queue=None):
+    '''Runs in each parse process. Sets the config and the log sink,
+    since processes may not inherit the parent's runstate.'''
+    config.cc = cc
+    if log_queue is not None: sink.attach(log_queue)
+    if config.cc.profile: profiling.start('parser')
 
 
+def _parse_result(result):
+    '''Runs in the parse pool. Parses the raw output of a device 
+    fetched by a worker, and returns the result for the main process
+    to store. A device which fails parsing is returned with the error.'''
+    proc = 'main._parse_result'
+    
+    with _result_context(result):
+        try: result['device'].parse_device()
+        except Exception as e:
+            log('Parsing {} failed: {}'.format(result['device'].ip, str(e)),
+                v=logging.C, proc=proc)
+            result['log'] = 'Parsing {} failed: {}'.format(result['device'].ip, str(e))
+            result['error'] = e
+    
+    return _with_metrics(result)
+
+
+def _with_metrics(result):
+    '''Attaches the timings recorded in this process since the last
+    result, for the main process to merge into its own.'''
+    result['metrics'] = metrics.drain()
+    return result
+
 
 def _kill_workers(task_queue, num_workers):
     '''
@@ -155,17 +610,40 @@ def _kill_workers(task_queue, num_workers):
     for w in range(num_workers): task_queue.put(None)
     
 
+# What a worker is doing, as stored in worker.state
+WORKER_STATES = ('idle', 'polling', 'stopped')
+IDLE, POLLING, STOPPED = range(3)
+
+
 class worker(multiprocessing.Process):
     
     def __init__(self,
                  task_queue,
                  result_queue,
+                 fetch_only=False,
+                 log_queue=None,
                  ):
+        '''
+        Keyword Args:
+            fetch_only (bool): Only poll the devices, and leave parsing
+                their output to the main process
+            log_queue (Queue): The queue of the log sink (see wylog.sink)
+        '''
         
         multiprocessing.Process.__init__(self)
         self.result_queue = result_queue
         self.task_queue = task_queue
+        self.fetch_only = fetch_only
+        self.log_queue = log_queue
         self.cc = config.cc
+        
+        # Shared with the main process, which reports it
+        self.state = multiprocessing.Value('b', IDLE, lock=False)
+    
+    def _return(self, result):
+        '''Hands a result back to the main process and goes idle'''
+        self.state.value = IDLE
+        self.result_queue.put(_with_metrics(result))
     
     def run(self):
         proc = '{}.run'.format(self.name)
@@ -173,31 +651,36 @@ class worker(multiprocessing.Process):
         # Reset global variables since subprocesses may not
         # inherit parent runstates
         config.cc= self.cc
+        if self.log_queue is not None: sink.attach(self.log_queue)
+        if config.cc.profile: profiling.start('worker')
         
         try:
             while True:
+                clear_context()
                 
-                log('{}: Awaiting task. Queue size: [{}]'.format(
-                                                    self.name,
-                                                    self.task_queue.qsize()),
-                                                    v=logging.I,
-                                                    proc=proc)
+                log('{}: Awaiting task. Queue size: [{}]', self.name,
+                    lazy(self.task_queue.qsize), v=logging.I, proc=proc)
                 # Get the next device in the queue
                 next_device = self.task_queue.get()
                 
                 # Poison pill means shutdown
                 if next_device is None:
-                    log('{}: Got poision pill. Walking into the light...'.format(
-                        self.name, self.task_queue.qsize()), v=logging.N, proc=proc)
+                    log('{}: Got poision pill. Walking into the light...',
+                    self.name, v=logging.N, proc=proc)
+                    self.state.value = STOPPED
                     
                     self.task_queue.task_done()
                     break
                 
-                log('{}: Got IP [{}], Device [{}]'.format(self.name,
-                                                          next_device.get('ip', 'Unknown IP'),
-                                                          next_device),
-                                                          v=logging.N, proc=proc,
-                                                          ip=next_device.get('ip', 'Unknown IP'))
+                # Tag everything logged while polling with the device
+                set_context(pending_id=next_device.get('pending_id'),
+                            ip=next_device.get('ip'))
+                
+                log('{}: Got IP [{}], Device [{}]', self.name,
+                    next_device.get('ip', 'Unknown IP'), next_device,
+                    v=logging.N, proc=proc, ip=next_device.get('ip', 'Unknown IP'))
+                
+                self.state.value = POLLING
                 
                 # Prepare the result set to pass back to the main proccess
                 result = {
@@ -216,7 +699,7 @@ class worker(multiprocessing.Process):
                     result['log'] = 'Device could not be instantiated.\n'
                     result['error'] = e 
                     self.task_queue.task_done()
-                    self.result_queue.put(result)
+                    self._return(result)
                     
                     if config.cc.raise_exceptions: raise
                     else: 
@@ -224,7 +707,9 @@ class worker(multiprocessing.Process):
                         continue
                     
                 # Poll the device
-                try: result['device'].process_device()
+                try: 
+                    if self.fetch_only: result['device'].fetch_device()
+                    else: result['device'].process_device()
                 except Exception as e:
                     log('Connection to {} failed: {}'.format(
                         result['device'].ip, str(e)),
@@ -237,7 +722,7 @@ class worker(multiprocessing.Process):
                     
                     # Put the result on the device queue and signal done
                     self.task_queue.task_done()
-                    self.result_queue.put(result) 
+                    self._return(result) 
                         
                     # Ignore CLI errors, raise the rest
                     if (config.cc.raise_exceptions and 
@@ -252,7 +737,7 @@ class worker(multiprocessing.Process):
                 
                 # Put the result on the device queue and signal done
                 self.task_queue.task_done()
-                self.result_queue.put(result)
+                self._return(result)
         
         except (KeyboardInterrupt, SystemExit):
             try: self.terminate()
@@ -489,6 +974,121 @@ def make_parser() -> argparse.ArgumentParser:
         '''),
         )
     
+    action.add_argument(
+        '-sP',
+        '--reparse',
+        action="store_true",
+        dest='reparse',
+        help=textwrap.dedent(
+        '''\
+        Parses the output stored with every device in the database
+            again, using the current parsers, and rewrites their 
+            interfaces, MAC addresses and neighbors. No devices are
+            polled.
+        '''),
+        )
+    
+    action.add_argument(
+        '-sT',
+        '--timings',
+        action="store_true",
+        dest='timings',
+        help=textwrap.dedent(
+        '''\
+        Lists the devices and the steps (commands, parsers, database 
+            writes) which took the most time in the last crawl. Use 
+            --top to list more or fewer.
+        '''),
+        )
+    
+    action.add_argument(
+        '-sD',
+        '--daemon',
+        action="store_true",
+        dest='daemon',
+        help=textwrap.dedent(
+        '''\
+        Keeps the MAC address tables of all previously found devices 
+            up to date, refreshing them every --interval seconds. 
+            Sessions to the devices are kept open between refreshes.
+        '''),
+        )
+    
+    polling.add_argument(
+        '--interval',
+        action='store',
+        type=int,
+        dest='interval',
+        metavar='SECONDS',
+        default=None,
+        help='Seconds between refreshes in daemon mode (-sD).',
+        )
+    
+    polling.add_argument(
+        '--top',
+        action='store',
+        type=int,
+        dest='top',
+        metavar='N',
+        default=20,
+        help='The number of devices and steps listed by --timings (-sT).',
+        )
+    
+    polling.add_argument(
+        '--profile',
+        action='store_true',
+        dest='profile',
+        help=textwrap.dedent(
+        '''\
+        Profiles every process of a recursive run (-sR) with cProfile,
+            and writes the merged stats and a flamegraph-ready collapsed
+            stack file to the profile folder of the run directory.
+        '''),
+        )
+    
+    polling.add_argument(
+        '--log-format',
+        action='store',
+        dest='log_format',
+        choices=('text', 'json'),
+        default=None,
+        help=textwrap.dedent(
+        '''\
+        Writes the log as text (log.txt), or as one JSON object per 
+            line (log.jsonl) tagged with the crawl, device, worker and
+            polling phase of each entry.
+        '''),
+        )
+    
+    polling.add_argument(
+        '--metrics-port',
+        action='store',
+        type=int,
+        dest='metrics_port',
+        metavar='PORT',
+        default=None,
+        help=textwrap.dedent(
+        '''\
+        Serves the progress and timings of a recursive run (-sR) on 
+            http://localhost:PORT/metrics, in the Prometheus format.
+        '''),
+        )
+    
+    polling.add_argument(
+        '--collect',
+        action='store',
+        dest='collection_profile',
+        metavar='PROFILE',
+        default=None,
+        help=textwrap.dedent(
+        '''\
+        The collection profile to use, which decides which optional
+            data (serials, CDP, MAC tables) is collected from each device 
+            and how often. One of the keys of config.collection_profiles, 
+            e.g. full, topology, inventory or nightly. Default is full.
+        '''),
+        )
+    
     target.add_argument(
         '-t',
         '--target',
@@ -516,6 +1116,11 @@ def parse_cli():
     args = parser.parse_args()
      
     if args.update: args.ignore_visited = True
+    
+    # Fail now rather than on every device after connecting to it
+    if args.collection_profile:
+        try: profiles.get_profile(args.collection_profile)
+        except KeyError as e: parser.error(e.args[0])
      
     return args
 
@@ -538,6 +1143,7 @@ def main():
 
     # Set verbosity level for wylog
     config.cc.verbosity= args.v
+    if args.log_format: config.cc.log_format= args.log_format
     
     log('Start new run', 
         new_log=True,
@@ -547,10 +1153,26 @@ def main():
     logging.PRINT_DEBUG = args.debug
     if args.debug: config.cc.debug= True 
     
+    if args.metrics_port is not None: 
+        config.cc.metrics_port= args.metrics_port
+    if args.profile: config.cc.profile= True
+    
 
     if args.manage_creds:
         menu.start()
     
+    # Nothing needs to log in to report on stored timings
+    if args.timings:
+        timing_report(limit=args.top, clean=False)
+        return
+    
+    # Nothing needs to log in to parse stored output
+    if args.reparse:
+        log('##### Starting Reparse #####', proc=proc, v=logging.H)
+        reparse_run(clean=False)
+        log('##### Reparse Complete #####', proc=proc, v=logging.H)
+        return
+    
     if len(config.cc.credentials) == 0:
         print('There are no stored credentials. You must first add them with -m')
         log('There are no stored credentials. You must first add them with -m',
@@ -575,16 +1197,27 @@ def main():
             netmiko_platform=args.platform,
             ignore_visited=args.ignore_visited,
             clean=args.clean,
+            collection_profile=args.collection_profile,
             )
         log('##### Recursive Run Complete #####', proc=proc, v=logging.H)
        
     elif args.single: 
         log('##### Starting Single Run #####', proc=proc, v=logging.H)
+        if args.collection_profile:
+            config.cc.collection_profile = args.collection_profile
         single_run(
             target= args.host,
             netmiko_platform=args.platform,
             )
         log('##### Single Run Complete #####', proc=proc, v=logging.H)
+    
+    elif args.daemon: 
+        log('##### Starting Daemon #####', proc=proc, v=logging.H)
+        daemon_run(
+            interval=args.interval,
+            clean=False,
+            )
+        log('##### Daemon Stopped #####', proc=proc, v=logging.H)
         
        
        
@@ -40,7 +40,7 @@ def create_instantiated_device(*args, **kwargs):
     and creates the object based on netmiko_platform."""
     proc = 'device_dispatcher.create_instantiated_device'
     
-    log('Instantiating ' + kwargs['ip'], v=logging.I, proc=proc)
+    log('Instantiating {}', kwargs['ip'], v=logging.I, proc=proc)
     
     # In case of an unknown platform, autodetect
     if kwargs.get('netmiko_platform') not in platforms:
@@ -58,7 +58,7 @@ def create_instantiated_device(*args, **kwargs):
         # instantiated based on vendor/platform.
         ConnectionClass = CLASS_MAPPER[kwargs['netmiko_platform']]
         
-    log('Instantiated ' + kwargs['ip'], v=logging.I, proc=proc)
+    log('Instantiated {}', kwargs['ip'], v=logging.I, proc=proc)
     return ConnectionClass(*args, **kwargs)
     
 
@@ -1,21 +1,125 @@
-from datetime import datetime
-import re, hashlib, os
-from time import sleep
+from array import array
+import re, hashlib, json, threading
 
 from prettytable import PrettyTable
 from netmiko import ConnectHandler
 
-from .. import config, util, cli
+from .. import archive, config, util, cli
+from .. retry import retry_policy, breaker, deadline, CheckFailed
 from .. util import is_ip, network_ip
-from .. wylog import log, logging, logf, log_snip
+from .. wylog import log, logging, logf, log_snip, set_context
+from .profiles import collection_plan
+
+
+# An interface type (at least 2 letters) and number (digits, /'s and .'s)
+_interface_name = re.compile(r'([A-Za-z\-]{2,})([\d\/\.]+)')
+
+# Collectors which need the session as a whole, and always run in the
+# fetch stage (see NetworkDevice.fetch_device)
+SESSION_STEPS = ('_enable', '_get_config', '_parse_hostname')
+
+# Collectors which must succeed for the device to be processed
+MANDATORY_STEPS = SESSION_STEPS + ('_get_interfaces',)
+
+# Config lines which change without the config changing, like the
+# clock drift or the time of the last save
+_volatile = re.compile(r'^(?:!.*|ntp clock-period .*)\n?', re.M)
+
+# Collectors which can be parsed again from output stored in the
+# database (see io_sql.device_db.get_stored_output), and the key
+# their output is stored under. Collectors which only read the config
+# have none.
+STORED_OUTPUT = (
+    ('_get_interfaces', 'raw_interfaces'),
+    ('_get_other_ips', None),
+    ('_get_cdp_neighbors', 'raw_cdp'),
+    ('_get_mac_address_table', 'raw_mac_address_table'),
+    )
+
+
+def split_interface_name(interface_name):
+    '''Returns a tuple containing (interface_type, interface_number),
+    or None if the name can't be split'''
+    
+    output = _interface_name.search(interface_name)
+    if output: return output.groups()
+    return None
+
+
+class mac_array():
+    '''A list of MAC addresses stored as 48 bit integers in an array,
+    instead of one string object per MAC. Iterating returns them in
+    the database notation (see util.int_to_mac).'''
+    
+    __slots__ = ('_macs',)
+    
+    def __init__(self, macs=()):
+        self._macs = array('Q')
+        self.extend(macs)
+    
+    def append(self, mac):
+        '''Adds a MAC address, given as a string or integer
+        
+        Raises:
+            ValueError: If the string is not a MAC address
+        '''
+        if not isinstance(mac, int): mac = util.mac_to_int(mac)
+        self._macs.append(mac)
+    
+    def extend(self, macs):
+        for mac in macs: self.append(mac)
+    
+    def __len__(self):
+        return len(self._macs)
+    
+    def __iter__(self):
+        return (util.int_to_mac(x) for x in self._macs)
+    
+    def __getitem__(self, index):
+        return util.int_to_mac(self._macs[index])
+    
+    def __contains__(self, mac):
+        if not isinstance(mac, int): mac = util.mac_to_int(mac)
+        return mac in self._macs
+    
+    def __eq__(self, other):
+        return list(self) == list(other)
+    
+    def __repr__(self):
+        return repr(list(self))
 
 
 class Interface():
     '''Generic network device interface'''
+    
+    # Devices can have thousands of interfaces, so don't give each 
+    # one a __dict__
+    __slots__ = (
+        'interface_description',
+        'tunnel_destination_ip',
+        'parent_interface_name',
+        'interface_subnet',
+        'interface_status',
+        'remote_interface',
+        'interface_number',
+        'interface_name',
+        'interface_type',
+        'tunnel_status',
+        'raw_interface',
+        'interface_ip',
+        'interface_id',
+        'virtual_ip',
+        'network_ip',
+        'device_id',
+        'neighbors',
+        '_macs',
+        )
+    
     def __init__(self, **kwargs):
         
         self.interface_description = kwargs.pop('interface_description', None)
         self.tunnel_destination_ip = kwargs.pop('tunnel_destination_ip', None)
+        self.parent_interface_name = kwargs.pop('parent_interface_name', None)
         self.interface_subnet = kwargs.pop('interface_subnet', None)
         self.interface_status = kwargs.pop('interface_status', None)
         self.remote_interface = kwargs.pop('remote_interface', None)
@@ -33,6 +137,22 @@ class Interface():
         # Mutable Arguments
         self.mac_address_table = []
         self.neighbors = []
+    
+    
+    @property
+    def mac_address_table(self):
+        return self._macs
+    
+    @mac_address_table.setter
+    def mac_address_table(self, macs):
+        self._macs = macs if isinstance(macs, mac_array) else mac_array(macs)
+    
+    
+    def attributes(self):
+        '''Returns a dict of the interface's attributes'''
+        output = {k: getattr(self, k) for k in self.__slots__ if k != '_macs'}
+        output['mac_address_table'] = self.mac_address_table
+        return output
         
         
     def get_network_ip(self):
@@ -46,13 +166,53 @@ class Interface():
     def __str__(self):
             
         output = []
-        for var, value in vars(self).items(): output.append(var + ': ' + str(value))
+        for var, value in self.attributes().items(): output.append(var + ': ' + str(value))
         return '\n'.join(str(x) for x in sorted(output))
     
 
 
 class NetworkDevice():
     '''Generic network device'''
+    
+    __slots__ = (
+        'raw_mac_address_table',
+        'netmiko_platform',
+        'system_platform',
+        'process_name',
+        'neighbor_id',
+        'device_name',
+        'connection',
+        'AD_enabled',
+        'device_id',
+        'cred_type',
+        'software',
+        'username',
+        'password',
+        'raw_cdp',
+        'raw_inventory',
+        'raw_output',
+        'updated',
+        'config',
+        'tcp_22',
+        'tcp_23',
+        'transport',
+        'ip',
+        'serial_numbers',
+        'interfaces',
+        'neighbors',
+        'other_ips',
+        'processing_error',
+        'failed',
+        'partial',
+        'fingerprints',
+        'timings',
+        'error',
+        'error_log',
+        '_interface_index',
+        'deadline',
+        '_watchdog',
+        )
+    
     def __init__(self, **kwargs):
         # Immutable arguments
         self.raw_mac_address_table = kwargs.pop('raw_mac_address_table', None)
@@ -69,23 +229,43 @@ class NetworkDevice():
         self.username= kwargs.pop('username', None)
         self.password= kwargs.pop('password', None)
         self.raw_cdp = kwargs.pop('raw_cdp', None)
+        self.raw_inventory = kwargs.pop('raw_inventory', None)
         self.updated = kwargs.pop('updated', None)
         self.config = kwargs.pop('config', None)
         self.tcp_22 = kwargs.pop('tcp_22', None)
         self.tcp_23 = kwargs.pop('tcp_23', None)
+        self.transport = kwargs.pop('transport', None)
         self.ip = kwargs.pop('ip', None)
         
         # Mutable arguments
-        self.mac_address_table = []
         self.serial_numbers = []
         self.interfaces = []
         self.neighbors = []
         self.other_ips = []
         
+        # Output of the fetch stage which hasn't been parsed yet, by
+        # collector, in the order the collectors are to be parsed
+        self.raw_output = {}
+        
+        # Hashes of the fetched output, by collector (see fingerprint)
+        self.fingerprints = None
+        
+        # Seconds spent on each step of processing the device (see timed)
+        self.timings = {}
+        
         # Other Args
         self.processing_error = False
         self.failed = False
+        self.partial = False
+        self.error = False
         self.error_log = ''
+        
+        # Lookup tables for find_interface
+        self._interface_index = None
+        
+        # Deadline of the current polling phase
+        self.deadline = deadline()
+        self._watchdog = None
     
     def credentials(self,
                     username= None,
@@ -116,7 +296,7 @@ class NetworkDevice():
             'Management IP:     ' + str(self.ip),
             'First Serial:      ' + self.first_serial_str(),
             'Serial Count:      ' + str(len(self.serial_numbers)),
-            'Dynamic MAC Count: ' + str(len(self.mac_address_table)),
+            'Dynamic MAC Count: ' + str(sum(len(i.mac_address_table) for i in self.interfaces)),
             'Interface Count:   ' + str(len(self.interfaces)),
             'Neighbor Count:    ' + str(len(self.all_neighbors())),
             'Config Size:       ' + str(len(self.config))
@@ -151,22 +331,27 @@ class NetworkDevice():
  
  
     def save_config(self):
+        '''Archives the config and the raw output collected from the 
+        device (see netcrawl.archive). Output which hasn't changed 
+        since an earlier crawl is not written again.
+        
+        Returns:
+            dict: The archive digest of each output, by kind
+        '''
         proc = 'base_device.save_config'
         log('Saving config', proc=proc, v=logging.I)
         
         if not self.config: raise ValueError('Config [{}] was empty'.format(self.config))
         
-        path = os.path.join(config.cc.devices_path, self.unique_name) 
-        
-        filename = os.path.join(path, datetime.now().strftime(config.cc.file_time) + '.cfg')
-        
-        if not os.path.exists(path):
-            os.makedirs(path)
-        
-        with open(filename, 'w') as outfile:       
-            outfile.write(self.config)
+        keys = archive.record(self.unique_name, {
+            'config': self.config,
+            'inventory': self.raw_inventory,
+            'cdp': self.raw_cdp,
+            'mac': self.raw_mac_address_table,
+            })
                 
         log('Saved config', proc=proc, v=logging.N)
+        return keys
     
     
     def all_neighbors(self):
@@ -225,22 +410,74 @@ class NetworkDevice():
             new_interfaces (List of interface objects): One or more interface objects
         """
         proc = 'base_device.merge_interfaces'
-         
+        
+        existing = {i.interface_name: i for i in self.interfaces}
+        
         for new_interf in new_interfaces:
-            match = False
-            for old_interf in self.interfaces:
-                # If the new interface name matches the saved name
-                if new_interf.interface_name == old_interf.interface_name:
-                    match = True
-                    log('Interface {} merged with old interface'.
-                        format(new_interf.interface_name),
-                        proc=proc,
-                        v=logging.D)
-                    # For each variable in the interface class, compare and overwrite new ones.
-                    for key in config(new_interf).keys():
-                        config(old_interf)[key] = config(new_interf)[key] 
+            old_interf = existing.get(new_interf.interface_name)
+            
+            # If the new interface name matches the saved name
+            if old_interf is not None and old_interf is not new_interf:
+                log('Interface {} merged with old interface', 
+                    new_interf.interface_name, proc=proc, v=logging.D)
+                # For each variable in the interface class, overwrite the old one.
+                for key, value in new_interf.attributes().items():
+                    setattr(old_interf, key, value)
+            
+            elif old_interf is None: 
+                self.interfaces.append(new_interf)
+                existing[new_interf.interface_name] = new_interf
+    
+    
+    def find_interface(self, name):
+        """Returns the interface matching a full or abbreviated interface
+        name (Gi1/0/1 finds GigabitEthernet1/0/1), or None. 
+        
+        Lookups go through an index of the interfaces, which is rebuilt
+        whenever interfaces are added or removed.
+        
+        Args:
+            name (str): The interface name, as found in MAC tables or 
+                CDP output
+        """
+        if not name: return None
+        
+        if (self._interface_index is None or 
+            self._interface_index[0] != len(self.interfaces)):
+            self._build_interface_index()
+        
+        count, full_names, numbers, cache = self._interface_index
+        
+        key = name.lower()
+        if key in full_names: return full_names[key]
+        if key in cache: return cache[key]
+        
+        match = None
+        split = split_interface_name(name)
+        if split:
+            short_type = split[0].lower()
+            for interface_type, interf in numbers.get(split[1], ()):
+                if interface_type.startswith(short_type):
+                    match = interf
+                    break
+        
+        cache[key] = match
+        return match
+    
+    
+    def _build_interface_index(self):
+        full_names = {}
+        numbers = {}
+        
+        for interf in self.interfaces:
+            if not interf.interface_name: continue
+            full_names.setdefault(interf.interface_name.lower(), interf)
             
-            if not match: self.interfaces.append(new_interf)
+            split = split_interface_name(interf.interface_name)
+            if split:
+                numbers.setdefault(split[1], []).append((split[0].lower(), interf))
+        
+        self._interface_index = (len(self.interfaces), full_names, numbers, {})
     
     
     def interfaces_to_string(self):
@@ -291,23 +528,204 @@ class NetworkDevice():
       
     
     def process_device(self):
-        '''Main method which fully populates the network_device'''
-        proc = 'base_device.process_devices'
+        '''Main method which fully populates the network_device, by
+        running fetch_device and then parse_device.'''
+        
+        self.fetch_device()
+        self.parse_device()
+        return True
+    
+    
+    def fetch_device(self):
+        '''Polls the device and keeps the raw output of each collector
+        in self.raw_output, without parsing it. The session is closed
+        before returning, so that parsing doesn't hold it (or an AAA
+        slot) open. Call parse_device to finish processing, which can 
+        be done in another process.
+        
+        Polling is split into three phases (connect, mandatory and 
+        optional collection), each limited by config.cc.phase_timeouts
+        and all of them together by config.cc.device_timeout. If the
+        time runs out after the device has been identified, the session
+        is cut and the device is returned with self.partial set.'''
+        proc = 'base_device.fetch_device'
         
         log('Processing device', proc=proc, v=logging.N)
         
+        device_deadline = deadline(config.cc.device_timeout)
+        
+        try:
+            self.open_session(device_deadline)
+            
+            with self.timed('collect'):
+                self._collect_mandatory(device_deadline, fetch_only=True)
+                if not self.partial: 
+                    self._collect_optional(device_deadline, fetch_only=True)
+        
+        finally:
+            self._end_session()
+        
+        self.fingerprints = self.fingerprint()
+        
+        if self.partial:
+            log('Finished polling {} with partial results'.format(self.unique_name),
+                proc=proc, v=logging.A)
+        else:
+            log('Finished polling {}'.format(self.unique_name), proc=proc, v=logging.H)
+        return True
+    
+    
+    def parse_device(self):
+        '''Parses the output kept by fetch_device. Needs no session.
+        
+        Raises:
+            Exception: If a mandatory collector could not be parsed
+        '''
+        proc = 'base_device.parse_device'
+        
+        with self.timed('parse'):
+            while self.raw_output:
+                method = next(iter(self.raw_output))
+                raw = self.raw_output.pop(method)
+                
+                parse = self._stage(method, 'parse')
+                fn = parse if parse else getattr(self, method)
+                
+                try:
+                    with log_snip(fn.__name__), self.timed('parse:' + method):
+                        if parse: parse(raw)
+                        else: fn()
+                except Exception as e:
+                    self.alert(fn.__name__ + ' - Error: ' + str(e), proc=proc)
+                    if method in MANDATORY_STEPS: raise
+                    if config.cc.raise_exceptions: raise
+            
+            if not config.cc.keep_raw_output: self.drop_raw_output()
+            
+            # Post-processing, which must be after all IP polling
+            self._normalize_netmasks()
+            self._calc_network_addresses()
+        
+        log('Finished parsing {}', self.unique_name, proc=proc, v=logging.I)
+        return True
+    
+    
+    def timed(self, step):
+        '''Returns a context manager which adds the time spent in it to
+        self.timings[step]. Steps are 'connect', 'collect', 'parse' 
+        and 'db_write', and 'step:detail' for the parts of a step, 
+        like 'collect:show run' or 'parse:_get_interfaces'.'''
+        return util.step_timer(self.timings, step)
+    
+    
+    def fingerprint(self):
+        '''Returns a hash of the config and of each fetched output 
+        which hasn't been parsed yet, by collector. Comments and clock
+        drift are left out of the config's hash.'''
+        
+        output = {}
+        if self.config: 
+            output['config'] = archive.digest(_volatile.sub('', self.config))
+        
+        for method, raw in self.raw_output.items():
+            if raw is None: continue
+            if not isinstance(raw, str): raw = json.dumps(raw, sort_keys=True)
+            output[method] = archive.digest(raw)
+        
+        return output
+    
+    
+    def unchanged_since(self, fingerprints):
+        '''Returns True if everything collected from the device during
+        this crawl is the same as in the crawl with these fingerprints.
+        Output which wasn't collected this time is not compared.'''
+        
+        if not self.fingerprints or not fingerprints: return False
+        return all(fingerprints.get(k) == v for k, v in self.fingerprints.items())
+    
+    
+    def _stage(self, method, stage):
+        '''Returns one half of a collector which is split into a 
+        fetch and a parse method, like _fetch_mac_address_table and 
+        _parse_mac_address_table for _get_mac_address_table. The 
+        fetch half returns the raw output, which is passed to the
+        parse half. Returns None if the collector isn't split.'''
+        
+        name = method.lstrip('_')
+        if name.startswith('get_'): name = name[len('get_'):]
+        
+        return getattr(self, '_{}_{}'.format(stage, name), None)
+    
+    
+    def load_stored_output(self, record):
+        '''Loads output stored in the database into self.raw_output, 
+        so that parse_device can parse it again without polling the 
+        device. Collectors without stored output are skipped.
+        
+        Args:
+            record (dict): As returned by device_db.get_stored_output
+        '''
+        self.config = record.get('config')
+        
+        for method, key in STORED_OUTPUT:
+            if self._stage(method, 'parse') is None: 
+                self.raw_output[method] = None
+            elif record.get(key) is not None:
+                self.raw_output[method] = self._decode_stored(method, record[key])
+    
+    
+    def _decode_stored(self, method, raw):
+        '''Returns stored output in the form the collector's fetch
+        half returns it'''
+        return raw
+    
+    
+    def _fetch(self, fn):
+        '''Runs the fetch half of a collector and keeps its output for 
+        parse_device. Collectors which aren't split are left to 
+        parse_device whole, since they only read output which was 
+        already fetched, unless they are one of SESSION_STEPS.'''
+        method = fn.__name__
+        
+        if method in SESSION_STEPS: return fn()
+        
+        fetch = self._stage(method, 'fetch')
+        self.raw_output[method] = fetch() if fetch else None
+    
+    
+    def open_session(self, device_deadline=None):
+        '''Connects to the device and stores the connection details.
+        
+        Raises:
+            IOError: If a connection could not be established
+        '''
+        proc = 'base_device.open_session'
+        
+        if device_deadline is None: device_deadline = deadline()
+        
         # Connect to the device
-        try: result = cli.connect(handler=ConnectHandler,
-                                          netmiko_platform=self.netmiko_platform,
-                                          ip=self.ip,
-                                          )
+        self._start_phase('connect', device_deadline)
+        try: 
+            with self.timed('connect'):
+                result = cli.connect(handler=ConnectHandler,
+                                     netmiko_platform=self.netmiko_platform,
+                                     ip=self.ip,
+                                     deadline=self.deadline.expires,
+                                     transport=self.transport,
+                                     history={'tcp_22': self.tcp_22,
+                                              'tcp_23': self.tcp_23},
+                                     )
         except Exception as e:
             self.alert('Connection failed', proc=proc)
             raise
         
-        # Error checking
+        for step, seconds in result.pop('timings').items():
+            self.timings['connect:' + step] = seconds
+        
+        # Error checking. Ports which didn't need probing may be None.
         for k, v in result.items():
-            assert v is not None, 'Result[\'{key}\'] is None, should have value.'.format(k)
+            if k in ('tcp_22', 'tcp_23'): continue
+            assert v is not None, 'Result[\'{}\'] is None, should have value.'.format(k)
         
         # Import results of CLI connection into device variables
         self.connection = result['connection']
@@ -316,46 +734,135 @@ class NetworkDevice():
         self.username= result['username']
         self.password= result['password']
         self.cred_type= result['cred_type']
-        
-        
-        # Functions that must work consecutively in order to proceed
-        # On error, these raise an exception and fail the processing
-        for fn in (
-            self._enable,
-            self._get_config,
-            self._parse_hostname,
-            self._get_interfaces,
-            ):
+        self.transport= result['transport']
+    
+    
+    def _collect_mandatory(self, device_deadline, fetch_only=False):
+        '''Functions that must work consecutively in order to proceed.
+        On error, these raise an exception and fail the processing.
+        With fetch_only, parsing is left to parse_device.'''
+        proc = 'base_device._collect_mandatory'
+        
+        self._start_phase('mandatory', device_deadline)
+        for fn in [getattr(self, x) for x in MANDATORY_STEPS]:
             try:
+                self.deadline.check('Mandatory phase deadline')
                 with log_snip(fn.__name__): 
-                    fn()
+                    if fetch_only: self._fetch(fn)
+                    else: fn()
             except Exception as e:
                 self.alert(msg=fn.__name__ + ' - Error: ' + str(e),
                            proc=proc,)
+                
+                # Keep what we have if we at least know the device
+                if self.deadline.expired() and self.device_name:
+                    self.partial = True
+                    return
                 raise
-        
-        # These are optional, and only leave a log message when they 
-        # fail (unless SUPPRESS_EXCEPTION has been set False)
-        for fn in (
-            self.get_serials,
-            self._get_other_ips,
-            self._get_cdp_neighbors,
-            self._get_mac_address_table,
-            self._normalize_netmasks,  # Must be after all IP polling
-            self._calc_network_addresses,
-            ):
+    
+    
+    def _collect_optional(self, device_deadline, plan=None, fetch_only=False):
+        '''These are optional, and only leave a log message when they 
+        fail (unless SUPPRESS_EXCEPTION has been set False). Which
+        ones run depends on the collection profile, unless a plan 
+        (list of method names) is given. With fetch_only, parsing is
+        left to parse_device.'''
+        proc = 'base_device._collect_optional'
+        
+        if plan is None: plan = collection_plan(self)
+        
+        self._start_phase('optional', device_deadline)
+        for fn in [getattr(self, x) for x in plan]:
+            if self.deadline.expired():
+                self.alert('Optional phase deadline reached before ' + 
+                           fn.__name__, proc=proc)
+                self.partial = True
+                break
+            
             try: 
                 with logging.log_snip(fn.__name__): 
-                    fn()
+                    if fetch_only: self._fetch(fn)
+                    else: fn()
             except Exception as e:
                 self.alert(fn.__name__ + ' - Error: ' + str(e), proc=proc)
                 if config.cc.raise_exceptions: raise
-               
         
-        log('Finished polling {}'.format(self.unique_name), proc=proc, v=logging.H)
-        self.connection.disconnect()
+        self._stop_watchdog()
+    
+    
+    def refresh_mac_address_table(self):
+        '''Polls the MAC address table again over the already open
+        session. Used by daemon mode to refresh warm devices.'''
+        
+        for i in self.interfaces: i.mac_address_table = []
+        self.partial = False
+        
+        self._collect_optional(deadline(config.cc.device_timeout),
+                               plan=['_get_mac_address_table'])
+        if not config.cc.keep_raw_output: self.drop_raw_output()
+        return not self.partial
+    
+    
+    def drop_raw_output(self):
+        '''Frees the raw command output which has already been parsed.
+        The config itself is kept, since it is saved to disk.'''
+        
+        self.raw_mac_address_table = None
+        self.raw_cdp = None
+        self.raw_inventory = None
+        self.raw_output = {}
+        
+        for i in self.interfaces: i.raw_interface = None
+        for n in self.all_neighbors(): n['raw_cdp'] = None
+    
+    
+    def _start_phase(self, phase, parent):
+        '''Sets the deadline for a new polling phase and arms a 
+        watchdog which cuts the session when it expires.
+        
+        Args:
+            phase (str): A key of config.cc.phase_timeouts
+            parent (deadline): The deadline for the whole device
+        '''
+        self._stop_watchdog()
+        set_context(phase=phase, device=self.device_name)
+        
+        self.deadline = deadline(config.cc.phase_timeouts.get(phase), parent)
+        
+        remaining = self.deadline.remaining()
+        if remaining is not None:
+            self._watchdog = threading.Timer(remaining, self._cut_session, (phase,))
+            self._watchdog.daemon = True
+            self._watchdog.start()
+            
+    
+    def _cut_session(self, phase):
+        '''Called by the watchdog. Disconnecting makes any command 
+        which is still waiting on the device fail straight away.'''
+        proc = 'base_device._cut_session'
+        
+        log('{} phase deadline reached. Cutting session.'.format(phase),
+            proc=proc, v=logging.A, ip=self.ip)
+        
+        try: self.connection.disconnect()
+        except Exception: pass
+    
+    
+    def _stop_watchdog(self):
+        if self._watchdog: self._watchdog.cancel()
+        self._watchdog = None
+    
+    
+    def _end_session(self):
+        '''Stops the watchdog and closes the connection. Both must be 
+        cleared before the device can be pickled.'''
+        self._stop_watchdog()
+        self._interface_index = None
+        
+        if self.connection:
+            try: self.connection.disconnect()
+            except Exception: pass
         self.connection = None
-        return True
     
     
     def _calc_network_addresses(self):
@@ -403,24 +910,25 @@ class NetworkDevice():
         '''
         proc = 'base_device._enable'
         
-        for i in range(attempts):
+        policy = retry_policy(attempts=attempts, host=self.ip, proc=proc,
+                              deadline=self.deadline.expires)
+        
+        while True:
             
             # Attempt to enter enable mode
             try: self.connection.enable()
             except Exception as e: 
-                log('Enable failed on attempt %s.' % (str(i + 1)),
-                    ip=self.connection.ip, proc=proc, v=logging.A, error=e)
+                log('Enable failed on attempt %s.' % (str(policy.failures + 1)),
+                    ip=self.ip, proc=proc, v=logging.A, error=e)
                 
-                # At the final try, return the failed device.
-                if i >= attempts - 1: 
-                    raise ValueError('Enable failed after {} attempts'.format(str(i+1)))
+                # Rest and try again, unless retrying won't help
+                if policy.retry(e): continue
                 
-                # Otherwise rest for one second longer each time and then try again
-                sleep(i + 2)
-                continue
+                raise ValueError('Enable failed after {} attempts'.format(
+                    str(policy.failures)))
             else: 
-                log('Enable successful on attempt %s' % (str(i + 1)),
-                    ip=self.connection.ip, proc=proc, v=logging.D)
+                log('Enable successful on attempt {}', policy.failures + 1,
+                    ip=self.ip, proc=proc, v=logging.D)
                 
                 return True
     
@@ -437,6 +945,9 @@ class NetworkDevice():
                 ):
         '''Attempts to send a command to a remote device.
         
+        Failed attempts are retried according to a retry_policy, so
+        errors which a retry won't fix fail straight away.
+        
         Args:
             command (String): The command to send
             proc (String): The calling process (for wylog purposes)
@@ -444,42 +955,42 @@ class NetworkDevice():
             
         Optional Args:
             v (Integer): log alert level for a failed run
-            attempts (Integer): Number of times to try the command
+            attempts (Integer): Maximum number of times to try the command
             alert (Boolean): LIf True, log failed attempts
+            check_msg (String): Error message used when fn_check fails
         
+        Raises:
+            CircuitOpenError: If the device has failed too often already
+            ValueError: If the final attempt failed
         '''
-        for i in range(attempts):
+        policy = retry_policy(attempts=attempts, host=self.ip, proc=proc,
+                              deadline=self.deadline.expires)
+        
+        while True:
+            breaker(self.ip).check()
+            self.deadline.check('Deadline for [{}]'.format(command))
+            
             try:
-                output = self.connection.send_command_expect(command)
-            except Exception as e:
-                if i < (attempts - 1):
-                    log('Attempt: {} - Failed Command: {} - Error: {}'.format(str(i + 1),
-                        command, str(e)), proc=proc, v=logging.I)
-                    # Sleep for an increasing amount of time
-                    sleep(i * i + 1)
-                    continue
-                else:
-                    if alert: self.alert('Attempt Final: {} - Failed Command: {} - Error: {}'.format(str(i + 1),
-                        command, str(e)), proc=proc)
-                    raise ValueError('Attempt Final: {} - Failed Command: {} - Error: {}'.format(str(i + 1),
-                        command, str(e)))
-            else:
+                with self.timed('collect:' + command):
+                    output = self.connection.send_command_expect(command)
+                
                 # Evaluate the returned output using the passed lamda function
-                if fn_check(output): 
-                    log('Attempt: {} - Successful Command: {}'.format(str(i + 1), command), proc=proc, v=logging.I)
-                    return output
+                if not fn_check(output):
+                    raise CheckFailed(check_msg or 'Check failed', output)
                 
-                elif i < (attempts - 1):
-                    log('Attempt: {} - Check Failed on Command: {}'.format(
-                        str(i + 1), command), proc=proc, v=logging.I)
-                    
-                    # Sleep for an increasing amount of time
-                    sleep(i * i + 1)
-                    continue
-                else:
-                    if alert: self.alert('Attempt Final: {} - Check Failed on Command: {}'.format(str(i + 1),
-                        command), proc=proc)
-                    raise ValueError('Attempt Final: {} - Check Failed on Command: {}'.format(str(i + 1),
-                        command))
-
-    
+            except Exception as e:
+                msg = 'Attempt: {} - Failed Command: {} - Error: {}'
+                attempt = policy.failures + 1
+                
+                log(msg, attempt, command, e, proc=proc, v=logging.I)
+                if policy.retry(e): continue
+                
+                msg = 'Attempt Final: ' + msg.format(attempt, command, e)
+                if alert: self.alert(msg, proc=proc)
+                raise ValueError(msg)
+            
+            else:
+                breaker(self.ip).success()
+                log('Attempt: {} - Successful Command: {}', 
+                    policy.failures + 1, command, proc=proc, v=logging.I)
+                return output
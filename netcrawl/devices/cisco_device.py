@@ -5,30 +5,32 @@ Created on Feb 19, 2017
 '''
 
 import re
-from time import sleep
 
 from .. import util, config
+from ..retry import retry_policy, CheckFailed, EMPTY
 from ..util import parse_ip
 from ..wylog import log, logging
-from .base import NetworkDevice, Interface
+from .base import NetworkDevice, Interface, split_interface_name
+from .mac_table import parse_mac_table
 
 class CiscoDevice(NetworkDevice):
     
-    def __init__(self, *args, **kwargs):
-        NetworkDevice.__init__(self, *args, **kwargs)
-
-        self.reg_serial= re.compile(r'''
-            ^Name.*?["](.+?)["][\s\S]*?
-            Desc.*?["](.+?)["][\s\S]*?
-            SN:[ ]?(\w+)''',
-            (re.X | re.M | re.I))
+    __slots__ = ()
+    
+    reg_serial= re.compile(r'''
+        ^Name.*?["](.+?)["][\s\S]*?
+        Desc.*?["](.+?)["][\s\S]*?
+        SN:[ ]?(\w+)''',
+        (re.X | re.M | re.I))
         
     
     def _parse_hostname(self, attempts=5):
         proc = 'CiscoDevice._parse_hostname'
         log('Parsing hostname', proc=proc, v=logging.I)
         
-        output = re.search('^hostname (.+)\n', self.config, re.MULTILINE)
+        # Runs in the fetch stage while the session is open, so only
+        # look for the hostname line instead of parsing the config
+        output = re.search(r'^hostname (\S+)', self.config, re.MULTILINE)
         if output and output.group(1): 
             log('Hostname from regex: {}'.format(output.group(1)), proc=proc, v=logging.N)
             self.device_name = output.group(1)
@@ -41,21 +43,22 @@ class CiscoDevice(NetworkDevice):
             raise ValueError(proc + ': No self.connection object available')
         
         # If the hostname couldn't be parsed, get it from the prompt    
-        for i in range(attempts):
+        policy = retry_policy(attempts=attempts, host=self.ip, proc=proc,
+                              deadline=self.deadline.expires)
+        while True:
             try:
                 output = self.connection.find_prompt()
-            except ValueError:
-                log('Failed to find the prompt during attempt {}'.format(str(i + 1)),
-                    proc=proc, v=logging.A)
-                sleep(2 + i)
-                continue
-                        
-            if '#' in output: 
-                self.device_name = output.split('#')[0]
-                log('Hostname from prompt: ' + self.device_name, proc=proc, v=logging.N)
-                return True
+                if '#' not in output:
+                    raise CheckFailed('No # in prompt', output)
+            except ValueError as e:
+                log('Failed to find the prompt during attempt {}'.format(
+                    str(policy.failures + 1)), proc=proc, v=logging.A)
+                if policy.retry(e): continue
+                break
             
-            else: sleep(2 + 1)
+            self.device_name = output.split('#')[0]
+            log('Hostname from prompt: ' + self.device_name, proc=proc, v=logging.N)
+            return True
         
         # Last case scenario, return nothing
         log('Failed. No hostname found.', proc=proc, v=logging.C)
@@ -63,8 +66,8 @@ class CiscoDevice(NetworkDevice):
 
     
     
-    def _poll_for_serials(self):
-        proc = 'CiscoDevice._poll_for_serials'
+    def _fetch_serials(self):
+        proc = 'CiscoDevice._fetch_serials'
         log('Starting: Polling for serials', proc=proc, v=logging.I)
         
         # Poll the device for the serials
@@ -74,6 +77,8 @@ class CiscoDevice(NetworkDevice):
     
     
     def _parse_serials(self, raw_input):
+        '''Adds the serials in the output of 'show inventory' to the 
+        device, and returns them.'''
         proc = 'CiscoDevice._parse_serials'
         log('Starting: Parsing serials', proc=proc, v=logging.I)
         
@@ -84,23 +89,9 @@ class CiscoDevice(NetworkDevice):
         if not (output and output[0]):
             log('Failed to get serials. Re.Findall produced no results. ' + 
                 'Raw_output[:20] was: {}'.format(raw_input[:20]),
-                ip=self.connection.ip, proc=proc, v=logging.A)
+                ip=self.ip, proc=proc, v=logging.A)
             raise ValueError(proc + ': Failed to get serials. Re.Findall produced no results ' + 
-                'Raw_output was: {}'''.format(raw_input))
-                
-        else: return output
-    
-    
-    def get_serials(self):
-        proc = 'CiscoDevice.get_serials'
-        
-        log('Starting to get serials', proc=proc, v=logging.I)
-        
-        # Get the serials
-        raw_output= self._poll_for_serials()
-        
-        # Parse each serial number
-        output = self._parse_serials(raw_output)
+                'Raw_output was: {}'.format(raw_input))
         
         # Add the found serials to the parent device        
         serials = []
@@ -112,110 +103,99 @@ class CiscoDevice(NetworkDevice):
                 })
         log('Serials found: {}'.format(len(serials)), proc=proc, v=logging.N)
         self.serial_numbers.extend(serials)
-        return True
+        self.raw_inventory = raw_input
+        return serials
+    
+    
+    def get_serials(self):
+        return self._parse_serials(self._fetch_serials())
         
     
     def split_interface_name(self, interface_name):
         '''Returns a tuple containing (interface_type, interface_number)'''
-        
-        try: output = re.search(r'''
-                ([A-Za-z\-]{2,})   # An interface name, consisting of at least 2 letters
-                ([\d\/\.]+)        # The interface number, with potential backslashes
-            ''', interface_name, re.I | re.X | re.M) 
-        except: 
-            return None
-        else:
-            if output and output.re.groups == 2: 
-                return (
-                    output.group(1),
-                    output.group(2),
-                    )
-            else: 
-                return None
-    
-    
+        return split_interface_name(interface_name)
     
     
     def _get_mac_address_table(self, attempts=3):
-        '''Populates self.mac_address_table from the remote device.
+        '''Adds the MAC address table of the remote device to its interfaces.
         
         Returns:
-            Boolean: True if the command was successful
-            
-        Raises:
-            Exception: ValueError if no result was found.
+            Boolean: True if a table was found
         '''
-        proc = 'CiscoDevice._get_mac_address_table'
+        return self._parse_mac_address_table(
+            self._fetch_mac_address_table(attempts))
+    
+    
+    def _fetch_mac_address_table(self, attempts=3):
+        '''Returns the raw MAC address table, or None if the device
+        didn't return one.'''
+        proc = 'CiscoDevice._fetch_mac_address_table'
 
         log('Getting MAC address table', proc=proc, v=logging.I)
         
         # Try the two command formats
-        try: self.raw_mac_address_table = self._attempt('show mac address-table',
+        try: return self._attempt('show mac address-table',
                          proc=proc,
+                         attempts=attempts,
                          fn_check=util.contains_mac_address,
                          alert=False)
         except: 
-            try: self.raw_mac_address_table = self._attempt('show mac-address-table',
+            try: return self._attempt('show mac-address-table',
                          proc=proc,
+                         attempts=attempts,
                          fn_check=util.contains_mac_address,
                          alert=False)
             except:
                 log('No MAC addresses found.', proc=proc, v=logging.A)
-                return False
-        
-        # Parse the table
-        output = re.finditer(# #### MAC Regex ####
-            r'''            
-            (?P<mac_address>         # MAC capture group
-                (?:[0-9A-F]{2,4}[\:\-\.]){2,7}[0-9A-F]{2,4}
-            )                    
-            .*?                      # Skip all characters up to the interface
-            (?P<interface_name>      # Interface capture group
-                (?P<interface_type>
-                    [A-Za-z\-]{2,}     # At least two letters
-                )
-                (?P<interface_number>
-                    [\d\/]+          # Any combination of numbers and
-                )    
-            )
-            \s*?$                    # Match if interface is at the end of the line
-            ''',
-            self.raw_mac_address_table, flags=(re.X | re.I | re.M))
-
-        # Return a dictionary containing the MAC's and interfaces
-        self.mac_address_table = [m.groupdict() for m in output]
+                return None
+    
+    
+    def _parse_mac_address_table(self, raw_input):
+        if raw_input is None: return False
         
-        count = 0
-        for mac in self.mac_address_table:
-            # Ignore blank mac addresses
-            if mac['mac_address'] == 'ffff.ffff.ffff': continue
-            
-            count += 1 
-            
-            # Get the associated parent interface
-            interf = self.match_partial_to_full_interface(mac['interface_name'])
-           
-            # If no match was found, create a new interface for it and append it to the list
-            if not interf:
-                interf = Interface()
-                interf.interface_description = '**** Matched from MAC Address, not interface list'
-                interf.interface_name = mac['interface_name']
-                self.interfaces.append(interf)
+        self.raw_mac_address_table = raw_input
+        self._assign_mac_address_table(parse_mac_table(raw_input))
+        return True
+    
+    
+    def _assign_mac_address_table(self, entries):
+        '''Adds MAC addresses to their interfaces.
+        
+        Args:
+            entries (list): (mac, interface_name) tuples, with the MAC as
+                an integer, as returned by mac_table.parse_mac_table
+        '''
+        proc = 'CiscoDevice._assign_mac_address_table'
+        
+        # Look each port up once, not once per MAC
+        interfaces = {}
+        
+        for mac_address, interface_name in entries:
+            interf = interfaces.get(interface_name)
             
-            # Normalize the MAC
-            mac['mac_address'] = util.ucase_letters(mac['mac_address'])
+            if interf is None:
+                # Get the associated parent interface
+                interf = self.match_partial_to_full_interface(interface_name)
+               
+                # If no match was found, create a new interface for it and append it to the list
+                if not interf:
+                    interf = Interface()
+                    interf.interface_description = '**** Matched from MAC Address, not interface list'
+                    interf.interface_name = interface_name
+                    self.interfaces.append(interf)
+                
+                interfaces[interface_name] = interf
             
             # Add the MAC to the interface
-            interf.mac_address_table.append(mac['mac_address'])
+            interf.mac_address_table.append(mac_address)
         
-        log('MAC entries found: {}'.format(count), proc=proc, v=logging.N)
-        return True
+        log('MAC entries found: {}'.format(len(entries)), proc=proc, v=logging.N)
 
 
     def _get_config(self, attempts=5):
         proc = 'CiscoDevice._get_config'
         
-        log('Beginning config download from %s' % self.connection.ip, proc=proc, v=logging.I)
+        log('Beginning config download from {}', self.ip, proc=proc, v=logging.I)
 
         self.config = self._attempt('show run',
                              proc=proc,
@@ -224,22 +204,28 @@ class CiscoDevice(NetworkDevice):
                              attempts=attempts,
                              )
         
-        log('Config download successful.', ip=self.connection.ip, proc=proc, v=logging.N)
+        log('Config download successful.', ip=self.ip, proc=proc, v=logging.N)
     
     
     def _get_other_ips(self):
         proc = 'CiscoDevice._get_other_ips'
         output = re.findall(r'(?:glbp|hsrp|standby).*?(\d{1,3}(?:\.\d{1,3}){3})', self.config, re.I)
-        log('{} non-standard (virtual) ips found on the device'.format(len(output)), proc=proc, v=logging.D)
+        log('{} non-standard (virtual) ips found on the device', len(output), proc=proc, v=logging.D)
         self.other_ips.extend(output)
         
     
     def _get_cdp_neighbors(self, attempts=3):
-        proc = 'CiscoDevice._get_cdp_neighbors'
+        return self._parse_cdp_neighbors(self._fetch_cdp_neighbors(attempts))
+    
+    
+    def _fetch_cdp_neighbors(self, attempts=3):
+        proc = 'CiscoDevice._fetch_cdp_neighbors'
 
         log('Getting CDP neighbors', proc=proc, v=logging.I)
         
-        for i in range(attempts):
+        policy = retry_policy(attempts=attempts, host=self.ip, proc=proc,
+                              deadline=self.deadline.expires)
+        while True:
             # Get the CDP neighbors for the device 
             raw_cdp = self._attempt('show cdp neighbor detail',
                          proc=proc,
@@ -248,76 +234,68 @@ class CiscoDevice(NetworkDevice):
             
             # Check whether CDP is enabled at all
             if re.search(r'not enabled', raw_cdp, re.I): 
-                log('CDP not enabled on %s' % self.connection.ip, proc=proc, v=logging.C)
-                raise ValueError(proc + ': CDP not enabled on %s' % self.connection.ip)
-            
-            # Split the full 'sh cdp [...]' output into non-empty individual neighbors
-            cdp_output = list(filter(None, re.split(r'-{4,}', raw_cdp)))
-            
-            # Parse each neighbor's CDP data
-            cdp_neighbor_list = []
-            neighbor_count = 0
-            for entry in cdp_output:
-                try: cdp_neighbor = self.parse_neighbor(entry)
-                except: continue
-                else:
-                    if not cdp_neighbor: continue
-                    neighbor_count += 1
-                    
-                    # Match a neighbor to a full neighbor entry
-                    interf = self.match_partial_to_full_interface(cdp_neighbor['source_interface'])
-                    if interf: interf.neighbors.append(cdp_neighbor)
-                    
-                    # Or else add it to the list of unmatched neighbors
-                    else: cdp_neighbor_list.append(cdp_neighbor)
+                log('CDP not enabled on %s' % self.ip, proc=proc, v=logging.C)
+                raise ValueError(proc + ': CDP not enabled on %s' % self.ip)
             
-            # If no neighbors were found, try again
-            if not neighbor_count > 0:
+            # If no neighbors were returned, try again
+            if not re.search(r'Device ID', raw_cdp, re.I):
                 log('Attempt {}: No CDP neighbors found. raw_cdp[20] was: {}'.format(
-                    str(i + 1), raw_cdp[:20]), proc=proc, v=logging.A)
-                if i >= attempts: raise ValueError(proc + ': Command successful but no neighbors found from %s' % self.connection.ip)
-                continue
+                    str(policy.failures + 1), raw_cdp[:20]), proc=proc, v=logging.A)
+                if policy.retry(EMPTY): continue
+                raise ValueError(proc + ': Command successful but no neighbors found from %s' % self.ip)
+            
+            return raw_cdp
+    
+    
+    def _parse_cdp_neighbors(self, raw_cdp):
+        proc = 'CiscoDevice._parse_cdp_neighbors'
+        
+        # Split the full 'sh cdp [...]' output into non-empty individual neighbors
+        cdp_output = list(filter(None, re.split(r'-{4,}', raw_cdp)))
+        
+        # Parse each neighbor's CDP data
+        cdp_neighbor_list = []
+        neighbor_count = 0
+        for entry in cdp_output:
+            try: cdp_neighbor = self.parse_neighbor(entry)
+            except: continue
             else:
-                log('CDP neighbors found: {}'.format(neighbor_count), proc=proc, v=logging.N)
+                if not cdp_neighbor: continue
+                neighbor_count += 1
                 
-            self.neighbors = cdp_neighbor_list
-            self.raw_cdp = raw_cdp
-            return True
+                # Match a neighbor to a full neighbor entry
+                interf = self.match_partial_to_full_interface(cdp_neighbor['source_interface'])
+                if interf: interf.neighbors.append(cdp_neighbor)
+                
+                # Or else add it to the list of unmatched neighbors
+                else: cdp_neighbor_list.append(cdp_neighbor)
+        
+        if not neighbor_count > 0:
+            raise ValueError(proc + ': No neighbors could be parsed from %s' % self.ip)
+        
+        log('CDP neighbors found: {}'.format(neighbor_count), proc=proc, v=logging.N)
+            
+        self.neighbors = cdp_neighbor_list
+        self.raw_cdp = raw_cdp
+        return True
 
     
     def match_partial_to_full_interface(self, partial):
-        '''Given a partial MAC address, iterate through all of this device's
-        interfaces and match the address to an interface. Return the 
-        interface.
-        
-        1. Split the partial interface by name and number
-        2. For each interface, check if the interface name starts with the partial name
-        3. If so, check if the interface number matches the partial interface number
-        4. Return the full interface name
+        '''Given a partial interface name (like Gi1/0/1 in a MAC table),
+        return this device's matching interface, or None.
         '''
         proc = 'CiscoDevice.match_partial_to_full_interface'
         
         if not partial: return None
-        # Split the MAC
-        output = self.split_interface_name(partial)
         
         # Returns none if no matches were found (such as when the interface is "Switch"
-        if not output: return None
+        if not split_interface_name(partial): return None
         
-        # Escape any problematic strings (like Gig0/0.100)
-        output = [re.escape(x) for x in output]
-        
-        # Match expanded interface names
-        p = re.compile('^' + output[0] + '.*?' + output[1], re.I)
-        
-        # Check if the mac's interface name matches an interface
-        for interf in self.interfaces:
-            if bool(p.match(interf.interface_name)):
-                log('Partial interface {} matched interface {}'.format(
-                    partial, interf.interface_name),
-                    v=logging.D, proc=proc, ip=self.ip)
-                
-                return interf 
+        interf = self.find_interface(partial)
+        if interf:
+            log('Partial interface {} matched interface {}', 
+                partial, interf.interface_name, v=logging.D, proc=proc, ip=self.ip)
+            return interf 
         
         # If no match was found return false
         self.alert('No interface match for {}'.format(partial), proc=proc, failed=False, ip=self.ip)
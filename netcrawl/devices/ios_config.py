@@ -0,0 +1,125 @@
+'''
+Single pass parser for Cisco IOS running configs.
+
+Large chassis configs run to hundreds of KB and thousands of
+interfaces, and used to be scanned once per piece of data (the
+interface blocks, then each interface's name, description and
+address, then the whole config again for virtual IPs). Here the
+config is read line by line exactly once, and everything that the
+IosDevice collectors need is picked up on the way.
+'''
+
+import re
+
+from ..wylog import log, logging
+from .base import Interface
+
+
+# Precompiled patterns. Each is only tried on lines which already
+# contain its keyword.
+_hostname = re.compile(r'^hostname (.+)$')
+_interface_name = re.compile(r'''
+    ^\s*?            # Beginning of a line, with whitespace
+    interf.*?        # The word interface, followed by some characters
+    \b               # A word boundry
+    (                # The full interface name capture group
+    ([A-Za-z\-]{2,})   # An interface name, consisting of at least 2 letters
+    ([\d\/\.]+)        # The interface number, with potential backslashes and .'s
+    )$
+    ''', re.I | re.X)
+_description = re.compile(r'description[ ]+(.+)$', re.I)
+_ip_address = re.compile(r'ip address.*?(\d{1,3}(?:\.\d{1,3}){3})[ ]?((?:\/\d+)|(?:\d{1,3}(?:\.\d{1,3}){3}))', re.I)
+_virtual_ip = re.compile(r'(?:glbp|hsrp|standby).*?(\d{1,3}(?:\.\d{1,3}){3})', re.I)
+
+
+class ios_config():
+    '''The parts of an IOS config used by IosDevice.
+
+    Attributes:
+        hostname (str): None if the config has no hostname line
+        interfaces (list): Interface objects, in config order
+        other_ips (list): HSRP, GLBP and standby addresses, in config order
+    '''
+
+    def __init__(self):
+        self.hostname = None
+        self.interfaces = []
+        self.other_ips = []
+
+
+def parse_config(text):
+    '''Parses a running config in a single pass.
+
+    An interface block starts at a line beginning with "interface" and
+    ends at the next "!" or unindented line. Interfaces whose name
+    can't be parsed are left out, as are their addresses.
+
+    Args:
+        text (str): The output of 'show run'
+
+    Returns:
+        ios_config: The parsed config
+    '''
+    proc = 'ios_config.parse_config'
+
+    result = ios_config()
+    interf = None
+    block = None
+
+    def close_block():
+        if interf is not None:
+            interf.raw_interface = '\n'.join(block)
+            result.interfaces.append(interf)
+
+    for line in text.splitlines():
+        if not line: continue
+
+        # Leaving a section
+        if line[0] == '!' or not line[0].isspace():
+            if block is not None:
+                close_block()
+                interf = block = None
+
+            if line[0] == '!': continue
+
+        lower = line.lower()
+
+        # Virtual addresses can be anywhere in the config
+        if 'standby' in lower or 'glbp' in lower or 'hsrp' in lower:
+            vips = _virtual_ip.findall(line)
+            result.other_ips.extend(vips)
+            if vips and interf is not None and interf.virtual_ip is None:
+                interf.virtual_ip = vips[0]
+
+        if block is not None:
+            block.append(line)
+            if interf is None: continue
+
+            if (interf.interface_description is None and
+                'description' in lower):
+                match = _description.search(line)
+                if match: interf.interface_description = match.group(1)
+
+            if interf.interface_ip is None and 'ip address' in lower:
+                match = _ip_address.search(line)
+                if match:
+                    interf.interface_ip = match.group(1)
+                    interf.interface_subnet = match.group(2)
+
+        elif lower.startswith('interface'):
+            block = [line]
+            match = _interface_name.match(line)
+            if match:
+                interf = Interface(interface_name=match.group(1),
+                                   interface_type=match.group(2),
+                                   interface_number=match.group(3))
+            else:
+                log('Could not parse interface name from [{}]', line,
+                    proc=proc, v=logging.D)
+
+        elif result.hostname is None and line.startswith('hostname '):
+            result.hostname = _hostname.match(line).group(1)
+
+    if block is not None: close_block()
+
+    return result
@@ -0,0 +1,132 @@
+'''
+Parser for 'show mac address-table' output.
+
+Core switches can return tens of thousands of rows, and running one
+large regex over the whole table (and then normalizing every MAC a
+character at a time) costs seconds per device. The known IOS and
+NX-OS layouts are read column-wise instead: a row is split on
+whitespace, its MAC is picked out by shape and converted straight to
+an integer, and the port is taken from the last column. Only tables
+in an unknown layout are parsed with the regex.
+'''
+
+import re
+
+from ..wylog import log, logging
+
+
+# The broadcast address, which is never a real host
+BROADCAST = 0xFFFFFFFFFFFF
+
+# Characters removed from a MAC before it is read as hex
+_separators = str.maketrans('', '', '.:-')
+
+# A port that MACs can be assigned to: at least two letters followed
+# by the number, like Gi1/0/1 or Po10. Rules out CPU, Router,
+# sup-eth1(R) and the like.
+_port = re.compile(r'[A-Za-z\-]{2,}[\d\/]+$')
+
+# Used for tables in an unknown layout
+_mac_row = re.compile(r'''
+    (?P<mac_address>         # MAC capture group
+        (?:[0-9A-F]{2,4}[\:\-\.]){2,7}[0-9A-F]{2,4}
+    )
+    .*?                      # Skip all characters up to the interface
+    (?P<interface_name>      # Interface capture group
+        (?P<interface_type>
+            [A-Za-z\-]{2,}     # At least two letters
+        )
+        (?P<interface_number>
+            [\d\/]+          # Any combination of numbers and
+        )
+    )
+    \s*?$                    # Match if interface is at the end of the line
+    ''', re.X | re.I | re.M)
+
+
+def _is_cisco_mac(token):
+    '''True for MACs in the Cisco notation, like 0011.2233.4455'''
+    return len(token) == 14 and token[4] == '.' and token[9] == '.'
+
+
+def _ports_are_last(text):
+    '''Looks for the column header of a known layout, and returns
+    True if it was found and its last column is the port.'''
+
+    for line in text.splitlines():
+        lower = line.lower()
+        if 'mac address' in lower or 'mac-address' in lower:
+            header = lower.split()
+            if header and header[-1].startswith('port'): return True
+    return False
+
+
+def parse_mac_table(text):
+    '''Parses the MAC address table of a Cisco device.
+
+    Args:
+        text (str): The output of 'show mac address-table'
+
+    Returns:
+        list: Of (mac, interface_name) tuples, where mac is an integer.
+            Broadcast entries and entries on ports which aren't
+            interfaces (CPU, sup-eth1 etc.) are left out.
+    '''
+    proc = 'mac_table.parse_mac_table'
+
+    if not text: return []
+
+    if not _ports_are_last(text):
+        log('Unknown MAC table layout. Using regex.', proc=proc, v=logging.I)
+        return parse_mac_table_regex(text)
+
+    output = []
+
+    # Most tables only have a few hundred distinct ports
+    ports = {}
+
+    for line in text.splitlines():
+        tokens = line.split()
+        if len(tokens) < 3: continue
+
+        # The MAC is in the second column, or the third when NX-OS
+        # flags the entry with a * or G
+        for mac in tokens[:3]:
+            if _is_cisco_mac(mac): break
+        else: continue
+
+        port = tokens[-1]
+
+        # Static entries can list several ports
+        if ',' in port: port = port.rsplit(',', 1)[1]
+
+        valid = ports.get(port)
+        if valid is None:
+            valid = ports[port] = bool(_port.match(port))
+        if not valid: continue
+
+        try: mac = int(mac.translate(_separators), 16)
+        except ValueError: continue
+
+        if mac == BROADCAST: continue
+        output.append((mac, port))
+
+    return output
+
+
+def parse_mac_table_regex(text):
+    '''Parses a MAC address table in any layout, as long as the port
+    is at the end of each line. Returns the same as parse_mac_table.'''
+
+    output = []
+    for m in _mac_row.finditer(text):
+        digits = m.group('mac_address').translate(_separators)
+
+        # Only 48 bit MACs
+        if len(digits) != 12: continue
+
+        mac = int(digits, 16)
+        if mac == BROADCAST: continue
+        output.append((mac, m.group('interface_name')))
+
+    return output
@@ -4,68 +4,148 @@ Created on Feb 18, 2017
 @author: Wyko
 '''
 
-import re
+import json, re
 
 from . import Interface, CiscoDevice
+from .mac_table import BROADCAST
+from .. import util
 from ..wylog import log, logging
 
 
+class JsonUnsupported(ValueError):
+    '''Raised when the device rejects a '| json' command'''
+
+
+def json_rows(data, table, row):
+    '''Returns the rows of an NX-OS JSON table as a list. NX-OS 
+    returns a dict instead of a list when there is only one row, and
+    leaves the table out entirely when there are none.'''
+    tables = data.get(table, [])
+    if isinstance(tables, dict): tables = [tables]
+    
+    rows = []
+    for t in tables:
+        r = t.get(row, [])
+        rows.extend([r] if isinstance(r, dict) else r)
+    return rows
+
+
 class NxosDevice(CiscoDevice):
     
+    __slots__ = ()
+    
+    def _attempt_json(self, command, proc, **kwargs):
+        '''Sends a command with '| json' appended and decodes the
+        output. 
+        
+        Raises:
+            JsonUnsupported: If the device doesn't support JSON output
+            ValueError: If the output could not be decoded
+        '''
+        output = self._attempt(command + ' | json', proc=proc, **kwargs)
+        
+        # Skip anything the device printed before the object
+        start = output.find('{')
+        if start == -1:
+            if re.search(r'invalid|syntax error|^\s*%', output, re.I | re.M):
+                raise JsonUnsupported('[{}] does not support JSON output'.format(command))
+            raise ValueError('No JSON object in output of [{}]'.format(command))
+        
+        return json.JSONDecoder().raw_decode(output, start)[0]
+    
     
-    def get_serials(self):
-        '''Returns serials based on XML output'''
-        proc = 'NxosDevice.get_serials'
+    def _decode_stored(self, method, raw):
+        '''JSON output is stored re-encoded, with each interface 
+        stored on its own'''
+        proc = 'NxosDevice._decode_stored'
+        
+        if method == '_get_interfaces':
+            # Interfaces added from the MAC table, or stored without 
+            # raw output, have nothing to decode
+            raw = [x for x in raw or () if x is not None]
+            
+            # Interfaces which were parsed from the config
+            if raw and not raw[0].lstrip().startswith('{'): return None
+            
+            try: rows = [json.loads(x) for x in raw]
+            except ValueError as e:
+                log('Stored interfaces could not be decoded. Parsing the config.',
+                    proc=proc, v=logging.A, ip=self.ip, error=e)
+                return None
+            
+            if not rows:
+                log('No stored JSON interfaces. Parsing the config.',
+                    proc=proc, v=logging.A, ip=self.ip)
+                return None
+            return {'TABLE_interface': {'ROW_interface': rows}}
+        
+        if raw.lstrip().startswith('{'): return json.loads(raw)
+        return raw
+    
+    
+    def _fetch_serials(self):
+        '''Returns the decoded JSON inventory, or the text output on
+        devices which don't support JSON.'''
+        proc = 'NxosDevice._fetch_serials'
         
         log('Starting to get serials', proc=proc, v=logging.I)
         
-        output = self._attempt('show inv | xml | sec <ROW_inv>',
-             proc=proc,
-             fn_check=lambda x: bool(re.search(r'ROW_inv', x, re.I)))
+        try: return self._attempt_json('show inventory', proc=proc,
+                                       fn_check=lambda x: bool(x.strip()))
+        except JsonUnsupported:
+            log('JSON not supported. Polling text.', proc=proc, v=logging.I)
+            return CiscoDevice._fetch_serials(self)
+    
+    
+    def _parse_serials(self, raw_input):
+        '''Returns serials based on JSON output'''
+        proc = 'NxosDevice._parse_serials'
+        
+        if isinstance(raw_input, str):
+            return CiscoDevice._parse_serials(self, raw_input)
         
-        # Split the output into a list of dicts
-        self.serial_numbers = [{x: y for (x, y) in re.findall(r'<(.+?)>(.*?)<\/\1>', entry, re.I)} 
-                    for entry in re.split(r'<RoW_inv>', output, flags=(re.I | re.M)) if entry.strip()]
+        self.serial_numbers = [{k: str(v).strip() for k, v in row.items()}
+                               for row in json_rows(raw_input, 'TABLE_inv', 'ROW_inv')]
+        self.raw_inventory = json.dumps(raw_input)
         
         log('Serials found: {}.'.format(len(self.serial_numbers)), proc=proc, v=logging.N)
-
+        return self.serial_numbers
+    
     
     def _get_interfaces(self):
-        '''Tries the two ways to parse NXOS'''
-        proc = 'NxosDevice._get_interfaces'
-        
-        try: self.get_interfaces_xml()
-        except: 
-            log('XML parsing failed. Attempting config parsing.',
-                proc=proc, v=logging.I)
-            self.get_interfaces_config()
+        '''Gets the interfaces from JSON output. The config is only 
+        parsed on devices which don't support JSON.'''
+        return self._parse_interfaces(self._fetch_interfaces())
+    
+    
+    def _fetch_interfaces(self):
+        '''Returns the decoded JSON, or None if the device doesn't 
+        support it and the config has to be parsed instead.'''
+        proc = 'NxosDevice._fetch_interfaces'
         
+        log('Getting JSON interface data', proc=proc, v=logging.I)
         
-    def get_interfaces_xml(self):
-        proc = 'NxosDevice.get_interfaces_xml'
+        try: return self._attempt_json('show interface', proc=proc,
+                                       fn_check=lambda x: bool(x.strip()))
+        except JsonUnsupported: 
+            log('JSON not supported. Attempting config parsing.',
+                proc=proc, v=logging.I)
+            return None
         
-        log('Getting XML interface data', proc=proc, v=logging.I)
         
-        # Poll the device for interfaces
-        output = self._attempt('show interface | xml | sec ROW_interface',
-                 proc=proc, fn_check=lambda x: '<ROW_interface>' in x)
+    def _parse_interfaces(self, raw_input):
+        proc = 'NxosDevice._parse_interfaces'
         
-        # Split the results into individual interfaces
-        output = [x for x in output.strip().split('<ROW_interface>') if not x.strip() == '']
+        if raw_input is None: return self.get_interfaces_config()
         
-        # Parse each interface into variables
-        re_comp = re.compile(r'<(.+?)>(.*?)<\/\1>')
         interfaces = []
-        for interf in output:
-            
-            # Parse the interface data
-            entries = dict(re_comp.findall(interf))
+        for entries in json_rows(raw_input, 'TABLE_interface', 'ROW_interface'):
             i = Interface()
             
-            i.raw_interface = interf
+            i.raw_interface = json.dumps(entries)
             
             # Set the interface variables based on the results
-            i.interface_name = entries.pop('interface', None)
+            i.interface_name = entries.get('interface')
             if not i.interface_name: continue
             
             x = self.split_interface_name(i.interface_name)
@@ -73,15 +153,13 @@ class NxosDevice(CiscoDevice):
                 i.interface_type = x[0]
                 i.interface_number = x[1]
             
-            i.interface_ip = next((v for k, v in entries.items() 
-                                if k == 'svi_ip_addr' or k == 'eth_ip_addr'), None) 
-            
-            i.interface_description = next((v for k, v in entries.items() 
-                                if k == 'svi_desc' or k == 'desc'), None)
+            i.interface_ip = entries.get('svi_ip_addr') or entries.get('eth_ip_addr')
+            i.interface_description = entries.get('svi_desc') or entries.get('desc')
             
-            i.interface_subnet = entries.pop('svi_ip_mask', None)
+            subnet = entries.get('svi_ip_mask') or entries.get('eth_ip_mask')
+            if subnet is not None: i.interface_subnet = str(subnet)
             
-            i.parent_interface_name = entries.pop('eth_bundle', None)
+            i.parent_interface_name = entries.get('eth_bundle')
             
             interfaces.append(i)
         
@@ -95,8 +173,132 @@ class NxosDevice(CiscoDevice):
             raise ValueError(proc + ': No interfaces found.')     
             
         self.merge_interfaces(interfaces)
+    
+    
+    def _fetch_cdp_neighbors(self, attempts=3):
+        '''Returns the decoded JSON, or the text output on devices 
+        which don't support JSON.'''
+        proc = 'NxosDevice._fetch_cdp_neighbors'
+        
+        log('Getting CDP neighbors', proc=proc, v=logging.I)
+        
+        try: return self._attempt_json('show cdp neighbors detail', 
+                                       proc=proc,
+                                       attempts=attempts,
+                                       fn_check=lambda x: bool(x.strip()))
+        except JsonUnsupported:
+            log('JSON not supported. Polling text.', proc=proc, v=logging.I)
+            return CiscoDevice._fetch_cdp_neighbors(self, attempts)
+    
+    
+    def _parse_cdp_neighbors(self, raw_input):
+        proc = 'NxosDevice._parse_cdp_neighbors'
+        
+        if isinstance(raw_input, str):
+            return CiscoDevice._parse_cdp_neighbors(self, raw_input)
+        
+        rows = json_rows(raw_input, 'TABLE_cdp_neighbor_detail_info', 
+                         'ROW_cdp_neighbor_detail_info')
+        if not rows:
+            raise ValueError(proc + ': Command successful but no neighbors found from %s' % self.ip)
+        
+        cdp_neighbor_list = []
+        for row in rows:
+            cdp_neighbor = self.parse_neighbor_json(row)
+            
+            # Match a neighbor to a full neighbor entry
+            interf = self.match_partial_to_full_interface(cdp_neighbor['source_interface'])
+            if interf: interf.neighbors.append(cdp_neighbor)
+            
+            # Or else add it to the list of unmatched neighbors
+            else: cdp_neighbor_list.append(cdp_neighbor)
+        
+        log('CDP neighbors found: {}'.format(len(rows)), proc=proc, v=logging.N)
+        
+        self.neighbors = cdp_neighbor_list
+        self.raw_cdp = json.dumps(raw_input)
+        return True
+    
+    
+    def parse_neighbor_json(self, row):
+        '''Accepts one ROW_cdp_neighbor_detail_info entry and parses it
+        into the same dictionary as parse_neighbor.'''
+        
+        # Management and interface addresses may each be a list
+        ip_list = []
+        for key in ('v4mgmtaddr', 'v4addr'):
+            value = row.get(key) or []
+            if isinstance(value, str): value = [value]
+            ip_list.extend(x for x in value if x not in ip_list)
         
+        device_name = row.get('sysname') or row.get('device_id') or ''
+        device_name = device_name.split('(')[0].split('.')[0]
         
+        return {
+            'device_name': device_name,
+            'netmiko_platform': self.parse_netmiko_platform(
+                ' '.join((row.get('platform_id', ''), row.get('version', '')))),
+            'system_platform': row.get('platform_id'),
+            'source_interface': row.get('intf_id'),
+            'neighbor_interface': row.get('port_id'),
+            'software': row.get('version'),
+            'raw_cdp': json.dumps(row),
+            'ip_list': ip_list,
+            }
+    
+    
+    def _fetch_mac_address_table(self, attempts=3):
+        '''Returns the decoded JSON MAC address table, the text output 
+        on devices which don't support JSON, or None if the device
+        didn't return a table.'''
+        proc = 'NxosDevice._fetch_mac_address_table'
+        
+        log('Getting MAC address table', proc=proc, v=logging.I)
+        
+        try: return self._attempt_json('show mac address-table', 
+                                       proc=proc,
+                                       attempts=attempts,
+                                       fn_check=lambda x: bool(x.strip()),
+                                       alert=False)
+        except JsonUnsupported:
+            log('JSON not supported. Polling text.', proc=proc, v=logging.I)
+            return CiscoDevice._fetch_mac_address_table(self, attempts)
+        
+        # Truncated or garbled output is not an empty table
+        except json.JSONDecodeError as e:
+            log('Could not decode the JSON MAC address table. Polling text.',
+                proc=proc, v=logging.A, error=e)
+            return CiscoDevice._fetch_mac_address_table(self, attempts)
+        except ValueError:
+            log('No MAC addresses found.', proc=proc, v=logging.A)
+            return None
+    
+    
+    def _parse_mac_address_table(self, raw_input):
+        '''Adds the MAC address table to the interfaces, from JSON output'''
+        
+        if raw_input is None or isinstance(raw_input, str):
+            return CiscoDevice._parse_mac_address_table(self, raw_input)
+        
+        self.raw_mac_address_table = json.dumps(raw_input)
+        
+        entries = []
+        for row in json_rows(raw_input, 'TABLE_mac_address', 'ROW_mac_address'):
+            interface_name = row.get('disp_port')
+            if not row.get('disp_mac_addr') or not interface_name: continue
+            
+            # Skip the CPU, router and drop entries
+            x = self.split_interface_name(interface_name)
+            if not x or x[0] + x[1] != interface_name: continue
+            
+            try: mac = util.mac_to_int(row['disp_mac_addr'])
+            except ValueError: continue
+            if mac == BROADCAST: continue
+            
+            entries.append((mac, interface_name))
+        
+        self._assign_mac_address_table(entries)
+        return True
     
     
     def get_interfaces_config(self):
@@ -0,0 +1,100 @@
+'''
+Collection profiles decide which optional collectors run on a device
+during a crawl, and how often.
+
+A profile maps each collector to an interval: 1 runs it every crawl,
+N runs it every Nth crawl and 0 never runs it. Intervals are offset by
+a hash of the device IP so that, for example, MAC tables taken every
+7th crawl are spread evenly over the week instead of all being pulled
+on the same night.
+'''
+
+import re, zlib
+
+from .. import config
+from ..wylog import log, logging
+
+
+# Optional collectors and the device methods which implement them,
+# in the order they are run
+COLLECTORS = (
+    ('serials', 'get_serials'),
+    ('other_ips', '_get_other_ips'),
+    ('cdp', '_get_cdp_neighbors'),
+    ('mac', '_get_mac_address_table'),
+    )
+
+
+def get_profile(name=None):
+    '''Returns the collector intervals of a named profile.
+
+    Keyword Args:
+        name (str): The profile name. Uses config.cc.collection_profile
+            by default
+
+    Raises:
+        KeyError: If the profile does not exist
+    '''
+    if name is None: name = config.cc.collection_profile
+
+    if name not in config.cc.collection_profiles:
+        raise KeyError('Collection profile [{}] does not exist. Choose from: {}'.format(
+            name, ', '.join(sorted(config.cc.collection_profiles))))
+
+    return dict(config.cc.collection_profiles[name])
+
+
+def device_profile(device, name=None):
+    '''Returns the collector intervals for one device. Entries in
+    config.cc.collection_overrides are applied on top of the profile
+    when their key equals the device's netmiko_platform, or when the
+    key is a regex which matches the device name (for roles like
+    '-dist-' or '^core').'''
+
+    profile = get_profile(name)
+
+    for key, intervals in config.cc.collection_overrides.items():
+        if key == device.netmiko_platform:
+            profile.update(intervals)
+        elif device.device_name and re.search(key, device.device_name, re.I):
+            profile.update(intervals)
+
+    return profile
+
+
+def is_due(interval, ip, run_number=None):
+    '''Returns True if a collector with the given interval should run
+    on the device with this IP during this crawl. 
+    
+    Crawls are numbered by device_db.start_run, which keeps counting 
+    across crawls, including after the databases are cleaned. Run 
+    number 0 is not a crawl (e.g. a single run, -sS), and runs every
+    collector which isn't turned off.'''
+
+    if not interval: return False
+    if interval == 1: return True
+
+    if run_number is None: run_number = config.cc.run_number
+    if not run_number: return True
+
+    # Spread the devices out over the interval
+    offset = zlib.crc32(str(ip).encode()) if ip else 0
+    return (run_number + offset) % interval == 0
+
+
+def collection_plan(device, name=None, run_number=None):
+    '''Returns the names of the device methods to run for the optional
+    collection phase of this crawl.'''
+    proc = 'profiles.collection_plan'
+
+    profile = device_profile(device, name)
+
+    plan = []
+    for collector, method in COLLECTORS:
+        if is_due(profile.get(collector, 1), device.ip, run_number):
+            plan.append(method)
+        else:
+            log('Skipping [{}] collection this run', collector,
+                proc=proc, v=logging.I, ip=device.ip)
+
+    return plan
@@ -1,10 +1,11 @@
 from psycopg2 import errorcodes
-import psycopg2, time, traceback
+import psycopg2, time, traceback, json, os, re
+from functools import lru_cache
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import DictCursor, RealDictCursor, execute_values
 
-from . import config
-from .wylog import log, logf, logging
+from . import config, util
+from .wylog import log, logf, logging, lazy, metrics
 from contextlib import contextmanager
 
 
@@ -13,6 +14,185 @@ retry_args = {'stop_max_delay': 60000,  # Stop after 60 seconds
              'wait_exponential_max': 10000,
              }
 
+# Statement templates are cut off after this many characters
+TEMPLATE_LENGTH = 240
+
+_sql_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_sql_space = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def statement_template(query):
+    '''Returns a statement with its literals replaced by ? and its 
+    whitespace collapsed, so that statements which only differ in 
+    their values (or table names built with format) are counted
+    together'''
+    if isinstance(query, bytes): query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str): query = str(query)
+    
+    query = _sql_space.sub(' ', _sql_literals.sub('?', query)).strip()
+    if len(query) > TEMPLATE_LENGTH: query = query[:TEMPLATE_LENGTH - 3] + '...'
+    return query
+
+
+def _explain(conn, query, params):
+    '''Returns the plan of a statement, without running it. Statements
+    which can't be explained on their own return None.'''
+    if isinstance(query, bytes): query = query.decode('utf-8', 'replace')
+    
+    # EXPLAIN only covers the first of several statements, and the
+    # rest would run again
+    if ';' in query.strip().rstrip(';'): return None
+    if not re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', query, re.I):
+        return None
+    
+    # Don't let a failed EXPLAIN abort the caller's transaction
+    savepoint = (not conn.autocommit and conn.get_transaction_status() ==
+                 psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+    
+    with psycopg2.extensions.cursor(conn) as cur:
+        if savepoint: cur.execute('SAVEPOINT netcrawl_explain')
+        try: 
+            cur.execute('EXPLAIN ' + query, params)
+            return '\n'.join(row[0] for row in cur.fetchall())
+        except psycopg2.Error as e:
+            if savepoint: cur.execute('ROLLBACK TO SAVEPOINT netcrawl_explain')
+            return 'EXPLAIN failed: {}'.format(str(e).strip())
+        finally:
+            if savepoint: cur.execute('RELEASE SAVEPOINT netcrawl_explain')
+
+
+def _record_slow(cur, template, query, params, seconds):
+    '''Writes a statement which took longer than 
+    config.cc.sql_slow_threshold to config.cc.sql_slow_path, with its
+    parameters and plan'''
+    proc = 'io_sql._record_slow'
+    
+    metrics.count('sql.slow')
+    log('Slow statement took [{:.3f}] seconds: [{}]', seconds, template, 
+        proc=proc, v=logging.I)
+    
+    plan = None
+    if not isinstance(params, list): plan = _explain(cur.connection, query, params)
+    
+    if isinstance(query, bytes): query = query.decode('utf-8', 'replace')
+    entry = {'time': time.strftime(config.cc.pretty_time),
+             'pid': os.getpid(),
+             'seconds': round(seconds, 6),
+             'template': template,
+             'statement': query,
+             'parameters': repr(params)[:2000],
+             'plan': plan,
+             }
+    
+    directory = os.path.dirname(config.cc.sql_slow_path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    with open(config.cc.sql_slow_path, 'a') as outfile:
+        outfile.write(json.dumps(entry) + '\n')
+
+
+class _timed():
+    '''Times each statement a cursor runs, in the metrics registry as
+    'sql:<template>' (see statement_template), and records statements 
+    slower than config.cc.sql_slow_threshold'''
+    
+    def _observe(self, query, params, seconds, error):
+        template = statement_template(query)
+        metrics.observe('sql:' + template, seconds, error)
+        
+        threshold = config.cc.sql_slow_threshold
+        if error or threshold is None or seconds < threshold: return
+        
+        try: _record_slow(self, template, query, params, seconds)
+        except Exception as e:
+            log('Could not record slow statement: {}', repr(e),
+                proc='io_sql._timed', v=logging.A)
+    
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        error = True
+        try:
+            output = super().execute(query, vars)
+            error = False
+            return output
+        finally: self._observe(query, vars, time.perf_counter() - start, error)
+    
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        start = time.perf_counter()
+        error = True
+        try:
+            output = super().executemany(query, vars_list)
+            error = False
+            return output
+        finally: self._observe(query, vars_list, time.perf_counter() - start, error)
+
+
+class timed_cursor(_timed, psycopg2.extensions.cursor): pass
+class timed_dict_cursor(_timed, DictCursor): pass
+class timed_real_dict_cursor(_timed, RealDictCursor): pass
+
+_timed_cursors = {
+    psycopg2.extensions.cursor: timed_cursor,
+    DictCursor: timed_dict_cursor,
+    RealDictCursor: timed_real_dict_cursor,
+    }
+
+
+class timed_connection(psycopg2.extensions.connection):
+    '''A connection whose cursors time every statement'''
+    
+    def cursor(self, *args, **kwargs):
+        factory = (kwargs.get('cursor_factory') or self.cursor_factory or 
+                   psycopg2.extensions.cursor)
+        kwargs['cursor_factory'] = _timed_cursors.get(factory, factory)
+        return psycopg2.extensions.connection.cursor(self, *args, **kwargs)
+
+
+def connect(**kwargs):
+    '''Opens a database connection with a timed_connection'''
+    return psycopg2.connect(connection_factory=timed_connection, **kwargs)
+
+
+def statement_summary(limit=None):
+    '''Returns the statements timed so far, costliest first.
+    
+    Keyword Args:
+        limit (int): Return at most this many
+    
+    Returns:
+        list: Of dicts with the statement template, and its count, 
+            errors, total, mean, p50, p95, p99 and max time
+    '''
+    output = []
+    for name, summary in metrics.summary().items():
+        if not name.startswith('sql:'): continue
+        summary['statement'] = name[4:]
+        output.append(summary)
+    
+    output.sort(key=lambda x: x['total'], reverse=True)
+    return output[:limit] if limit else output
+
+
+def log_statement_summary(limit=None):
+    '''Logs the costliest statements of a run, one line each'''
+    proc = 'io_sql.log_statement_summary'
+    
+    if limit is None: limit = config.cc.sql_summary_size
+    if not limit: return
+    
+    statements = statement_summary()
+    if not statements: return
+    
+    log('[{}] statements ran [{}] times in [{:.3f}] seconds. Costliest:',
+        len(statements), sum(x['count'] for x in statements), 
+        sum(x['total'] for x in statements), proc=proc, v=logging.H)
+    
+    for s in statements[:limit]:
+        log('[{:.3f}]s total, [{}] calls, p95 [{:.4f}]s, max [{:.4f}]s: {}',
+            s['total'], s['count'], s['p95'], s['max'], s['statement'],
+            proc=proc, v=logging.H)
+
             
 class sql_logger():
     '''Utility class to enable logging of SQL execute statements, 
@@ -25,30 +205,31 @@ class sql_logger():
         self.ignore_duplicates = ignore_duplicates
         
     def __enter__(self):
-        log('Beginning execution in [{}]'.format(self.proc),
-            proc=self.proc, v=logging.D)
+        log('Beginning execution in [{}]', self.proc, proc=self.proc, v=logging.D)
         self.start = time.time()
         
     def __exit__(self, ty, val, tb):
         end = time.time()
+        metrics.observe('sql.{}'.format(self.proc), end - self.start, 
+                        error=ty is not None)
         
         # Ignore the problem if we just added a duplicate
         if ty is None:
-            log('SQL execution in [{}] completed without error. Duration: [{:.3f}]'.format(
-                self.proc, end - self.start), proc=self.proc, v=logging.D)
+            log('SQL execution in [{}] completed without error. Duration: [{:.3f}]',
+                self.proc, end - self.start, proc=self.proc, v=logging.D)
         
         # Handle duplicate entry violations    
         elif (ty is psycopg2.IntegrityError) and self.ignore_duplicates:
             if (val.pgcode in (errorcodes.UNIQUE_VIOLATION,
                                errorcodes.NOT_NULL_VIOLATION,
                 )):
-                log('SQL execution in [{}] completed. Null or Unique constraint hit [{}]. Duration: [{:.3f}]'.format(
-                    self.proc, val.pgerror, end - self.start), proc=self.proc, v=logging.I)
+                log('SQL execution in [{}] completed. Null or Unique constraint hit [{}]. Duration: [{:.3f}]',
+                    self.proc, val.pgerror, end - self.start, proc=self.proc, v=logging.I)
                 return True
                 
         else:
-            log('Finished SQL execution in [{}] after [{:.3f}] seconds with [{}] error [{}]. Traceback: [{}]'.format(
-                self.proc, end - self.start, ty.__name__, str(val), traceback.format_tb(tb)),
+            log('Finished SQL execution in [{}] after [{:.3f}] seconds with [{}] error [{}]. Traceback: [{}]',
+                self.proc, end - self.start, ty.__name__, val, lazy(traceback.format_tb, tb),
                 proc=self.proc, v=logging.I)
 
 
@@ -74,7 +255,7 @@ class sql_database():
         else:
             log('Database [{}] exists, proceeding to delete'.format(dbname), v=logging.I, proc= proc)
         
-        with psycopg2.connect(**config.cc.postgres.args) as conn:
+        with connect(**config.cc.postgres.args) as conn:
             with conn.cursor() as cur, sql_logger(proc):
         
                 cur.execute('''
@@ -87,7 +268,7 @@ class sql_database():
                 '''.format(dbname))
                 
         # Create a new isolated transaction block to drop the database                
-        with psycopg2.connect(**config.cc.postgres.args) as conn:
+        with connect(**config.cc.postgres.args) as conn:
             conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)    
             with conn.cursor() as cur, sql_logger(proc):
                 cur.execute('DROP DATABASE {0}'.format(dbname))
@@ -125,7 +306,7 @@ class sql_database():
         '''Returns true is the specified database exists'''
         proc = 'sql_database._database_exists'
         
-        with psycopg2.connect(**config.cc.postgres.args) as conn:
+        with connect(**config.cc.postgres.args) as conn:
             with conn.cursor() as cur, sql_logger(proc):
                 cur.execute("SELECT 1 from pg_database WHERE datname= %s", (db,))
                 return bool(cur.fetchone()) 
@@ -138,7 +319,7 @@ class sql_database():
         if self.database_exists(new_db):
             return True
         else:
-            with psycopg2.connect(**config.cc.postgres.args) as conn:
+            with connect(**config.cc.postgres.args) as conn:
                 conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
                 with conn.cursor() as cur, sql_logger(proc):
                     cur.execute('CREATE DATABASE {};'.format(new_db))
@@ -213,7 +394,7 @@ class main_db(sql_database):
         try: self.create_database(self.dbname)
         except FileExistsError: pass
         
-        self.conn = psycopg2.connect(**config.cc.main.args)
+        self.conn = connect(**config.cc.main.args)
         self.create_table(drop_tables=self.clean)
         self.ignore_visited = kwargs.get('ignore_visited', True)
         
@@ -354,11 +535,11 @@ class main_db(sql_database):
         with self.conn, self.conn.cursor() as cur:
             for ip in _device_d['ip_list']:
                 if sql_database.ip_exists(self, ip, 'visited'):
-                    log('[{}] already in visited table'.format(ip),
+                    log('[{}] already in visited table', ip,
                         v=logging.I, proc=proc)
                 
                 if sql_database.ip_exists(self, ip, 'pending'):
-                    log('[{}] already in pending table'.format(ip),
+                    log('[{}] already in pending table', ip,
                         v=logging.I, proc=proc)
                     continue
                 
@@ -429,8 +610,8 @@ class main_db(sql_database):
             for neighbor in device.all_neighbors():           
                 
                 if not neighbor.get('netmiko_platform'):
-                    log('Neighbor [{}] has no platform. Skipping'.format(
-                        neighbor), v=logging.I, proc=proc)
+                    log('Neighbor [{}] has no platform. Skipping', neighbor,
+                        v=logging.I, proc=proc)
                     continue
                     
                 # Add it to the list of ips to check
@@ -446,7 +627,7 @@ class main_db(sql_database):
                 cur.execute('''
                     DROP TABLE IF EXISTS 
                         pending, 
-                        visited 
+                        visited
                     CASCADE;
                     ''')
                 
@@ -561,7 +742,7 @@ class main_db(sql_database):
                 
                 # Get the IP's from the device 
                 ip_list = _device.get_ips()
-                log('{} has {} ip(s)'.format(_device.device_name, len(ip_list)),
+                log('{} has {} ip(s)', _device.device_name, len(ip_list),
                     proc=proc, v=logging.I)
                 
                 # For failed devices which couldn't be fully polled:
@@ -604,7 +785,7 @@ class main_db(sql_database):
         else: return _execute(_list, cur)
         
         
-        log('Added {} devices to visited table'.format(len(_list)),
+        log('Added {} devices to visited table', len(_list),
             proc=proc, v=logging.I)
         return True
     
@@ -638,7 +819,7 @@ class device_db(sql_database):
         try: self.create_database(self.dbname)
         except FileExistsError: pass
 
-        self.conn = psycopg2.connect(**config.cc.inventory.args)
+        self.conn = connect(**config.cc.inventory.args)
         self.create_table(drop_tables=self.clean)
         
     
@@ -845,28 +1026,445 @@ class device_db(sql_database):
             for serial in _device.serial_numbers:
                 self.insert_serial_entry(device_id, serial, cur)
             
-            # Add all of the device's interfaces            
-            for interf in _device.interfaces:
-                interface_id = self.insert_interface_entry(device_id, interf, cur)
-                
-                # Add all the interface's mac addresses
-                for mac_address in interf.mac_address_table:
-                    mac_id = self.insert_mac_entry(device_id, interface_id, mac_address, cur)
-                
-                # Add each neighbor + ip that was matched to an interface
-                for neighbor in interf.neighbors:
-                    neighbor_id = self.insert_neighbor_entry(device_id, interface_id, neighbor, cur)
-                    for n_ip in neighbor: self.insert_neighbor_ip_entry(neighbor_id, n_ip, cur)
-                
-            # Add each neighbor + ip not matched to an interface
-            for neighbor in _device.neighbors:
-                neighbor_id = self.insert_neighbor_entry(device_id, None, neighbor, cur)
-                for n_ip in neighbor: self.insert_neighbor_ip_entry(neighbor_id, n_ip, cur)
+            self.insert_interface_entries(device_id, _device, cur)
                     
         self.conn.commit()
         return device_id
     
     
+    def insert_interface_entries(self, device_id, device, cur):
+        '''Adds the interfaces of a device, with their MAC addresses 
+        and neighbors, and the neighbors not matched to an interface'''
+        
+        # Add all of the device's interfaces            
+        for interf in device.interfaces:
+            interface_id = self.insert_interface_entry(device_id, interf, cur)
+            
+            # Add all the interface's mac addresses
+            for mac_address in interf.mac_address_table:
+                mac_id = self.insert_mac_entry(device_id, interface_id, mac_address, cur)
+            
+            # Add each neighbor + ip that was matched to an interface
+            for neighbor in interf.neighbors:
+                neighbor_id = self.insert_neighbor_entry(device_id, interface_id, neighbor, cur)
+                for n_ip in neighbor.get('ip_list') or []: 
+                    self.insert_neighbor_ip_entry(neighbor_id, n_ip, cur)
+            
+        # Add each neighbor + ip not matched to an interface
+        for neighbor in device.neighbors:
+            neighbor_id = self.insert_neighbor_entry(device_id, None, neighbor, cur)
+            for n_ip in neighbor.get('ip_list') or []: 
+                self.insert_neighbor_ip_entry(neighbor_id, n_ip, cur)
+    
+    
+    def get_transport_history(self, ip):
+        '''Returns how the device with this IP was last reached, so
+        that cli.connect can try that transport first.
+        
+        Args:
+            ip (str): The management IP, or any interface IP, of the device
+            
+        Returns:
+            dict: Containing 'transport', 'tcp_22' and 'tcp_23', or an 
+                empty dict if the device has not been polled before
+        '''
+        proc = 'device_db.get_transport_history'
+        
+        with self.conn, self.conn.cursor(cursor_factory=RealDictCursor) as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT transport, tcp_22, tcp_23
+                FROM devices
+                WHERE 
+                    ip = %(ip)s OR 
+                    device_id IN (
+                        SELECT device_id 
+                        FROM interfaces 
+                        WHERE ip = %(ip)s)
+                ORDER BY (transport IS NULL), updated DESC
+                LIMIT 1;
+                ''', {'ip': ip})
+            result = cur.fetchone()
+            
+        if result is None: return {}
+        return dict(result)
+
+
+    def get_refresh_targets(self):
+        '''Returns the devices which daemon mode keeps refreshed: the
+        latest successful record for each management IP.
+
+        Returns:
+            list: Of dicts containing device_id, ip, netmiko_platform,
+                transport, tcp_22 and tcp_23
+        '''
+        proc = 'device_db.get_refresh_targets'
+
+        with self.conn, self.conn.cursor(cursor_factory=RealDictCursor) as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT DISTINCT ON (ip)
+                    device_id, ip, netmiko_platform, transport, tcp_22, tcp_23
+                FROM devices
+                WHERE
+                    ip IS NOT NULL AND
+                    failed IS NOT TRUE
+                ORDER BY ip, updated DESC;
+                ''')
+            return [dict(x) for x in cur.fetchall()]
+
+
+    def update_mac_table(self, device_id, device):
+        '''Replaces the MAC address table of an existing device record
+        with the one on a freshly polled device. MACs which are still
+        present get a new last_seen time, new ones are inserted and
+        the rest are marked as not seen in the last scan.
+
+        Args:
+            device_id (int): The existing device record
+            device (NetworkDevice): The device holding the new table
+
+        Returns:
+            int: The number of MAC addresses recorded
+        '''
+        proc = 'device_db.update_mac_table'
+
+        rows = []
+        with self.conn, self.conn.cursor() as cur, sql_logger(proc):
+            cur.execute('''
+                UPDATE mac
+                SET seen_last_scan = FALSE
+                WHERE device_id = %s;
+                ''', (device_id, ))
+
+            cur.execute('''
+                SELECT interface_name, interface_id
+                FROM interfaces
+                WHERE device_id = %s;
+                ''', (device_id, ))
+            interface_ids = dict(cur.fetchall())
+
+            for interf in device.interfaces:
+                if not interf.mac_address_table: continue
+
+                interface_id = interface_ids.get(interf.interface_name)
+                if interface_id is None:
+                    log('Interface [{}] is not in the database', 
+                        interf.interface_name, proc=proc, v=logging.I,
+                        ip=device.ip)
+                    continue
+
+                rows.extend((device_id, interface_id, mac_address)
+                            for mac_address in interf.mac_address_table)
+
+            # Mark the MACs which are still there as seen, and insert
+            # the new ones, in one statement per page of rows
+            if rows: execute_values(cur, '''
+                WITH new (device_id, interface_id, mac_address) AS (
+                    VALUES %s
+                    ),
+                seen AS (
+                    UPDATE mac m
+                    SET
+                        seen_last_scan = TRUE,
+                        last_seen = now(),
+                        updated = now()
+                    FROM new
+                    WHERE
+                        m.interface_id = new.interface_id AND
+                        m.mac_address = new.mac_address
+                    RETURNING m.interface_id, m.mac_address
+                    )
+                INSERT INTO mac (device_id, interface_id, mac_address)
+                SELECT DISTINCT new.device_id, new.interface_id, new.mac_address
+                FROM new
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM seen
+                    WHERE 
+                        seen.interface_id = new.interface_id AND
+                        seen.mac_address = new.mac_address
+                    );
+                ''', rows, page_size=1000)
+
+        return len(rows)
+
+
+    def get_fingerprints(self, ip, device_name):
+        '''Returns the fingerprints (see NetworkDevice.fingerprint) of 
+        the latest successful record of a device.
+        
+        Returns:
+            tuple: (device_id, fingerprints), or None if the device has
+                no record with fingerprints
+        '''
+        proc = 'device_db.get_fingerprints'
+        
+        with self.conn, self.conn.cursor() as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT device_id, fingerprints
+                FROM devices
+                WHERE 
+                    ip = %s AND 
+                    device_name = %s AND
+                    failed IS NOT TRUE AND
+                    fingerprints IS NOT NULL
+                ORDER BY updated DESC
+                LIMIT 1;
+                ''', (ip, device_name))
+            result = cur.fetchone()
+        
+        if result is None: return None
+        return result[0], json.loads(result[1])
+    
+    
+    def get_neighbors(self, device_id):
+        '''Returns the neighbors of a device record, in the form 
+        CiscoDevice.parse_neighbor returns them.'''
+        proc = 'device_db.get_neighbors'
+        
+        with self.conn, self.conn.cursor(cursor_factory=RealDictCursor) as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT 
+                    device_name, netmiko_platform, system_platform, 
+                    source_interface, neighbor_interface, software, 
+                    raw_cdp,
+                    ARRAY(
+                        SELECT ip
+                        FROM neighbor_ips
+                        WHERE neighbor_ips.neighbor_id = neighbors.neighbor_id
+                        ORDER BY neighbor_ip_id) AS ip_list
+                FROM neighbors
+                WHERE device_id = %s
+                ORDER BY neighbor_id;
+                ''', (device_id, ))
+            output = [dict(x) for x in cur.fetchall()]
+        
+        # Older records stored junk in neighbor_ips
+        for neighbor in output:
+            neighbor['ip_list'] = [x for x in neighbor['ip_list'] if util.is_ip(x)]
+        return output
+    
+    
+    def get_reparse_ids(self):
+        '''Returns the ids of the device records which have stored 
+        output to parse again, oldest first.'''
+        proc = 'device_db.get_reparse_ids'
+        
+        with self.conn, self.conn.cursor() as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT device_id
+                FROM devices
+                WHERE 
+                    failed IS NOT TRUE AND
+                    config IS NOT NULL
+                ORDER BY device_id;
+                ''')
+            return [x[0] for x in cur.fetchall()]
+    
+    
+    def get_stored_output(self, device_id):
+        '''Returns what is needed to parse a device again without 
+        polling it: its identity, and the raw output stored with it.
+        
+        Returns:
+            dict: The device_id, device_name, ip, netmiko_platform,
+                system_platform, software, config, raw_cdp and 
+                raw_mac_address_table of the record, raw_interfaces
+                (a list, in the order the interfaces were inserted), 
+                and has_macs and has_neighbors, which are True if the 
+                record has any. None if the record doesn't exist.
+        '''
+        proc = 'device_db.get_stored_output'
+        
+        with self.conn, self.conn.cursor(cursor_factory=RealDictCursor) as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT 
+                    device_id, device_name, ip, netmiko_platform, 
+                    system_platform, software, config, raw_cdp, 
+                    raw_mac_address_table,
+                    EXISTS(
+                        SELECT 1 FROM mac 
+                        WHERE mac.device_id = devices.device_id) AS has_macs,
+                    EXISTS(
+                        SELECT 1 FROM neighbors 
+                        WHERE neighbors.device_id = devices.device_id) AS has_neighbors,
+                    ARRAY(
+                        SELECT raw_interface
+                        FROM interfaces
+                        WHERE interfaces.device_id = devices.device_id
+                        ORDER BY interface_id) AS raw_interfaces
+                FROM devices
+                WHERE device_id = %s;
+                ''', (device_id, ))
+            result = cur.fetchone()
+        
+        if result is None: return None
+        return dict(result)
+    
+    
+    def replace_interface_entries(self, device_id, device):
+        '''Replaces the interfaces, MAC addresses and neighbors of an 
+        existing device record with those of a device which was parsed
+        again (see core.reparse_run). The device record and its serials
+        are left alone. MAC addresses keep the time of the poll which
+        collected them as their last_seen.'''
+        proc = 'device_db.replace_interface_entries'
+        
+        with self.conn, self.conn.cursor() as cur, sql_logger(proc):
+            
+            # Removes their MACs and neighbors along with them
+            cur.execute('''
+                DELETE FROM interfaces
+                WHERE device_id = %(d)s;
+                
+                DELETE FROM neighbors
+                WHERE device_id = %(d)s;
+                ''', {'d': device_id})
+            
+            self.insert_interface_entries(device_id, device, cur)
+            
+            cur.execute('''
+                UPDATE mac
+                SET last_seen = devices.updated
+                FROM devices
+                WHERE 
+                    mac.device_id = %(d)s AND
+                    devices.device_id = %(d)s;
+                ''', {'d': device_id})
+    
+    
+    def start_run(self, profile=None):
+        '''Records the start of a new crawl. Run numbers are kept in 
+        the inventory, which outlives cleaning the main database, so
+        they keep counting up from the last crawl with stored timings.
+        
+        Returns:
+            int: The run number of the new crawl
+        '''
+        proc = 'device_db.start_run'
+        
+        with self.conn, self.conn.cursor() as cur, sql_logger(proc):
+            cur.execute('''
+                INSERT INTO runs (run_id, profile)
+                VALUES (
+                    GREATEST(
+                        (SELECT COALESCE(max(run_id), 0) FROM runs),
+                        (SELECT COALESCE(max(run_number), 0) FROM device_timings)
+                        ) + 1,
+                    %s)
+                RETURNING run_id;
+                ''', (profile,))
+            return cur.fetchone()[0]
+    
+    
+    def add_device_timings(self, device_id, device):
+        '''Stores the time spent on each step of processing a device 
+        (see NetworkDevice.timed), one row per step. 'step:detail' 
+        timings are stored with the detail in the step column.'''
+        proc = 'device_db.add_device_timings'
+        
+        rows = []
+        for name, seconds in device.timings.items():
+            phase, _, step = name.partition(':')
+            rows.append({
+                'device_id': device_id,
+                'run_number': config.cc.run_number,
+                'phase': phase,
+                'step': step or None,
+                'seconds': seconds,
+                })
+        
+        if not rows: return
+        
+        with self.conn, self.conn.cursor() as cur, sql_logger(proc):
+            cur.executemany('''
+                INSERT INTO device_timings (
+                    device_id,
+                    run_number,
+                    phase,
+                    step,
+                    seconds
+                    )
+                VALUES (
+                    %(device_id)s,
+                    %(run_number)s,
+                    %(phase)s,
+                    %(step)s,
+                    %(seconds)s
+                    );
+                ''', rows)
+    
+    
+    def slowest_devices(self, limit=20, run_number=None):
+        '''Returns the devices which took longest to process in a crawl.
+        
+        Keyword Args:
+            limit (int): The number of devices to return
+            run_number (int): The crawl. Default is the latest one 
+                with timings.
+        
+        Returns:
+            list: Of dicts with the device_id, device_name, ip, 
+                system_platform, the total seconds and the seconds 
+                spent on each phase, slowest first
+        '''
+        proc = 'device_db.slowest_devices'
+        
+        with self.conn, self.conn.cursor(cursor_factory=RealDictCursor) as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT 
+                    t.device_id, d.device_name, d.ip, d.system_platform,
+                    sum(t.seconds) AS seconds,
+                    sum(t.seconds) FILTER (WHERE t.phase = 'connect') AS connect,
+                    sum(t.seconds) FILTER (WHERE t.phase = 'collect') AS collect,
+                    sum(t.seconds) FILTER (WHERE t.phase = 'parse') AS parse,
+                    sum(t.seconds) FILTER (WHERE t.phase = 'db_write') AS db_write
+                FROM device_timings t
+                JOIN devices d ON d.device_id = t.device_id
+                WHERE 
+                    t.step IS NULL AND
+                    t.run_number = COALESCE(%(run_number)s, 
+                        (SELECT max(run_number) FROM device_timings))
+                GROUP BY t.device_id, d.device_name, d.ip, d.system_platform
+                ORDER BY seconds DESC
+                LIMIT %(limit)s;
+                ''', {'run_number': run_number, 'limit': limit})
+            return [dict(x) for x in cur.fetchall()]
+    
+    
+    def slowest_steps(self, limit=20, run_number=None):
+        '''Returns the steps (commands, parsers etc.) which took the 
+        most time in total across the devices of a crawl.
+        
+        Keyword Args:
+            limit (int): The number of steps to return
+            run_number (int): The crawl. Default is the latest one 
+                with timings.
+        
+        Returns:
+            list: Of dicts with the phase, step, number of devices, and
+                the total, mean and max seconds, slowest first
+        '''
+        proc = 'device_db.slowest_steps'
+        
+        with self.conn, self.conn.cursor(cursor_factory=RealDictCursor) as cur, sql_logger(proc):
+            cur.execute('''
+                SELECT 
+                    phase, step, 
+                    count(*) AS devices,
+                    sum(seconds) AS seconds,
+                    avg(seconds) AS mean,
+                    max(seconds) AS max
+                FROM device_timings
+                WHERE 
+                    step IS NOT NULL AND
+                    run_number = COALESCE(%(run_number)s, 
+                        (SELECT max(run_number) FROM device_timings))
+                GROUP BY phase, step
+                ORDER BY seconds DESC
+                LIMIT %(limit)s;
+                ''', {'run_number': run_number, 'limit': limit})
+            return [dict(x) for x in cur.fetchall()]
+    
+    
     def get_device_record(self,
                           column,
                           value):
@@ -914,8 +1512,8 @@ class device_db(sql_database):
         
         # Return if the device is not already in the database
         if not index:
-            log('Not a duplicate record: [{}]'.format(
-                device.device_name), v=logging.I, proc= proc)
+            log('Not a duplicate record: [{}]', device.device_name,
+                v=logging.I, proc= proc)
             return False
         
         log('Positive Duplicate record: [{}]'.format(
@@ -955,12 +1553,17 @@ class device_db(sql_database):
                 system_platform= %(system_platform)s,
                 software= %(software)s,
                 raw_cdp= %(raw_cdp)s,
+                raw_mac_address_table= %(raw_mac_address_table)s,
                 config= %(config)s,
+                fingerprints= %(fingerprints)s,
                 failed= %(failed)s,
+                partial= %(partial)s,
                 error_log= %(error_log)s,
                 processing_error= %(processing_error)s,
                 tcp_22= %(tcp_22)s,
                 tcp_23= %(tcp_23)s,
+                ip= %(ip)s,
+                transport= %(transport)s,
                 username= %(username)s,
                 password= %(password)s,
                 cred_type= %(cred_type)s,
@@ -975,12 +1578,17 @@ class device_db(sql_database):
                 'system_platform': device.system_platform,
                 'software': device.software,
                 'raw_cdp': device.raw_cdp,
+                'raw_mac_address_table': device.raw_mac_address_table,
                 'config': device.config,
+                'fingerprints': json.dumps(device.fingerprints) if device.fingerprints else None,
                 'failed': device.failed,
+                'partial': device.partial,
                 'error_log': device.error_log,
                 'processing_error': device.processing_error,
                 'tcp_22': device.tcp_22,
                 'tcp_23': device.tcp_23,
+                'ip': device.ip,
+                'transport': device.transport,
                 'username': device.username,
                 'password': device.short_pass(),
                 'cred_type': device.cred_type,
@@ -993,9 +1601,10 @@ class device_db(sql_database):
             
         
     @useCursor
-    def set_dependents_as_updated(self, device_id, cur= None):
+    def set_dependents_as_updated(self, device_id, macs_seen=False, cur= None):
         '''Sets the last touched time on all dependents of the
-        given device_id to now'''
+        given device_id to now. With macs_seen, the MAC addresses
+        are also marked as seen now.'''
         
         cur.execute('''
             UPDATE devices
@@ -1020,11 +1629,19 @@ class device_db(sql_database):
             
             UPDATE neighbor_ips
             SET updated = now()
-            WHERE neighbor_id = 
+            WHERE neighbor_id IN 
                 (SELECT neighbor_id
                  FROM neighbors
                  WHERE device_id = %(d)s);
         ''', {'d': device_id})
+        
+        if macs_seen: cur.execute('''
+            UPDATE mac
+            SET 
+                last_seen = now(),
+                seen_last_scan = TRUE
+            WHERE device_id = %(d)s;
+            ''', {'d': device_id})
     
     
     
@@ -1044,12 +1661,17 @@ class device_db(sql_database):
                 system_platform,
                 software,
                 raw_cdp,
+                raw_mac_address_table,
                 config,
+                fingerprints,
                 failed,
+                partial,
                 error_log,
                 processing_error,
                 tcp_22,
                 tcp_23,
+                ip,
+                transport,
                 username,
                 password,
                 cred_type
@@ -1061,12 +1683,17 @@ class device_db(sql_database):
                 %(system_platform)s,
                 %(software)s,
                 %(raw_cdp)s,
+                %(raw_mac_address_table)s,
                 %(config)s,
+                %(fingerprints)s,
                 %(failed)s,
+                %(partial)s,
                 %(error_log)s,
                 %(processing_error)s,
                 %(tcp_22)s,
                 %(tcp_23)s,
+                %(ip)s,
+                %(transport)s,
                 %(username)s,
                 %(password)s,
                 %(cred_type)s
@@ -1080,12 +1707,17 @@ class device_db(sql_database):
                 'system_platform': device.system_platform,
                 'software': device.software,
                 'raw_cdp': device.raw_cdp,
+                'raw_mac_address_table': device.raw_mac_address_table,
                 'config': device.config,
+                'fingerprints': json.dumps(device.fingerprints) if device.fingerprints else None,
                 'failed': device.failed,
+                'partial': device.partial,
                 'error_log': device.error_log,
                 'processing_error': device.processing_error,
                 'tcp_22': device.tcp_22,
                 'tcp_23': device.tcp_23,
+                'ip': device.ip,
+                'transport': device.transport,
                 'username': device.username,
                 'password': device.short_pass(),
                 'cred_type': device.cred_type,
@@ -1262,6 +1894,7 @@ class device_db(sql_database):
         with self.conn, self.conn.cursor() as cur:
                 if drop_tables: cur.execute('''
                     DROP TABLE IF EXISTS 
+                        device_timings,
                         neighbor_IPs,
                         mac,
                         serials,
@@ -1280,12 +1913,17 @@ class device_db(sql_database):
                         system_platform    TEXT,
                         software           TEXT,
                         raw_cdp            TEXT,
+                        raw_mac_address_table TEXT,
                         config             TEXT,
+                        fingerprints       TEXT,
                         failed             BOOLEAN,
+                        partial            BOOLEAN,
                         error_log          TEXT,
                         processing_error   BOOLEAN,
                         tcp_22             BOOLEAN,
                         tcp_23             BOOLEAN,
+                        ip                 TEXT,
+                        transport          TEXT,
                         username           TEXT,
                         password           TEXT,
                         cred_type          TEXT,
@@ -1364,6 +2002,38 @@ class device_db(sql_database):
                         FOREIGN KEY(neighbor_id) REFERENCES Neighbors(neighbor_id) 
                             ON DELETE CASCADE ON UPDATE CASCADE
                     );  
+                    
+                    CREATE TABLE IF NOT EXISTS Device_Timings(
+                        timing_id          BIGSERIAL PRIMARY KEY , 
+                        device_id          INTEGER NOT NULL,
+                        run_number         INTEGER,
+                        phase              TEXT NOT NULL,
+                        step               TEXT,
+                        seconds            REAL NOT NULL,
+                        updated            TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+                        FOREIGN KEY(device_id) REFERENCES Devices(device_id) 
+                            ON DELETE CASCADE ON UPDATE CASCADE
+                    );  
+                    
+                    CREATE INDEX IF NOT EXISTS device_timings_run 
+                        ON device_timings (run_number);
+                    
+                    -- Never dropped, so that run numbers don't repeat
+                    CREATE TABLE IF NOT EXISTS runs(
+                        run_id             INTEGER PRIMARY KEY, 
+                        profile            TEXT,
+                        started            TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+                    );
+                    ''')
+                
+                # Add columns which are missing from older databases
+                cur.execute('''
+                    ALTER TABLE devices 
+                        ADD COLUMN IF NOT EXISTS partial BOOLEAN,
+                        ADD COLUMN IF NOT EXISTS ip TEXT,
+                        ADD COLUMN IF NOT EXISTS transport TEXT,
+                        ADD COLUMN IF NOT EXISTS raw_mac_address_table TEXT,
+                        ADD COLUMN IF NOT EXISTS fingerprints TEXT;
                     ''')
         
         
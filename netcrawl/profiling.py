@@ -0,0 +1,176 @@
+'''
+Profiles a crawl across all of its processes.
+
+With config.cc.profile set (--profile), normal_run, every crawl
+worker and every parse process run cProfile, and each process writes
+its stats to config.cc.profile_path as <role>-<pid>.prof when it
+exits. At the end of the run, merge() adds them up into:
+
+    - merged.prof: The stats of all processes, for pstats or snakeviz
+    - collapsed.txt: Stacks in the collapsed format read by
+      flamegraph.pl and speedscope, one 'a;b;c microseconds' per line
+
+cProfile only records which function called which, not whole stacks,
+so the stacks are rebuilt from the call graph by splitting the time
+of each function between its callers in proportion to the time spent
+under each. Functions with several callers are therefore approximate.
+'''
+
+import cProfile, glob, os, pstats
+from multiprocessing import util as mp_util
+
+from . import config
+from .wylog import log, logging
+
+
+# The profiler of this process, the name its stats are saved under,
+# and the process it belongs to (forked processes inherit it)
+_profiler = None
+_role = None
+_pid = None
+
+# Stacks deeper than this are cut off, and paths which account for
+# less time than this (in seconds) are left out of collapsed.txt
+MAX_DEPTH = 64
+MIN_TIME = 0.0001
+
+
+def start(role):
+    '''Starts profiling this process. The stats are written when the
+    process exits, or when stop() is called.
+
+    Args:
+        role (str): What the process does, e.g. 'worker'. Used in the
+            name of the stats file.
+    '''
+    global _profiler, _role, _pid
+
+    if _profiler is not None:
+        if _pid == os.getpid(): return
+
+        # Forked while the parent was profiling
+        _profiler.disable()
+
+    _role = role
+    _pid = os.getpid()
+    _profiler = cProfile.Profile()
+
+    # Child processes exit without running atexit, but do run
+    # multiprocessing's finalizers
+    mp_util.Finalize(None, stop, exitpriority=10)
+
+    _profiler.enable()
+
+
+def stop():
+    '''Stops profiling this process and writes its stats.
+
+    Returns:
+        str: The stats file, or None if the process wasn't profiled
+    '''
+    global _profiler
+
+    if _profiler is None or _pid != os.getpid(): return None
+
+    _profiler.disable()
+    os.makedirs(config.cc.profile_path, exist_ok=True)
+    path = os.path.join(config.cc.profile_path,
+                        '{}-{}.prof'.format(_role, os.getpid()))
+    _profiler.dump_stats(path)
+    _profiler = None
+    return path
+
+
+def clear():
+    '''Removes the stats left by an earlier run'''
+    for path in glob.glob(os.path.join(config.cc.profile_path, '*.prof')):
+        os.remove(path)
+
+
+def _func_name(func):
+    filename, line, name = func
+    if filename == '~': return name
+    return '{}:{}({})'.format(os.path.basename(filename), line, name)
+
+
+def collapse(stats):
+    '''Rebuilds approximate call stacks from the call graph in stats.
+
+    Args:
+        stats (pstats.Stats): The profile
+
+    Returns:
+        dict: Seconds of own time by stack, where a stack is a tuple of
+            function names from the outermost call
+    '''
+    calls = stats.stats
+
+    # Callees of each function, with the cumulative time spent in
+    # each callee when it was called from that function
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in calls.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    output = {}
+
+    def walk(func, path, share):
+        cc, nc, tt, ct, callers = calls[func]
+        path = path + (_func_name(func),)
+
+        own = tt * share
+        if own >= MIN_TIME: output[path] = output.get(path, 0) + own
+
+        if len(path) >= MAX_DEPTH: return
+
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = calls[callee][3]
+            if not callee_time: continue
+
+            # Leave out recursion and paths too small to show
+            if _func_name(callee) in path: continue
+            if edge_time * share < MIN_TIME: continue
+
+            walk(callee, path, edge_time * share / callee_time)
+
+    # Start at the functions which nothing profiled called
+    for func, (cc, nc, tt, ct, callers) in calls.items():
+        if not callers: walk(func, (), 1.0)
+
+    return output
+
+
+def merge(directory=None):
+    '''Adds up the stats written by every process of a run.
+
+    Keyword Args:
+        directory (str): Where the stats are. Default is
+            config.cc.profile_path
+
+    Returns:
+        tuple: The paths of merged.prof and collapsed.txt, or None if
+            no stats were found
+    '''
+    proc = 'profiling.merge'
+
+    if directory is None: directory = config.cc.profile_path
+
+    paths = sorted(x for x in glob.glob(os.path.join(directory, '*.prof'))
+                   if os.path.basename(x) != 'merged.prof')
+    if not paths:
+        log('No profiles found in [{}]', directory, proc=proc, v=logging.A)
+        return None
+
+    stats = pstats.Stats(*paths)
+    merged = os.path.join(directory, 'merged.prof')
+    stats.dump_stats(merged)
+
+    collapsed = os.path.join(directory, 'collapsed.txt')
+    with open(collapsed, 'w') as outfile:
+        for path, seconds in sorted(collapse(stats).items()):
+            outfile.write('{} {}\n'.format(';'.join(path),
+                                           max(1, round(seconds * 1e6))))
+
+    log('Merged [{}] profiles into [{}] and [{}]', len(paths), merged,
+        collapsed, proc=proc, v=logging.N)
+    return merged, collapsed
@@ -0,0 +1,294 @@
+'''
+Retry policies for device commands and logins.
+
+Failures are sorted into classes (authentication, timeout, prompt
+mismatch, empty output...) and each class gets its own retry budget.
+Errors that a retry will not fix, like a rejected password, are given
+up on immediately instead of being slept on. Hosts which keep failing
+have their circuit opened so that no more time is spent on them.
+
+Circuit state is kept per process. It is shared by the threads of a
+process, but a host whose circuit is open in one worker process is 
+still tried by the others.
+'''
+
+import random, socket, threading, time
+
+from netmiko import NetMikoAuthenticationException
+from netmiko import NetMikoTimeoutException
+
+from . import config
+from .wylog import log, logging
+
+
+# Error classes
+AUTH = 'auth'
+TIMEOUT = 'timeout'
+PROMPT = 'prompt'
+EMPTY = 'empty'
+INVALID = 'invalid'
+UNKNOWN = 'unknown'
+
+
+class CircuitOpenError(IOError):
+    '''Raised when a host has failed too often to be worth trying again'''
+
+
+class DeadlineExceeded(TimeoutError):
+    '''Raised when there is no time left to start more work'''
+
+
+class CheckFailed(ValueError):
+    '''Raised when a command succeeded but its output did not pass the
+    check function'''
+
+    def __init__(self, msg, output=None):
+        ValueError.__init__(self, msg)
+        self.output = output
+
+
+def classify(error):
+    '''Sorts an exception into one of the retry error classes.
+
+    Args:
+        error (Exception): The exception raised by a failed attempt
+
+    Returns:
+        str: One of AUTH, TIMEOUT, PROMPT, EMPTY, INVALID or UNKNOWN
+    '''
+
+    if isinstance(error, NetMikoAuthenticationException):
+        return AUTH
+
+    if isinstance(error, CheckFailed):
+        if error.output is None or not str(error.output).strip():
+            return EMPTY
+        return INVALID
+
+    if isinstance(error, (NetMikoTimeoutException,
+                          socket.timeout,
+                          TimeoutError,
+                          EOFError,
+                          )):
+        return TIMEOUT
+
+    msg = str(error).lower()
+
+    if 'authentication' in msg:
+        return AUTH
+    elif 'pattern not detected' in msg or 'prompt' in msg:
+        return PROMPT
+    elif 'timed out' in msg or 'timeout' in msg or 'socket is closed' in msg:
+        return TIMEOUT
+
+    return UNKNOWN
+
+
+def backoff(attempt, base=None, maximum=None):
+    '''Returns a jittered, exponentially increasing delay in seconds.
+
+    Uses "full jitter": a random value between zero and the exponential
+    delay, so that many workers retrying at once don't retry in lockstep.
+
+    Args:
+        attempt (int): The number of failed attempts so far (starting at 0)
+
+    Keyword Args:
+        base (float): The delay for the first retry. Uses
+            config.cc.retry_base_delay by default
+        maximum (float): The largest delay which will be returned. Uses
+            config.cc.retry_max_delay by default
+    '''
+    if base is None: base = config.cc.retry_base_delay
+    if maximum is None: maximum = config.cc.retry_max_delay
+
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+class retry_policy():
+    '''Tracks failed attempts of one operation and decides whether
+    to try again.
+
+    Each error class has its own budget of retries, taken from
+    config.cc.retry_budgets unless given. The total number of attempts
+    is capped by *attempts*, and no retry is made if the sleep would
+    run past the *deadline* (an absolute time.time() value).
+
+    Usage::
+
+        policy = retry_policy(attempts=3, host=ip)
+        while True:
+            try: return do_something()
+            except Exception as e:
+                if not policy.retry(e): raise
+    '''
+
+    def __init__(self,
+                 attempts=3,
+                 budgets=None,
+                 deadline=None,
+                 host=None,
+                 proc='retry_policy',
+                 ):
+        self.attempts = attempts
+        self.budgets = dict(config.cc.retry_budgets)
+        if budgets: self.budgets.update(budgets)
+        self.deadline = deadline
+        self.host = host
+        self.proc = proc
+
+        # Number of failures so far, in total and per error class
+        self.failures = 0
+        self.spent = {}
+        self.last_class = None
+
+    def remaining(self):
+        '''Seconds left before the deadline, or None if there is none'''
+        if self.deadline is None: return None
+        return self.deadline - time.time()
+
+    def retry(self, error):
+        '''Records a failed attempt and sleeps if it should be retried.
+
+        Args:
+            error (Exception or str): The exception raised by the failed
+                attempt, or an error class
+
+        Returns:
+            bool: True if the operation should be attempted again
+        '''
+
+        if isinstance(error, str): error_class = error
+        else: error_class = classify(error)
+
+        self.failures += 1
+        self.last_class = error_class
+        self.spent[error_class] = self.spent.get(error_class, 0) + 1
+
+        if self.host: breaker(self.host).failure(error_class)
+
+        if self.failures >= self.attempts:
+            return False
+
+        # Some errors will not be fixed by a retry
+        if self.spent[error_class] > self.budgets.get(error_class, 0):
+            log('No retry budget left for [{}] errors', error_class,
+                proc=self.proc, v=logging.I, ip=self.host)
+            return False
+
+        if self.host and breaker(self.host).is_open():
+            return False
+
+        delay = backoff(self.failures - 1)
+
+        # Don't sleep past the deadline
+        remaining = self.remaining()
+        if remaining is not None and remaining <= delay:
+            log('Deadline reached. Not retrying after [{}] error', error_class,
+                proc=self.proc, v=logging.I, ip=self.host)
+            return False
+
+        log('Retrying after [{}] error in [{:.2f}] seconds', error_class, 
+            delay, proc=self.proc, v=logging.I, ip=self.host)
+        time.sleep(delay)
+        return True
+
+
+class deadline():
+    '''A point in time after which no more work should be started.
+
+    Args:
+        seconds (float): Seconds from now until the deadline. None or 0
+            means there is no deadline.
+
+    Keyword Args:
+        parent (deadline): An outer deadline. The earlier of the two
+            is used, so a phase can never outlast its device.
+    '''
+
+    def __init__(self, seconds=None, parent=None):
+        self.expires = (time.time() + seconds) if seconds else None
+
+        if parent is not None and parent.expires is not None:
+            if self.expires is None: self.expires = parent.expires
+            else: self.expires = min(self.expires, parent.expires)
+
+    def remaining(self):
+        '''Seconds left before the deadline, or None if there is none'''
+        if self.expires is None: return None
+        return max(0, self.expires - time.time())
+
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    def check(self, what='Deadline'):
+        '''Raises DeadlineExceeded if the deadline has passed'''
+        if self.expired():
+            raise DeadlineExceeded('{} reached'.format(what))
+
+
+class circuit_breaker():
+    '''Counts consecutive hard failures for one host. After
+    config.cc.circuit_threshold failures the circuit opens and the
+    host is not tried again for config.cc.circuit_reset seconds.'''
+
+    # Failures that say something about the host itself rather than
+    # about the command that was sent
+    counted = (TIMEOUT, UNKNOWN)
+
+    def __init__(self, host):
+        self.host = host
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def failure(self, error_class):
+        if error_class not in self.counted: return
+
+        with self.lock:
+            self.failures += 1
+            if (self.failures < config.cc.circuit_threshold or
+                self.opened is not None): return
+            self.opened = time.time()
+
+        log('Opening circuit after [{}] consecutive failures'.format(
+            self.failures), proc='circuit_breaker.failure',
+            v=logging.A, ip=self.host)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def is_open(self):
+        with self.lock:
+            if self.opened is None: return False
+
+            # Let one attempt through once the reset time has passed
+            if time.time() - self.opened >= config.cc.circuit_reset:
+                self.opened = None
+                self.failures = config.cc.circuit_threshold - 1
+                return False
+
+            return True
+
+    def check(self):
+        '''Raises CircuitOpenError if the host should not be tried'''
+        if self.is_open():
+            raise CircuitOpenError(
+                'Circuit open for [{}] after [{}] failures'.format(
+                    self.host, self.failures))
+
+
+# Circuit breakers for each host seen by this process, and the lock
+# which the threads of the process share to reach them
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker(host):
+    '''Returns this process's circuit_breaker for a host, creating it
+    if needed'''
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = circuit_breaker(host)
+        return _breakers[host]
@@ -0,0 +1,236 @@
+'''
+A pool of logged-in device sessions for daemon mode.
+
+Scheduled re-polls (like refreshing MAC tables) spend most of their
+time on TCP setup, key exchange and AAA rather than on the command
+itself. The pool keeps a bounded number of sessions open between
+refreshes, sends keepalives so that idle sessions aren't dropped by
+the device, and evicts the least recently used sessions when it is
+full or when the process uses too much memory.
+'''
+
+from collections import OrderedDict
+import os, threading, time
+
+from . import config
+from .device_dispatcher import create_instantiated_device
+from .retry import deadline
+from .wylog import log, logging
+
+
+class pooled_session():
+    '''A connected device and the bookkeeping needed to pool it'''
+
+    def __init__(self, device):
+        self.device = device
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+
+def current_rss():
+    '''Returns the resident memory of this process in MB, or None if
+    it can't be determined on this platform.'''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class session_pool():
+    '''Keeps up to *max_sessions* device sessions open, keyed by IP.
+
+    Keyword Args:
+        max_sessions (int): Uses config.cc.pool_max_sessions by default
+        keepalive (float): Seconds of idle time before a keepalive is
+            sent. Uses config.cc.pool_keepalive by default
+        max_rss (float): Evict sessions while the process uses more
+            than this many MB. Uses config.cc.pool_max_rss by default.
+            0 disables the check.
+    '''
+
+    def __init__(self, max_sessions=None, keepalive=None, max_rss=None):
+        self.max_sessions = max_sessions or config.cc.pool_max_sessions
+        self.keepalive = keepalive or config.cc.pool_keepalive
+        self.max_rss = config.cc.pool_max_rss if max_rss is None else max_rss
+
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, ip):
+        return ip in self.sessions
+
+    def start(self):
+        '''Starts the keepalive thread'''
+        self._keepalive_thread = threading.Thread(
+            target=self._keepalive_loop, name='session_pool.keepalive')
+        self._keepalive_thread.daemon = True
+        self._keepalive_thread.start()
+
+    def close(self):
+        '''Stops the keepalive thread and closes every session'''
+        self._stop.set()
+        if self._keepalive_thread: self._keepalive_thread.join()
+
+        with self.lock:
+            evicted = [self._evict(ip) for ip in list(self.sessions)]
+        for session in evicted: self._close(session)
+
+    def acquire(self, ip, netmiko_platform=None, **kwargs):
+        '''Returns a pooled_session for the device at this IP, opening
+        a new session if there isn't a live one. The session's lock is
+        held on return and must be released by the caller.
+
+        Keyword Args:
+            netmiko_platform (str): Platform of the device, used when
+                a new session has to be opened
+            **kwargs: Passed on to the device class, e.g. transport
+                history from the inventory
+
+        Raises:
+            IOError: If a new session could not be opened
+        '''
+        proc = 'session_pool.acquire'
+
+        while True:
+            with self.lock:
+                session = self.sessions.get(ip)
+                if session: self.sessions.move_to_end(ip)
+
+            if session:
+                session.lock.acquire()
+                if self._alive(session):
+                    log('Reusing warm session', proc=proc, v=logging.I, ip=ip)
+                    session.last_used = time.time()
+                    return session
+
+                session.lock.release()
+                with self.lock: dead = self._evict(ip, session)
+                if dead: self._close(dead)
+
+            session = pooled_session(self._open(ip, netmiko_platform, **kwargs))
+            session.lock.acquire()
+
+            with self.lock:
+                pooled = ip not in self.sessions
+                if pooled: self.sessions[ip] = session
+
+            if pooled:
+                self._shrink()
+                return session
+
+            # Another thread pooled a session for this IP while this
+            # one was opening. Use that one instead.
+            log('Closing duplicate session', proc=proc, v=logging.I, ip=ip)
+            session.device._end_session()
+
+    def release(self, session):
+        session.last_used = time.time()
+        session.lock.release()
+
+    def _open(self, ip, netmiko_platform, **kwargs):
+        '''Opens a session and identifies the device, so that its
+        interfaces are known before any table is polled.'''
+        proc = 'session_pool._open'
+
+        log('Opening new session', proc=proc, v=logging.N, ip=ip)
+
+        device = create_instantiated_device(ip=ip,
+                                            netmiko_platform=netmiko_platform,
+                                            **kwargs)
+
+        device_deadline = deadline(config.cc.device_timeout)
+        try:
+            device.open_session(device_deadline)
+            device._collect_mandatory(device_deadline)
+        except Exception:
+            device._end_session()
+            raise
+        finally:
+            device._stop_watchdog()
+
+        return device
+
+    def _alive(self, session):
+        try: return bool(session.device.connection.is_alive())
+        except Exception: return False
+
+    def _evict(self, ip, session=None):
+        '''Forgets a session, and returns it to be closed with _close()
+        once self.lock is released, so that a slow disconnect doesn't
+        hold up other threads. Must hold self.lock. 
+
+        Keyword Args:
+            session (pooled_session): Only evict the session for this
+                IP if it is still this one
+
+        Returns:
+            pooled_session: The evicted session, or None
+        '''
+        if session is not None and self.sessions.get(ip) is not session: return None
+
+        return self.sessions.pop(ip, None)
+
+    def _close(self, session):
+        log('Closing evicted session', proc='session_pool._close', 
+            v=logging.I, ip=session.device.ip)
+        session.device._end_session()
+
+    def _over_limit(self):
+        if len(self.sessions) > self.max_sessions: return True
+        if not self.max_rss: return False
+
+        rss = current_rss()
+        return rss is not None and rss > self.max_rss
+
+    def _shrink(self):
+        '''Evicts least recently used sessions, one at a time, until 
+        the pool is within its limits. Sessions which are in use are 
+        skipped. Must not hold self.lock.'''
+
+        while True:
+            evicted = None
+            with self.lock:
+                if len(self.sessions) <= 1 or not self._over_limit(): return
+
+                for ip, session in self.sessions.items():
+                    if not session.lock.acquire(blocking=False): continue
+                    try: evicted = self._evict(ip)
+                    finally: session.lock.release()
+                    break
+
+            # Everything is in use
+            if evicted is None: return
+            self._close(evicted)
+
+    def _keepalive_loop(self):
+        proc = 'session_pool._keepalive_loop'
+
+        while not self._stop.wait(min(self.keepalive, 5)):
+            with self.lock:
+                idle = [(ip, s) for ip, s in self.sessions.items()
+                        if time.time() - s.last_used >= self.keepalive]
+
+            for ip, session in idle:
+                # Skip sessions which are busy anyway
+                if not session.lock.acquire(blocking=False): continue
+
+                try:
+                    if self._alive(session):
+                        session.last_used = time.time()
+                        continue
+                finally: session.lock.release()
+
+                log('Session died while idle', proc=proc, v=logging.I, ip=ip)
+                with self.lock: dead = self._evict(ip, session)
+                if dead: self._close(dead)
+
+            self._shrink()
@@ -0,0 +1,145 @@
+'''
+HTTP endpoint which reports the metrics of a running crawl in the
+Prometheus text format.
+
+normal_run starts it when config.cc.metrics_port is set, and serves
+whatever is in the main process' metrics registry (see wylog.metrics)
+on /metrics:
+
+    - netcrawl_<gauge>: The state of the crawl, e.g. netcrawl_pending,
+      netcrawl_in_flight or netcrawl_worker_state
+    - netcrawl_events_total: Counters, like credential attempts
+    - netcrawl_duration_seconds: A histogram per function, collector
+      or SQL statement
+
+Only the standard library is used.
+'''
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import re, threading
+
+from . import config
+from .wylog import log, logging, metrics
+
+
+PREFIX = 'netcrawl_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _metric_name(name):
+    return PREFIX + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _labels(pairs):
+    '''Formats (label, value) pairs as {label="value",...}'''
+    if not pairs: return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\')
+                                                  .replace('"', r'\"')
+                                                  .replace('\n', r'\n'))
+                          for k, v in pairs) + '}'
+
+
+def render():
+    '''Returns every metric in the registry in the Prometheus text
+    exposition format'''
+    lines = []
+
+    # Gauges, grouped by name
+    gauges = {}
+    for (name, labels), value in metrics.gauges().items():
+        gauges.setdefault(name, []).append((labels, value))
+
+    for name in sorted(gauges):
+        lines.append('# TYPE {} gauge'.format(_metric_name(name)))
+        for labels, value in sorted(gauges[name], key=lambda x: x[0]):
+            lines.append('{}{} {}'.format(_metric_name(name),
+                                          _labels(labels), value))
+
+    counters = metrics.counters()
+    if counters:
+        lines.append('# TYPE {}events_total counter'.format(PREFIX))
+        for name in sorted(counters):
+            lines.append('{}events_total{} {}'.format(
+                PREFIX, _labels([('name', name)]), counters[name]))
+
+    histograms = metrics.histograms()
+    if histograms:
+        lines.append('# TYPE {}duration_seconds histogram'.format(PREFIX))
+        for name in sorted(histograms):
+            h = histograms[name]
+
+            total = 0
+            for bound, n in zip(metrics.BUCKETS + ('+Inf',), h.counts):
+                total += n
+                lines.append('{}duration_seconds_bucket{} {}'.format(
+                    PREFIX, _labels([('name', name), ('le', bound)]), total))
+
+            lines.append('{}duration_seconds_sum{} {}'.format(
+                PREFIX, _labels([('name', name)]), h.sum))
+            lines.append('{}duration_seconds_count{} {}'.format(
+                PREFIX, _labels([('name', name)]), h.count))
+
+        lines.append('# TYPE {}errors_total counter'.format(PREFIX))
+        for name in sorted(histograms):
+            lines.append('{}errors_total{} {}'.format(
+                PREFIX, _labels([('name', name)]), histograms[name].errors))
+
+    return '\n'.join(lines) + '\n'
+
+
+class metrics_handler(BaseHTTPRequestHandler):
+    '''Serves render() on /metrics'''
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log(lambda: format % args, proc='telemetry.metrics_handler', 
+            v=logging.D, ip=self.client_address[0])
+
+
+class metrics_server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start(port=None, host=None):
+    '''Serves the metrics endpoint from a background thread.
+
+    Keyword Args:
+        port (int): Default is config.cc.metrics_port. 0 picks a free
+            port.
+        host (str): The address to listen on. Default is
+            config.cc.metrics_host
+
+    Returns:
+        metrics_server: The running server. Its port is
+            server.server_address[1]. Stop it with stop().
+    '''
+    proc = 'telemetry.start'
+
+    if port is None: port = config.cc.metrics_port
+    if host is None: host = config.cc.metrics_host
+
+    server = metrics_server((host, port), metrics_handler)
+    threading.Thread(target=server.serve_forever, name='telemetry',
+                     daemon=True).start()
+
+    log('Serving metrics on http://{}:{}/metrics', host,
+        server.server_address[1], proc=proc, v=logging.N)
+    return server
+
+
+def stop(server):
+    if server is None: return
+    server.shutdown()
+    server.server_close()
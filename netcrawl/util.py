@@ -1,6 +1,37 @@
 from contextlib import closing
+from functools import lru_cache
 from netaddr import IPNetwork
-import socket, re, time
+import ipaddress, socket, re, time
+
+
+# Patterns used by the functions below, compiled once
+_non_word = re.compile(r'\W')
+_non_hex_separator = re.compile(r'[\W_]')
+_non_ip_char = re.compile(r'[^\d\.]')
+_non_digit = re.compile(r'\D')
+
+_mac_address = re.compile(r'''
+    (?:
+        [0-9A-F]{2,4}  # Match 2-4 Hex characters
+        [\:\-\.]       # Seperated by :, -, or .
+    ){2,7}             # match it between 2 and 7 times
+        [0-9A-F]{2,4}  # Followed by one last set of Hex
+    ''', re.I | re.X)
+
+_ip_address = r'''
+    (?:
+        (?:
+            25[0-5]|          # Match 250-255
+            2[0-4][0-9]|      # Match 200-249
+            [01]?[0-9][0-9]?  # Match 0-199
+        )
+        (?:\.|\b)             # Followed by a . or a word boundry
+    ){4}                      # Repeat that four times
+    '''
+_is_ip = re.compile(_ip_address, re.X)
+# Every match starts with a digit, so the lookahead skips other
+# positions without trying the alternatives
+_parse_ip = re.compile(r'\b(?=\d)' + _ip_address + r'\b', re.X)
 
 
 def getCreds():
@@ -25,26 +56,45 @@ def getCreds():
 
 
 def ucase_letters(raw_input):
-        return ''.join([x.upper() for x in raw_input if re.match(r'\w', x)])
+    '''Returns the word characters of a string (letters, digits and _)
+    in upper case, e.g. for normalizing MAC addresses'''
+    return _non_word.sub('', raw_input).upper()
+
+
+def mac_to_int(mac):
+    '''Returns a MAC address in any of the usual notations
+    (0011.2233.4455, 00:11:22:33:44:55, 001122334455) as an integer.
+    
+    Raises:
+        ValueError: If the input is not a 48 bit MAC address
+    '''
+    digits = _non_hex_separator.sub('', mac)
+    if len(digits) != 12:
+        raise ValueError('[{}] is not a MAC address'.format(mac))
+    return int(digits, 16)
+
+
+def int_to_mac(mac):
+    '''Returns an integer MAC address in the notation stored in the
+    database: 12 upper case hex digits, like ucase_letters produces.'''
+    return '{:012X}'.format(mac)
 
 
 def contains_mac_address(mac):
     '''Simple boolean operator to determine if a string contains a mac anywhere
     within it.'''
-    return bool(re.search(r'''
-        (?:
-            [0-9A-F]{2,4}  # Match 2-4 Hex characters
-            [\:\-\.]       # Seperated by :, -, or .
-        ){2,7}             # match it between 2 and 7 times
-            [0-9A-F]{2,4}  # Followed by one last set of Hex
-        ''',
-        mac, re.I | re.X))
+    return bool(_mac_address.search(mac))
 
 
-def network_ip(ip, subnet):
+@lru_cache(maxsize=256)
+def _subnet_mask(subnet):
+    '''Returns a subnet (a netmask or CIDR) as a netmask string, and 
+    as an int, or None for netmasks which aren't contiguous. Cached, 
+    since a network only has a handful of different subnets.
     
-    if not is_ip(ip): 
-        raise TypeError('IP [{}] is not a valid ip'.format(ip))
+    Raises:
+        TypeError: If the subnet is not valid
+    '''
     
     # Handle CIDR
     if not is_ip(subnet):
@@ -53,25 +103,47 @@ def network_ip(ip, subnet):
             raise TypeError(
                 'Subnet [{}] is not a valid ip or CIDR'.format(subnet))
     
-    return str(IPNetwork( '{}/{}'.format(
+    try: mask = int.from_bytes(socket.inet_pton(socket.AF_INET, subnet), 'big')
+    except OSError: return subnet, None
+    
+    # The host bits must be all ones, e.g. 0.0.3.255
+    hosts = mask ^ 0xffffffff
+    if hosts & (hosts + 1): return subnet, None
+    return subnet, mask
+
+
+def network_ip(ip, subnet):
+    '''Returns the network address of an IP and its subnet (a
+    netmask or CIDR).
+    
+    Raises:
+        TypeError: If the IP or the subnet are not valid
+    '''
+    
+    if not is_ip(ip): 
+        raise TypeError('IP [{}] is not a valid ip'.format(ip))
+    
+    subnet, mask = _subnet_mask(subnet)
+    
+    if mask is not None:
+        try: address = socket.inet_pton(socket.AF_INET, ip)
+        except OSError: pass
+        else:
+            return socket.inet_ntoa(
+                (int.from_bytes(address, 'big') & mask).to_bytes(4, 'big'))
+    
+    try: return str(ipaddress.IPv4Network((ip, subnet), strict=False).network_address)
+    
+    # netaddr is more lenient, e.g. with leading zeros
+    except ValueError: 
+        return str(IPNetwork( '{}/{}'.format(
             ip, subnet)).network)
 
 
 def parse_ip(raw_input):
     """Returns a list of strings containing each IP address 
     matched in the input string."""
-    return re.findall(r'''
-        \b                        # Start at a word boundry
-        (?:
-            (?:
-                25[0-5]|          # Match 250-255
-                2[0-4][0-9]|      # Match 200-249
-                [01]?[0-9][0-9]?  # Match 0-199
-            )
-            (?:\.|\b)             # Followed by a . or a word boundry
-        ){4}                      # Repeat that four times
-        \b                        # End at a word boundry
-        ''', raw_input, re.X)
+    return _parse_ip.findall(raw_input)
 
 
 def is_ip(raw_input):
@@ -80,23 +152,13 @@ def is_ip(raw_input):
         raise TypeError('[{}] is not a string'.format(
             raw_input))
     
-    match= re.match(r'''
-        (?:
-            (?:
-                25[0-5]|          # Match 250-255
-                2[0-4][0-9]|      # Match 200-249
-                [01]?[0-9][0-9]?  # Match 0-199
-            )
-            (?:\.|\b)             # Followed by a . or a word boundry
-        ){4}                      # Repeat that four times
-        ''', raw_input, re.X)
-    
-    return bool(match)
+    return bool(_is_ip.match(raw_input))
 
 def netmask_to_cidr(netmask):
     return sum([bin(int(x)).count("1") for x in netmask.split(".")])
     
     
+@lru_cache(maxsize=None)
 def cidr_to_netmask(cidr):
     '''Changes CIDR notation to subnet masks. 
     I honestly have no idea how this works. I
@@ -104,7 +166,7 @@ def cidr_to_netmask(cidr):
     
     # Strip any non digit characters
     if isinstance(cidr, str): 
-        cidr = int(re.sub(r'\D', '', str(cidr)))
+        cidr = int(_non_digit.sub('', str(cidr)))
     
     try: cidr = int(cidr)
     except Exception as e: 
@@ -123,7 +185,7 @@ def clean_ip(ip):
     '''Removes all non-digit or period characters from
     the source string'''
     
-    return ''.join([x for x in ip if re.match(r'[\d\.]', x)])
+    return _non_ip_char.sub('', ip)
         
 
 def timeit(method):
@@ -148,6 +210,24 @@ class benchmark(object):
         return False    
 
 
+class step_timer():
+    '''Adds the seconds spent in a with block to timings[step]'''
+    
+    __slots__ = ('timings', 'step', 'start')
+    
+    def __init__(self, timings, step):
+        self.timings = timings
+        self.step = step
+        
+    def __enter__(self):
+        self.start = time.perf_counter()
+        
+    def __exit__(self, ty, val, tb):
+        self.timings[self.step] = (self.timings.get(self.step, 0) + 
+                                   time.perf_counter() - self.start)
+        return False
+
+
 def port_is_open(port, address, timeout=5):
     """Checks a socket to see if the port is open.
     
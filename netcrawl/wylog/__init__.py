@@ -1,4 +1,4 @@
-from .logging import log_snip, logf, log
+from .logging import log_snip, logf, log, lazy, is_enabled, context, set_context, clear_context
 from .multi import logged_lock
 
 
@@ -5,9 +5,10 @@ Created on Mar 4, 2017
 '''
 
 from datetime import datetime
-import os, traceback, time, sys
+import json, multiprocessing, threading, traceback, time, sys
 
 from netcrawl import config
+from . import metrics, sink
 
 
 # Variables for logging
@@ -26,20 +27,122 @@ I = 5
 DEBUG = 6
 D = 6
 
+
+# Fields added to every log line of a thread (see context)
+_local = threading.local()
+
+# Keyword arguments of log() which aren't copied into JSON lines
+_LOG_KWARGS = frozenset(('v', 'proc', 'ip', 'error', 'print_out', 
+                         'log_path', 'new_log'))
+
+
+def get_context():
+    '''Returns the context fields of this thread'''
+    fields = getattr(_local, 'fields', None)
+    if fields is None: fields = _local.fields = {}
+    return fields
+
+
+def set_context(**fields):
+    '''Adds fields to every following log line of this thread, e.g.
+    set_context(pending_id=12, ip='10.1.1.1'). A field set to None
+    is removed.'''
+    current = get_context()
+    for k, val in fields.items():
+        if val is None: current.pop(k, None)
+        else: current[k] = val
+
+
+def clear_context():
+    '''Removes all context fields of this thread'''
+    _local.fields = {}
+
+
+class context():
+    '''Adds fields to the log lines written inside a with block, and
+    puts the old ones back afterwards::
+    
+        with context(pending_id=12, device='core-1'):
+            log('Parsing', proc=proc)
+    '''
+    
+    def __init__(self, **fields):
+        self.fields = fields
         
-def log(msg, **kwargs):
+    def __enter__(self):
+        self.old = dict(get_context())
+        set_context(**self.fields)
+        return self
+        
+    def __exit__(self, ty, val, tb):
+        _local.fields = self.old
+
+
+def _json_line(msg, v, proc, ip, error, kwargs):
+    '''Formats a log entry as a JSON object with the crawl, process
+    and context it came from'''
+    record = {'time': datetime.now().isoformat(timespec='milliseconds'),
+              'v': v,
+              'proc': str(proc),
+              'msg': msg,
+              'crawl': config.cc.run_number,
+              'process': multiprocessing.current_process().name,
+              }
+    record.update(get_context())
+    if ip: record['ip'] = str(ip)
+    if error is not None: record['error'] = str(error)
+    
+    for k, val in kwargs.items():
+        if k not in _LOG_KWARGS: record[k] = val
+    
+    return json.dumps(record, default=str)
+
+
+
+class lazy():
+    '''A log() argument which is only worked out if the message is
+    actually written, e.g. lazy(traceback.format_tb, tb).'''
+    
+    __slots__ = ('f', 'args')
+    
+    def __init__(self, f, *args):
+        self.f = f
+        self.args = args
+        
+    def __call__(self):
+        return self.f(*self.args)
+    
+
+def is_enabled(v):
+    '''Returns True if a message of verbosity v would be logged. Use
+    it to skip building messages which are expensive even with
+    lazy arguments.'''
+    return v < INFORMATIONAL or config.cc.debug is not False
+
+        
+def log(msg, *args, **kwargs):
     """
     Writes a message to the log.
     
+    Nothing is formatted for messages which are skipped, so pass the
+    values of a message as args instead of formatting it yourself::
+    
+        log('Got [{}] results', len(results), proc=proc, v=logging.I)
+    
     Args:
-        msg (str): The message to write.
+        msg (str): The message to write. If args are given, it is a 
+            format string for them. Can also be a callable which 
+            returns the message.
+        *args: Values to format into msg. lazy() values are called
+            first.
         
     Keyword Args:
         ip (str): The IP address of whatever device we are connected to
         proc (str): The process which caused the log entry, in the form
             of *'module.method_name'*
         log_path (str): The filepath of the directory where to save the 
-            log file. Uses config.cc.log_path by default
+            log file. Uses config.cc.log_path by default, or 
+            config.cc.json_log_path if config.cc.log_format is 'json'
         print_out (bool): If True, copies the message to console
         v (int): Verbosity level. Logs with verbosity above the global 
             verbosity level will not be printed out.  
@@ -51,108 +154,128 @@ def log(msg, **kwargs):
             
         error (Exception): An exception object to be included in the
             log output
+        **fields: Any other keyword args, like duration, are added to
+            JSON log lines
         
     Returns:
         bool: True if write was successful.
     """ 
     
     v = kwargs.get('v', 4)
+    
+    # Skip debug messages (unless turned on)
+    if (v >= 5) and (config.cc.debug is False): return False 
+    
     proc= kwargs.get('proc', '')
-    ip= kwargs.get('ip', '') 
+    ip= kwargs.get('ip') or get_context().get('ip', '')
     error=  kwargs.get('error')
     print_out= kwargs.get('print_out', True)
-    log_path = kwargs.get('log_path', config.cc.log_path)
+    json_format = config.cc.log_format == 'json'
+    log_path = kwargs.get('log_path', config.cc.json_log_path if json_format
+                          else config.cc.log_path)
     new_log = kwargs.get('new_log', False)
     
-    # Skip debug messages (unless turned on)
-    if (v >= 5) and (config.cc.debug is False): return False 
+    if callable(msg): msg = msg()
     
-    msg= str(msg)
+    if args:
+        msg = str(msg).format(*[a() if isinstance(a, lazy) else a 
+                                for a in args])
+    else: msg= str(msg)
     
     # Set the prefix for the log entry
     if v >=3: info_str = '#' + str(v)
     if v ==2: info_str = '? '
     if v ==1: info_str = '! '
 
+    if json_format: output = _json_line(msg, v, proc, ip, error, kwargs)
+    
     msg = info_str + ' ' + msg
     
-    try:
-        output = '{_proc:20}, {_msg}, {_time}, {_ip:15}, {_error}'.format(
-                    _time= datetime.now().strftime(config.cc.pretty_time),
-                    _proc= str(proc),
-                    _msg = msg.replace(',', ';'),
-                    _ip = str(ip),
-                    _error = str(error)
-                    )
-    except: pass
+    if not json_format:
+        try:
+            output = '{_proc:20}, {_msg}, {_time}, {_ip:15}, {_error}'.format(
+                        _time= datetime.now().strftime(config.cc.pretty_time),
+                        _proc= str(proc),
+                        _msg = msg.replace(',', ';'),
+                        _ip = str(ip),
+                        _error = str(error)
+                        )
+        except: pass
     
     # Print the message to console            
     try: 
         if v <=  config.cc.verbosity and print_out: print('{:<35.35}: {}'.format(proc, msg))
     except: pass
     
-    if not os.path.exists(config.cc.run_path):
-        os.makedirs(config.cc.run_path)
-    
-    # Open the error log
-    if new_log: f = open(log_path, 'w')
-    else: f = open(log_path, 'a')
-    
-    if f and not f.closed:
-        f.write(output + '\n')
-        f.close()
-        return True
-    
-    else: return False
+    sink.emit(log_path, output, new_log)
+    return True
         
 
 class log_snip():
+    '''Times a block of code. The duration is recorded in 
+    wylog.metrics under proc, and logged if config.cc.timing_logs
+    is set.'''
+    
     def __init__(self, proc, v=5):
         self.proc = proc
         self.v= v
         
     def __enter__(self):
-        log('Entering snippet [{}]'.format(self.proc),
-            proc= self.proc, v= self.v)
-        self.start = time.time()
+        if config.cc.timing_logs:
+            log('Entering snippet [{}]', self.proc, proc= self.proc, v= self.v)
+        self.start = time.perf_counter()
         
     def __exit__(self,ty,val,tb):
-        end = time.time()
+        duration = time.perf_counter() - self.start
+        metrics.observe(self.proc, duration, error= ty is not None)
+        
+        if not config.cc.timing_logs: return
         
         if ty is None:
-            log('Finished snippet [{}] after [{:.3f}] without error'.format(
-                self.proc, end-self.start), proc= self.proc, v= self.v)
+            log('Finished snippet [{}] after [{:.3f}] without error',
+                self.proc, duration, proc= self.proc, v= self.v,
+                duration= duration)
             
         else:
-            log('Finished snippet [{}] after [{:.3f}] seconds with [{}] error. Traceback: [{}]'.format(
-                self.proc, end-self.start, ty.__name__, traceback.format_tb(tb)),
-                proc= self.proc, v= self.v)
+            log('Finished snippet [{}] after [{:.3f}] seconds with [{}] error. Traceback: [{}]',
+                self.proc, duration, ty.__name__, lazy(traceback.format_tb, tb),
+                proc= self.proc, v= self.v, duration= duration)
 
 def logf(f, **kwargs):
+    '''Decorator which times each call of f. The duration is recorded
+    in wylog.metrics as 'parent.name', and logged if 
+    config.cc.timing_logs is set. Errors are always logged.'''
     parent= kwargs.get('parent', '__________')
+    proc= '{0}.{1}'.format(parent, f.__name__)
     
     # Take a decorated method and log it.
     def wrapped_f(*args, **kwargs):
-        log('Starting method [{}]'.format(f.__name__),
-            proc= '{0}.{1}'.format(parent, f.__name__),
-            v= DEBUG)
-        start = time.time()
+        timing_logs= config.cc.timing_logs
+        if timing_logs: 
+            log('Starting method [{}]', f.__name__, proc= proc, v= DEBUG)
+        start = time.perf_counter()
         
         # Run the decorated function
         try: result= f(*args, **kwargs)
         
         # On exception, log it and re-raise
         except Exception as e:
+            duration= time.perf_counter()- start
+            metrics.observe(proc, duration, error=True)
+            
             tb = sys.exc_info()[2]
-            log('Finished method [{}] after [{:.3f}] seconds with [{}] Error: [{}] Traceback: [{}]'.format(
-                f.__name__, time.time()- start, type(e).__name__, str(e), traceback.format_tb(tb)),
-                proc= '{0}.{1}'.format(parent, f.__name__),
-                v= ALERT)
+            log('Finished method [{}] after [{:.3f}] seconds with [{}] Error: [{}] Traceback: [{}]',
+                f.__name__, duration, type(e).__name__, str(e), 
+                lazy(traceback.format_tb, tb), proc= proc, v= ALERT,
+                duration= duration)
             raise
         else:
-            log('Finished method [{}] after [{:.3f}] seconds'.format(
-                f.__name__, time.time()- start),
-                proc= '{0}.{1}'.format(parent, f.__name__),
-                v= DEBUG)
+            duration= time.perf_counter()- start
+            metrics.observe(proc, duration)
+            
+            if timing_logs:
+                log('Finished method [{}] after [{:.3f}] seconds',
+                    f.__name__, duration, proc= proc, v= DEBUG,
+                    duration= duration)
             return result
     return wrapped_f
\ No newline at end of file
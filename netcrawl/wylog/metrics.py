@@ -0,0 +1,223 @@
+'''
+In-memory timing metrics for wylog.
+
+logf and log_snip record the duration of every call in a histogram
+per function or snippet, so timings can be collected without writing
+a log line per call. Each process has its own registry. Crawl
+workers send what they recorded to the main process with each result
+(see drain() and merge()), which writes the totals with dump() at the
+end of a run. summary() can be read at any time while a run is going.
+
+Besides timings, a registry holds counters (see count()), which are
+merged the same way, and gauges (see set_gauge()), which only make 
+sense in the process that sets them.
+'''
+
+import bisect, json, os, threading
+
+from netcrawl import config
+
+
+# Upper bounds of the histogram buckets, in seconds. Slower calls go
+# in one more, unbounded bucket.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10, 25, 50, 100, 250, 600)
+
+
+class histogram():
+    '''Counts durations in BUCKETS, along with their number, sum,
+    maximum and how many of them ended in an error.'''
+
+    __slots__ = ('counts', 'count', 'errors', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max: self.max = seconds
+        if error: self.errors += 1
+
+    def percentile(self, p):
+        '''Estimates a percentile (0-100) of the durations, by
+        interpolating within the bucket that it falls in. Returns
+        None if nothing was recorded.'''
+        if not self.count: return None
+
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n,
+                           self.max)
+            seen += n
+        return self.max
+
+    def state(self):
+        '''Returns the raw counts as a dict, to merge() elsewhere'''
+        return {'counts': list(self.counts), 'count': self.count,
+                'errors': self.errors, 'sum': self.sum, 'max': self.max}
+
+    def merge(self, state):
+        for i, n in enumerate(state['counts']): self.counts[i] += n
+        self.count += state['count']
+        self.errors += state['errors']
+        self.sum += state['sum']
+        self.max = max(self.max, state['max'])
+
+    def summary(self):
+        return {'count': self.count,
+                'errors': self.errors,
+                'total': round(self.sum, 6),
+                'mean': round(self.sum / self.count, 6) if self.count else None,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'max': round(self.max, 6),
+                }
+
+
+class registry():
+    '''A thread safe set of histograms and counters, by name, and 
+    gauges by name and labels'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, seconds, error=False):
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None: h = self.histograms[name] = histogram()
+            h.observe(seconds, error)
+
+    def count(self, name, n=1):
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + n
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.gauges[key] = value
+
+    def get(self, name):
+        '''Returns the histogram of name, or None'''
+        return self.histograms.get(name)
+
+    def summary(self):
+        with self.lock:
+            return {name: h.summary() for name, h in self.histograms.items()}
+
+    def state(self):
+        '''Returns the histograms and counters, to merge() elsewhere'''
+        with self.lock:
+            return {'histograms': {name: h.state() 
+                                   for name, h in self.histograms.items()},
+                    'counters': dict(self.counters)}
+
+    def drain(self):
+        '''Returns state() and empties the histograms and counters'''
+        with self.lock:
+            output = {'histograms': {name: h.state() 
+                                     for name, h in self.histograms.items()},
+                      'counters': self.counters}
+            self.histograms = {}
+            self.counters = {}
+        return output
+
+    def merge(self, state):
+        '''Adds the state returned by drain() or state() in another
+        registry to this one'''
+        if not state: return
+
+        with self.lock:
+            for name, h_state in state['histograms'].items():
+                h = self.histograms.get(name)
+                if h is None: h = self.histograms[name] = histogram()
+                h.merge(h_state)
+            
+            for name, n in state['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def clear(self):
+        with self.lock: 
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+
+
+# The registry of this process
+_registry = registry()
+
+
+def observe(name, seconds, error=False):
+    '''Records one duration (in seconds) for name'''
+    _registry.observe(name, seconds, error)
+
+def count(name, n=1):
+    '''Adds n to the counter name'''
+    _registry.count(name, n)
+
+def set_gauge(name, value, **labels):
+    '''Sets the current value of a gauge. Labels tell apart gauges 
+    with the same name, e.g. set_gauge('worker_busy', 1, worker='w1')'''
+    _registry.set_gauge(name, value, **labels)
+
+def get(name): return _registry.get(name)
+
+def histograms():
+    '''Returns a copy of the histograms, by name'''
+    with _registry.lock: 
+        output = {}
+        for name, h in _registry.histograms.items():
+            output[name] = histogram()
+            output[name].merge(h.state())
+        return output
+
+def counters():
+    with _registry.lock: return dict(_registry.counters)
+
+def gauges():
+    '''Returns the gauges as {(name, ((label, value), ...)): value}'''
+    with _registry.lock: return dict(_registry.gauges)
+
+def summary():
+    '''Returns the count, errors, total, mean, p50, p95, p99 and max
+    duration of everything recorded, by name'''
+    return _registry.summary()
+
+def drain(): return _registry.drain()
+
+def merge(state): _registry.merge(state)
+
+def clear(): _registry.clear()
+
+
+def dump(path=None):
+    '''Writes summary() to a JSON file.
+
+    Keyword Args:
+        path (str): The file to write. Default is config.cc.metrics_path
+
+    Returns:
+        dict: The summary which was written
+    '''
+    if path is None: path = config.cc.metrics_path
+
+    output = summary()
+
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'w') as outfile:
+        json.dump(output, outfile, indent=4, sort_keys=True)
+
+    return output
@@ -22,10 +22,10 @@ class logged_lock():
         self.name = name
         
     def __enter__(self):
-        log('Acquiring lock [{}]'.format(self.name), proc= self.proc, v= logging.D)
+        log('Acquiring lock [{}]', self.name, proc= self.proc, v= logging.D)
         self.lock.acquire()
-        log('Got lock [{}]'.format(self.name), proc= self.proc, v= logging.D)
+        log('Got lock [{}]', self.name, proc= self.proc, v= logging.D)
     
     def __exit__(self, exc_type, exc_value, traceback):
         self.lock.release()
-        log('Released lock [{}]'.format(self.name), proc= self.proc, v= logging.D)
\ No newline at end of file
+        log('Released lock [{}]', self.name, proc= self.proc, v= logging.D)
\ No newline at end of file
@@ -0,0 +1,208 @@
+'''
+Writes log lines to disk for wylog.
+
+Without a sink, each process keeps its log files open and appends
+one line per write. During a crawl, every worker process would then
+be writing to the same file at once. Instead, the main process starts
+a sink with start(): a thread which takes the lines of all processes
+from one queue and writes them in batches. Worker processes send
+their lines to it once they have called attach() with the sink's
+queue (processes which are forked after start() are attached
+already).
+
+Log files which grow past config.cc.log_max_bytes are renamed with 
+the time they were rotated at, e.g. log.jsonl.20170419_031500, and
+gzipped in the background. Only the sink rotates files: without one,
+each process would count the size of a shared file on its own, and 
+rename it while the others still have it open.
+'''
+
+from datetime import datetime
+import gzip, multiprocessing, os, queue, shutil, threading, time
+
+from netcrawl import config
+
+
+# The queue of the running sink, and its writer thread
+_queue = None
+_writer = None
+
+# Files opened by this process when no sink is running, and the lock
+# which threads writing to them share
+_files = {}
+_files_lock = threading.Lock()
+
+# Threads compressing rotated files
+_compressing = []
+
+
+def _compress(path):
+    '''Gzips a rotated log file, and removes the original'''
+    with open(path, 'rb') as infile, gzip.open(path + '.gz.tmp', 'wb') as outfile:
+        shutil.copyfileobj(infile, outfile)
+    os.replace(path + '.gz.tmp', path + '.gz')
+    os.remove(path)
+
+
+class log_file():
+    '''An open log file, which is rotated once it grows past 
+    config.cc.log_max_bytes if it is written by the sink'''
+
+    def __init__(self, path, new_log=False, rotating=False):
+        self.path = path
+        self.rotating = rotating
+
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+
+        self.f = open(path, 'w' if new_log else 'a')
+        self.size = self.f.tell()
+
+    def write(self, line):
+        self.f.write(line + '\n')
+        self.size += len(line) + 1
+
+        limit = config.cc.log_max_bytes
+        if self.rotating and limit and self.size >= limit: self.rotate()
+
+    def rotate(self):
+        self.f.close()
+
+        stamp = datetime.now().strftime(config.cc.file_time)
+        rotated = '{}.{}'.format(self.path, stamp)
+        n = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            n += 1
+            rotated = '{}.{}_{}'.format(self.path, stamp, n)
+        os.replace(self.path, rotated)
+
+        t = threading.Thread(target=_compress, args=(rotated,), 
+                             name='wylog.compress')
+        t.start()
+        _compressing.append(t)
+
+        self.f = open(self.path, 'w')
+        self.size = 0
+
+    def flush(self): self.f.flush()
+
+    def close(self): self.f.close()
+
+
+def _open(files, path, new_log=False, rotating=False):
+    '''Returns the log file at path from a dict of open files,
+    opening it (and creating its directory) the first time'''
+
+    f = files.get(path)
+    if f is None or new_log:
+        if f is not None: f.close()
+        f = files[path] = log_file(path, new_log, rotating)
+    return f
+
+
+def emit(path, line, new_log=False):
+    '''Writes one log line, through the sink if there is one.
+
+    Args:
+        path (str): The log file
+        line (str): The line, without a newline
+
+    Keyword Args:
+        new_log (bool): Empty the file first
+    '''
+    if _queue is not None:
+        _queue.put((path, line, new_log))
+        return
+
+    with _files_lock:
+        f = _open(_files, path, new_log)
+        f.write(line)
+        f.flush()
+
+
+class log_writer(threading.Thread):
+    '''Takes (path, line, new_log) records from a queue and writes
+    them, flushing every config.cc.log_batch lines or every
+    config.cc.log_flush_interval seconds, whichever comes first.
+    A None record stops the writer.'''
+
+    def __init__(self, records):
+        threading.Thread.__init__(self, name='wylog.sink', daemon=True)
+        self.records = records
+        self.files = {}
+
+    def run(self):
+        pending = 0
+        last_flush = time.monotonic()
+
+        while True:
+            # Wake up in time for the next flush
+            interval = config.cc.log_flush_interval
+            timeout = interval
+            if pending: 
+                timeout = max(0, interval - (time.monotonic() - last_flush))
+
+            try: record = self.records.get(timeout=timeout)
+            except queue.Empty: record = False
+
+            if record:
+                path, line, new_log = record
+                _open(self.files, path, new_log, rotating=True).write(line)
+                pending += 1
+
+            # Flush on a full batch, when the interval is up, or when
+            # stopping
+            if pending and (record is None or 
+                            pending >= config.cc.log_batch or
+                            time.monotonic() - last_flush >= interval):
+                for f in self.files.values(): f.flush()
+                pending = 0
+                last_flush = time.monotonic()
+
+            if record is None: break
+
+        for f in self.files.values(): f.close()
+
+
+def start():
+    '''Starts the sink in this process. All lines logged by this
+    process, and by the processes it forks afterwards, go through it.
+
+    Returns:
+        multiprocessing.Queue: The sink's queue, to pass to attach()
+            in processes which aren't forked
+    '''
+    global _queue, _writer
+
+    if _queue is not None: return _queue
+
+    records = multiprocessing.Queue()
+    _writer = log_writer(records)
+    _writer.start()
+    _queue = records
+
+    # Lines written before the sink started must come first
+    with _files_lock:
+        for f in _files.values(): f.close()
+        _files.clear()
+
+    return _queue
+
+
+def attach(records):
+    '''Sends the lines logged by this process to a sink which was
+    started in another process'''
+    global _queue
+    _queue = records
+
+
+def stop():
+    '''Writes out everything in the sink's queue and stops it'''
+    global _queue, _writer
+
+    if _writer is not None:
+        _queue.put(None)
+        _writer.join()
+    _queue = _writer = None
+
+    while _compressing: _compressing.pop().join()
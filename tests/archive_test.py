@@ -0,0 +1,54 @@
+'''
+Tests for the raw output archive
+'''
+
+import os
+
+import pytest
+
+from netcrawl import archive, config
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(config.cc, 'archive_path', str(tmp_path / 'archive'))
+    monkeypatch.setattr(config.cc, 'devices_path', str(tmp_path / 'devices'))
+    return tmp_path
+
+
+def blobs(path):
+    return [f for _, _, files in os.walk(str(path / 'archive')) for f in files]
+
+
+def test_put_and_get(paths):
+    key= archive.put('hostname lab-01\n')
+    
+    assert key == archive.digest('hostname lab-01\n')
+    assert archive.get(key) == 'hostname lab-01\n'
+    assert archive.put('hostname lab-01\n') == key
+    assert len(blobs(paths)) == 1
+
+
+def test_unchanged_output_is_stored_once(paths):
+    from datetime import datetime
+    
+    first= archive.record('LAB01', {'config': 'a' * 1000, 'cdp': 'b', 'mac': None},
+                         when=datetime(2017, 4, 1))
+    second= archive.record('LAB01', {'config': 'a' * 1000, 'cdp': 'c'},
+                          when=datetime(2017, 4, 2))
+    
+    assert first['config'] == second['config']
+    assert 'mac' not in first
+    assert len(blobs(paths)) == 3
+    
+    assert [x[0] for x in archive.history('LAB01', 'config')] == [
+        '20170401_000000', '20170402_000000']
+    assert archive.latest('LAB01', 'cdp') == 'c'
+    assert archive.latest('LAB02', 'cdp') is None
+    
+    # Compressed on disk
+    assert os.path.getsize(archive.blob_path(first['config'])) < 1000
@@ -5,11 +5,11 @@ Created on Mar 15, 2017
 '''
 
 from netcrawl.devices.base import NetworkDevice
-from netcrawl import config
+from netcrawl import archive, config
 from faker import Faker
 from tests.helpers import populated_cisco_network_device,\
     populated_cisco_interface
-import os, glob
+import os
 
 
 def test_interface_string():
@@ -22,23 +22,142 @@ def test_interface_string():
     # Make sure something legible actually got printed
     assert len(str(i)) > 5
     
-def test_config_save():
+def test_config_save(tmp_path, monkeypatch):
     '''Ensure that the device can save its config'''
+    monkeypatch.setattr(config.cc, 'archive_path', str(tmp_path / 'archive'))
+    monkeypatch.setattr(config.cc, 'devices_path', str(tmp_path / 'devices'))
     
     n= populated_cisco_network_device()
-    n.save_config()
+    keys= n.save_config()
     
-    path = os.path.join(config.cc.devices_path, 
-                        n.unique_name)
+    assert archive.latest(n.unique_name, 'config') == n.config
+    assert set(keys) == {'config'}
     
-    assert glob.glob(os.path.join(path, '*.cfg'))
     
-    import shutil
-    shutil.rmtree(path, ignore_errors=True)
     
-    assert not glob.glob(os.path.join(path, '*.cfg'))
+
+class _slow_connection():
+    '''Stands in for a Netmiko connection which never answers'''
+    def __init__(self):
+        self.disconnected= False
+    
+    def disconnect(self):
+        self.disconnected= True
+
+
+def test_watchdog_cuts_session_at_deadline():
+    from time import sleep
+    from netcrawl.retry import deadline
+    
+    n= populated_cisco_network_device()
+    n.connection= _slow_connection()
+    
+    old= config.cc.phase_timeouts
+    config.cc.phase_timeouts= {'optional': 0.05}
+    try:
+        n._start_phase('optional', deadline())
+        connection= n.connection
+        sleep(0.2)
+        assert connection.disconnected
+        assert n.deadline.expired()
+    finally:
+        config.cc.phase_timeouts= old
+        n._end_session()
+    
+    # The device must be picklable afterwards
+    import pickle
+    assert n.connection is None
+    pickle.dumps(n)
+
+
+def _named_interfaces(*names):
+    from netcrawl.devices.base import Interface
+    return [Interface(interface_name=x) for x in names]
+
+
+def test_find_interface_matches_abbreviations():
+    n= populated_cisco_network_device()
+    n.merge_interfaces(_named_interfaces('GigabitEthernet1/0/1',
+                                         'GigabitEthernet1/0/10',
+                                         'TenGigabitEthernet1/0/1',
+                                         'Port-channel10',
+                                         'Vlan10'))
+    
+    assert n.find_interface('Gi1/0/1').interface_name == 'GigabitEthernet1/0/1'
+    assert n.find_interface('Gi1/0/10').interface_name == 'GigabitEthernet1/0/10'
+    assert n.find_interface('Te1/0/1').interface_name == 'TenGigabitEthernet1/0/1'
+    assert n.find_interface('Po10').interface_name == 'Port-channel10'
+    assert n.find_interface('vlan10').interface_name == 'Vlan10'
+    assert n.find_interface('Gi2/0/1') is None
+    
+    # New interfaces are picked up
+    n.interfaces.extend(_named_interfaces('Loopback0'))
+    assert n.find_interface('Lo0').interface_name == 'Loopback0'
+
+
+def test_merge_interfaces_overwrites_by_name():
+    n= populated_cisco_network_device()
+    n.merge_interfaces(_named_interfaces('Vlan10', 'Vlan20'))
+    
+    new= _named_interfaces('Vlan20', 'Vlan30')
+    new[0].interface_description= 'Servers'
+    n.merge_interfaces(new)
+    
+    assert [i.interface_name for i in n.interfaces] == ['Vlan10', 'Vlan20', 'Vlan30']
+    assert n.interfaces[1].interface_description == 'Servers'
+
+
+def test_mac_array_stores_integers():
+    from netcrawl.devices.base import mac_array
+    
+    macs= mac_array(['0011.2233.44aa', '00:11:22:33:44:BB'])
+    macs.append(0x001122334455)
+    
+    assert list(macs) == ['0011223344AA', '0011223344BB', '001122334455']
+    assert '0011.2233.44bb' in macs
+    assert macs._macs.itemsize == 8
+
+
+def test_device_pickles_without_raw_output():
+    import pickle
+    from netcrawl.devices import IosDevice
+    from netcrawl.devices.base import Interface
+    
+    n= IosDevice(ip='192.0.2.1')
+    n.config= 'hostname test'
+    i= Interface(interface_name='Vlan10', raw_interface='interface Vlan10')
+    i.mac_address_table.append('0011.2233.4455')
+    i.neighbors.append({'device_name': 'x', 'raw_cdp': 'Device ID: x'})
+    n.interfaces.append(i)
+    
+    assert not hasattr(n, '__dict__')
+    assert not hasattr(i, '__dict__')
+    
+    n.drop_raw_output()
+    n= pickle.loads(pickle.dumps(n))
+    
+    assert n.interfaces[0].raw_interface is None
+    assert n.interfaces[0].neighbors[0]['raw_cdp'] is None
+    assert list(n.interfaces[0].mac_address_table) == ['001122334455']
+
+
+def test_fingerprints_ignore_volatile_lines():
+    n= populated_cisco_network_device()
+    n.config= 'hostname lab-01\n!\ninterface Vlan1\n ip address 10.0.0.1 255.255.255.0\n'
+    n.raw_output= {'_get_interfaces': None, '_get_mac_address_table': 'table'}
+    n.fingerprints= n.fingerprint()
     
+    assert set(n.fingerprints) == {'config', '_get_mac_address_table'}
     
+    previous= dict(n.fingerprints)
+    n.config= ('! Last configuration change at 03:15:00 UTC Tue Apr 18 2017\n' + 
+               n.config + 'ntp clock-period 36029056\n')
+    assert n.fingerprint() == previous
     
+    # Output which wasn't collected this time isn't compared
+    n.fingerprints= {'config': previous['config']}
+    assert n.unchanged_since(previous)
     
-    
\ No newline at end of file
+    n.fingerprints= {'config': 'changed'}
+    assert not n.unchanged_since(previous)
+    assert not n.unchanged_since(None)
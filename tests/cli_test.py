@@ -0,0 +1,88 @@
+'''
+Tests for connection handling in netcrawl.cli
+'''
+
+from pytest import raises
+
+from netcrawl import config, cli
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+_cred= {'username': 'user', 'password': 'pass', 'cred_type': 'test'}
+
+
+class _fake_handler():
+    '''Stands in for a Netmiko ConnectHandler. Only connects using
+    the device types in *works*.'''
+    def __init__(self, works):
+        self.works= works
+        self.tried= []
+        
+    def __call__(self, device_type, **kwargs):
+        self.tried.append(device_type)
+        if device_type not in self.works:
+            raise ValueError('Connection refused')
+        return device_type
+
+
+def _probe_recorder(monkeypatch, open_ports):
+    probed= []
+    def port_is_open(port, address, timeout=5):
+        probed.append(port)
+        return port in open_ports
+    monkeypatch.setattr(cli, 'port_is_open', port_is_open)
+    return probed
+
+
+def test_ssh_is_tried_first_by_default(monkeypatch):
+    probed= _probe_recorder(monkeypatch, (22, 23))
+    handler= _fake_handler(['cisco_ios'])
+    
+    result= cli.connect(handler, 'cisco_ios', '192.0.2.10', cred=_cred)
+    
+    assert result['transport'] == 'ssh'
+    assert probed == [22]
+
+
+def test_known_telnet_device_skips_ssh(monkeypatch):
+    probed= _probe_recorder(monkeypatch, (23,))
+    handler= _fake_handler(['cisco_ios_telnet'])
+    
+    result= cli.connect(handler, 'cisco_ios', '192.0.2.11', cred=_cred,
+                        transport='telnet')
+    
+    assert result['transport'] == 'telnet'
+    assert probed == [23]
+    assert handler.tried == ['cisco_ios_telnet']
+
+
+def test_port_history_prefers_telnet(monkeypatch):
+    probed= _probe_recorder(monkeypatch, (23,))
+    handler= _fake_handler(['cisco_ios_telnet'])
+    
+    result= cli.connect(handler, 'cisco_ios', '192.0.2.12', cred=_cred,
+                        history={'tcp_22': False, 'tcp_23': True})
+    
+    assert probed == [23]
+    assert result['tcp_22'] is False
+
+
+def test_falls_back_to_other_transport(monkeypatch):
+    probed= _probe_recorder(monkeypatch, (22, 23))
+    handler= _fake_handler(['cisco_ios'])
+    
+    result= cli.connect(handler, 'cisco_ios', '192.0.2.13', cred=_cred,
+                        transport='telnet')
+    
+    assert result['transport'] == 'ssh'
+    assert probed == [23, 22]
+
+
+def test_no_open_ports_raises(monkeypatch):
+    _probe_recorder(monkeypatch, ())
+    
+    with raises(IOError):
+        cli.connect(_fake_handler([]), 'cisco_ios', '192.0.2.14', cred=_cred)
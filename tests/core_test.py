@@ -26,7 +26,14 @@ def test_process_duplicate_device():
     duplicate= core.process_duplicate_device(device, ddb)
     
     assert duplicate
-        
+
+
+def test_unknown_collection_profile_is_rejected(monkeypatch):
+    config.parse_config()
     
+    monkeypatch.setattr('sys.argv', ['netcrawl', '-sR', '--collect', 'nope'])
+    with pytest.raises(SystemExit):
+        core.parse_cli()
     
-    
\ No newline at end of file
+    monkeypatch.setattr('sys.argv', ['netcrawl', '-sR', '--collect', 'topology'])
+    assert core.parse_cli().collection_profile == 'topology'
@@ -0,0 +1,74 @@
+'''
+Tests for the single pass IOS config parser
+'''
+
+import re
+
+import pytest
+
+from netcrawl import config
+from netcrawl.devices import IosDevice
+from netcrawl.devices.ios_config import parse_config
+from tests import helpers
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+@pytest.fixture(params=list(helpers.get_example_dir('ios_config')))
+def example(request):
+    return request.param
+
+
+def test_matches_multi_pass_parsing(example):
+    '''The parser must find what the old per-item regexes found'''
+    parsed= parse_config(example)
+
+    assert parsed.hostname == re.search('^hostname (.+)\n', example, re.M).group(1)
+    assert parsed.other_ips == re.findall(
+        r'(?:glbp|hsrp|standby).*?(\d{1,3}(?:\.\d{1,3}){3})', example, re.I)
+
+    raw_interfaces= re.findall(r'\n(^interface[\s\S]+?)\n!', example, (re.M | re.I))
+    assert [i.raw_interface for i in parsed.interfaces] == raw_interfaces
+
+
+def test_interface_details():
+    example= next(helpers.get_example_dir('ios_config'))
+    interfaces= {i.interface_name: i for i in parse_config(example).interfaces}
+
+    assert interfaces['Port-channel1'].interface_description == 'Uplink to lab-core-01'
+    assert interfaces['GigabitEthernet1/0/3.100'].interface_type == 'GigabitEthernet'
+    assert interfaces['GigabitEthernet1/0/3.100'].interface_number == '1/0/3.100'
+    assert interfaces['GigabitEthernet1/0/3.100'].interface_subnet == '/24'
+    assert interfaces['Vlan1'].interface_ip is None
+
+    # Secondary addresses don't replace the primary
+    assert interfaces['Vlan10'].interface_ip == '10.10.10.2'
+    assert interfaces['Vlan10'].interface_subnet == '255.255.255.0'
+    assert interfaces['Vlan10'].virtual_ip == '10.10.10.1'
+    assert interfaces['Vlan20'].virtual_ip == '10.10.20.1'
+
+
+def test_device_wrappers_share_one_parse():
+    d= IosDevice()
+    d.config= next(helpers.get_example_dir('ios_config'))
+
+    d._parse_hostname()
+    d._get_interfaces()
+    d._get_other_ips()
+
+    assert d.device_name == 'lab-dist-01'
+    assert len(d.interfaces) == 8
+    assert d.other_ips == ['10.10.10.1', '10.10.20.1']
+    assert d.parsed_config() is d.parsed_config()
+
+
+def test_hostname_does_not_parse_the_config():
+    d= IosDevice()
+    d.config= next(helpers.get_example_dir('ios_config'))
+    
+    # Part of the fetch stage, so the config is left to the parse pool
+    d._parse_hostname()
+    assert d.device_name == 'lab-dist-01'
+    assert d._parsed == (None, None)
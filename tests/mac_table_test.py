@@ -0,0 +1,43 @@
+'''
+Tests for the MAC address table parser
+'''
+
+import pytest
+
+from netcrawl.devices import mac_table
+from tests import helpers
+
+
+@pytest.fixture(params=list(helpers.get_example_dir('mac_table')))
+def example(request):
+    return request.param
+
+
+def test_fast_path_matches_regex(example):
+    fast= mac_table.parse_mac_table(example)
+
+    assert fast
+    assert fast == mac_table.parse_mac_table_regex(example)
+
+
+def test_only_interfaces_are_kept():
+    for example in helpers.get_example_dir('mac_table'):
+        ports= {port for mac, port in mac_table.parse_mac_table(example)}
+
+        assert not ports & {'CPU', 'Router', 'sup-eth1(R)', 'Peer-Link'}
+
+
+def test_macs_are_integers():
+    table= '''
+Vlan    Mac Address       Type        Ports
+----    -----------       --------    -----
+  10    0011.2233.44aa    DYNAMIC     Gi1/0/1
+  10    ffff.ffff.ffff    STATIC      Gi1/0/1
+'''
+    assert mac_table.parse_mac_table(table) == [(0x0011223344AA, 'Gi1/0/1')]
+
+
+def test_unknown_layout_uses_regex():
+    table= '00-11-22-33-44-55 learned on Gi0/1\n'
+
+    assert mac_table.parse_mac_table(table) == [(0x001122334455, 'Gi0/1')]
@@ -0,0 +1,60 @@
+'''
+Tests for the timing metrics recorded by logf and log_snip
+'''
+
+import json
+
+import pytest
+
+from netcrawl import config
+from netcrawl.wylog import log_snip, logf, metrics
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+def setup_function(function):
+    metrics.clear()
+
+
+def test_percentiles_are_interpolated():
+    h= metrics.histogram()
+    for i in range(100): h.observe(0.0015)
+    h.observe(3.0)
+    
+    assert 0.001 < h.percentile(50) <= 0.0025
+    assert h.percentile(100) == 3.0
+    assert metrics.histogram().percentile(50) is None
+
+
+def test_decorators_record_calls_and_errors():
+    @logf
+    def fails(): raise ValueError('Expected')
+    
+    with pytest.raises(ValueError): fails()
+    with log_snip('metrics_test.snip'): pass
+    
+    summary= metrics.summary()
+    assert summary['__________.fails']['count'] == 1
+    assert summary['__________.fails']['errors'] == 1
+    assert summary['metrics_test.snip']['errors'] == 0
+
+
+def test_drained_metrics_merge(tmp_path):
+    config.cc.timing_logs= False
+    try:
+        for i in range(3):
+            with log_snip('metrics_test.merge'): pass
+    finally: config.cc.timing_logs= True
+    
+    state= metrics.drain()
+    assert metrics.summary() == {}
+    
+    metrics.merge(state)
+    metrics.merge(state)
+    
+    path= str(tmp_path / 'metrics.json')
+    metrics.dump(path)
+    with open(path) as f: dumped= json.load(f)
+    assert dumped['metrics_test.merge']['count'] == 6
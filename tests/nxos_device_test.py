@@ -0,0 +1,210 @@
+'''
+Tests for the NX-OS JSON collectors
+'''
+
+import json, pickle
+
+from netcrawl import config
+from netcrawl.devices import IosDevice, NxosDevice
+from netcrawl.devices.nxos_device import json_rows
+from netcrawl.retry import deadline
+from tests import helpers
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+INTERFACES= {'TABLE_interface': {'ROW_interface': [
+    {'interface': 'mgmt0', 'eth_ip_addr': '10.0.0.5', 'eth_ip_mask': 24},
+    {'interface': 'Ethernet1/1', 'desc': 'To core', 'eth_bundle': 'port-channel10'},
+    {'interface': 'Vlan10', 'svi_desc': 'Users', 'svi_ip_addr': '10.10.10.2',
+     'svi_ip_mask': 24},
+    ]}}
+
+CDP= {'TABLE_cdp_neighbor_detail_info': {'ROW_cdp_neighbor_detail_info': {
+    'device_id': 'core-01.example.com(FOX1234)',
+    'sysname': 'core-01',
+    'platform_id': 'N9K-C93180YC-EX',
+    'version': 'Cisco Nexus Operating System (NX-OS) Software, Version 7.0(3)I7(5)',
+    'intf_id': 'Ethernet1/1',
+    'port_id': 'Ethernet1/49',
+    'v4mgmtaddr': '10.0.0.1',
+    'v4addr': ['10.0.0.1', '10.1.1.1'],
+    }}}
+
+MAC= {'TABLE_mac_address': {'ROW_mac_address': [
+    {'disp_mac_addr': '0011.2233.4455', 'disp_port': 'Ethernet1/1'},
+    {'disp_mac_addr': '0011.2233.4466', 'disp_port': 'Vlan10'},
+    {'disp_mac_addr': '0011.2233.4477', 'disp_port': 'sup-eth1(R)'},
+    ]}}
+
+
+class fake_connection():
+    def __init__(self, outputs):
+        self.outputs= outputs
+        self.sent= []
+
+    def send_command_expect(self, command):
+        self.sent.append(command)
+        return self.outputs[command]
+
+
+def make_device(outputs):
+    d= NxosDevice(ip='192.0.2.50')
+    d.connection= fake_connection(outputs)
+    return d
+
+
+def test_json_rows_handles_single_rows():
+    assert len(json_rows(INTERFACES, 'TABLE_interface', 'ROW_interface')) == 3
+    assert len(json_rows(CDP, 'TABLE_cdp_neighbor_detail_info',
+                         'ROW_cdp_neighbor_detail_info')) == 1
+    assert json_rows({}, 'TABLE_mac_address', 'ROW_mac_address') == []
+
+
+def test_json_collectors():
+    d= make_device({
+        'show interface | json': 'show interface | json\n' + json.dumps(INTERFACES) + '\nswitch# ',
+        'show cdp neighbors detail | json': json.dumps(CDP),
+        'show mac address-table | json': json.dumps(MAC),
+        })
+
+    d._get_interfaces()
+    interfaces= {i.interface_name: i for i in d.interfaces}
+    assert interfaces['mgmt0'].interface_subnet == '24'
+    assert interfaces['Vlan10'].interface_ip == '10.10.10.2'
+    assert interfaces['Vlan10'].interface_description == 'Users'
+    assert interfaces['Ethernet1/1'].parent_interface_name == 'port-channel10'
+
+    d._get_cdp_neighbors()
+    neighbor= interfaces['Ethernet1/1'].neighbors[0]
+    assert neighbor['device_name'] == 'core-01'
+    assert neighbor['netmiko_platform'] == 'cisco_nxos'
+    assert neighbor['ip_list'] == ['10.0.0.1', '10.1.1.1']
+
+    d._get_mac_address_table()
+    assert len(interfaces['Ethernet1/1'].mac_address_table) == 1
+    assert len(interfaces['Vlan10'].mac_address_table) == 1
+
+
+def test_config_is_parsed_without_json():
+    d= make_device({'show interface | json': "% Invalid command at '^' marker."})
+    d.config= 'interface Ethernet1/2\n  description Spare\n  ip address 10.2.2.2/30\n\n'
+
+    d._get_interfaces()
+    assert d.interfaces[0].interface_name == 'Ethernet1/2'
+    assert d.interfaces[0].interface_ip == '10.2.2.2'
+
+
+
+def test_garbled_mac_json_falls_back_to_text():
+    d= make_device({
+        'show interface | json': json.dumps(INTERFACES),
+        'show mac address-table | json': json.dumps(MAC)[:40],
+        'show mac address-table': '10    0011.2233.4455    dynamic   0   F    F  Eth1/1',
+        })
+    d._get_interfaces()
+    
+    raw= d._fetch_mac_address_table(attempts=1)
+    assert isinstance(raw, str)
+    assert d.connection.sent[-1] == 'show mac address-table'
+
+def test_fetch_and_parse_stages():
+    d= make_device({
+        'show interface | json': json.dumps(INTERFACES),
+        'show cdp neighbors detail | json': json.dumps(CDP),
+        'show mac address-table | json': json.dumps(MAC),
+        })
+    
+    d._fetch(d._get_interfaces)
+    d._collect_optional(deadline(), fetch_only=True,
+                        plan=['_get_cdp_neighbors', '_get_mac_address_table'])
+    
+    # Nothing is parsed until the session is gone
+    assert not d.interfaces
+    assert list(d.raw_output) == ['_get_interfaces', '_get_cdp_neighbors',
+                                  '_get_mac_address_table']
+    
+    d._end_session()
+    d= pickle.loads(pickle.dumps(d))
+    d.parse_device()
+    
+    interfaces= {i.interface_name: i for i in d.interfaces}
+    assert interfaces['Ethernet1/1'].neighbors[0]['device_name'] == 'core-01'
+    assert len(interfaces['Vlan10'].mac_address_table) == 1
+    assert interfaces['Vlan10'].network_ip == '10.10.10.0'
+    assert d.raw_output == {}
+
+
+def test_unsplit_collectors_are_parsed_whole():
+    d= IosDevice(ip='192.0.2.51')
+    d.config= next(helpers.get_example_dir('ios_config'))
+    
+    d._fetch(d._get_interfaces)
+    d._fetch(d._get_other_ips)
+    assert d.raw_output == {'_get_interfaces': None, '_get_other_ips': None}
+    
+    d.parse_device()
+    assert len(d.interfaces) == 8
+    assert d.other_ips == ['10.10.10.1', '10.10.20.1']
+
+
+def test_stored_json_is_decoded():
+    d= make_device({
+        'show interface | json': json.dumps(INTERFACES),
+        'show mac address-table | json': json.dumps(MAC),
+        })
+    d._get_interfaces()
+    d._get_mac_address_table()
+    
+    record= {'config': '',
+             'raw_interfaces': [i.raw_interface for i in d.interfaces],
+             'raw_cdp': None,
+             'raw_mac_address_table': d.raw_mac_address_table}
+    
+    stored= NxosDevice(ip='192.0.2.50')
+    stored.load_stored_output(record)
+    stored.parse_device()
+    
+    assert ([i.interface_name for i in stored.interfaces] == 
+            [i.interface_name for i in d.interfaces])
+    assert len(stored.find_interface('Ethernet1/1').mac_address_table) == 1
+
+
+def test_stored_interfaces_without_json_are_skipped():
+    d= make_device({'show interface | json': json.dumps(INTERFACES)})
+    d._get_interfaces()
+    
+    # An interface added from the MAC table has no raw output
+    raw= [i.raw_interface for i in d.interfaces] + [None]
+    
+    stored= NxosDevice(ip='192.0.2.50')
+    stored.config= 'interface Ethernet9/9\n  description Config only\n\n'
+    stored.load_stored_output({'config': stored.config,
+                               'raw_interfaces': raw,
+                               'raw_cdp': None,
+                               'raw_mac_address_table': None})
+    stored.parse_device()
+    
+    # Parsed from the stored JSON, not from the config
+    assert ([i.interface_name for i in stored.interfaces] == 
+            [i.interface_name for i in d.interfaces])
+
+
+def test_steps_are_timed():
+    d= make_device({
+        'show interface | json': json.dumps(INTERFACES),
+        'show mac address-table | json': json.dumps(MAC),
+        })
+    
+    d._fetch(d._get_interfaces)
+    d._fetch(d._get_mac_address_table)
+    d._end_session()
+    d.parse_device()
+    
+    assert set(d.timings) == {'collect:show interface | json', 
+                              'collect:show mac address-table | json',
+                              'parse', 'parse:_get_interfaces', 
+                              'parse:_get_mac_address_table'}
+    assert d.timings['parse'] >= d.timings['parse:_get_interfaces']
@@ -0,0 +1,67 @@
+'''
+Tests for the collection profiles in netcrawl.devices.profiles
+'''
+
+from pytest import raises
+
+from netcrawl import config
+from netcrawl.devices import profiles
+from tests.helpers import populated_cisco_network_device
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+def test_full_profile_runs_everything():
+    n= populated_cisco_network_device()
+    n.ip= '10.0.0.1'
+    
+    plan= profiles.collection_plan(n, 'full')
+    assert plan == [method for name, method in profiles.COLLECTORS]
+
+
+def test_topology_profile_skips_macs():
+    n= populated_cisco_network_device()
+    n.ip= '10.0.0.1'
+    
+    plan= profiles.collection_plan(n, 'topology')
+    assert '_get_cdp_neighbors' in plan
+    assert '_get_mac_address_table' not in plan
+    assert 'get_serials' not in plan
+
+
+def test_interval_runs_once_per_cycle():
+    for ip in ('10.0.0.1', '10.0.0.2', '192.168.1.1'):
+        due= [profiles.is_due(7, ip, run) for run in range(1, 8)]
+        assert due.count(True) == 1
+
+
+def test_single_runs_collect_everything_enabled():
+    # Outside of a crawl, intervals don't apply
+    assert profiles.is_due(7, '10.0.0.1', 0)
+    assert not profiles.is_due(0, '10.0.0.1', 0)
+
+
+def test_overrides_match_platform_and_name():
+    n= populated_cisco_network_device()
+    n.ip= '10.0.0.1'
+    n.netmiko_platform= 'cisco_nxos'
+    n.device_name= 'site-core-1'
+    
+    old= config.cc.collection_overrides
+    config.cc.collection_overrides= {'cisco_nxos': {'mac': 0},
+                                     '-core-': {'cdp': 0}}
+    try:
+        plan= profiles.collection_plan(n, 'full')
+    finally:
+        config.cc.collection_overrides= old
+    
+    assert '_get_mac_address_table' not in plan
+    assert '_get_cdp_neighbors' not in plan
+    assert 'get_serials' in plan
+    
+
+def test_unknown_profile_raises():
+    with raises(KeyError):
+        profiles.get_profile('no_such_profile')
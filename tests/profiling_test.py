@@ -0,0 +1,47 @@
+'''
+Tests for profiling crawls across processes
+'''
+
+import multiprocessing, os, pstats
+
+from netcrawl import config, profiling
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+def _busy_work():
+    return sum(i * i for i in range(200000))
+
+
+def _profiled_child(cc):
+    config.cc= cc
+    profiling.start('worker')
+    _busy_work()
+
+
+def test_profiles_are_merged(tmp_path):
+    old= config.cc.profile_path
+    config.cc.profile_path= str(tmp_path)
+    try:
+        profiling.start('coordinator')
+        
+        child= multiprocessing.Process(target=_profiled_child, args=(config.cc,))
+        child.start()
+        child.join()
+        
+        _busy_work()
+        assert profiling.stop().startswith(str(tmp_path))
+        
+        assert len(os.listdir(str(tmp_path))) == 2
+        merged, collapsed= profiling.merge()
+    finally:
+        config.cc.profile_path= old
+    
+    stats= pstats.Stats(merged)
+    assert any(func[2] == '_busy_work' for func in stats.stats)
+    
+    with open(collapsed) as f: lines= f.read().splitlines()
+    assert any('(_busy_work);' in x for x in lines)
+    assert all(int(x.rsplit(' ', 1)[1]) > 0 for x in lines)
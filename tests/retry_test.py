@@ -0,0 +1,101 @@
+'''
+Tests for the retry policies in netcrawl.retry
+'''
+
+import socket, threading
+
+from netmiko import NetMikoAuthenticationException
+from pytest import raises
+
+from netcrawl import config, retry
+
+
+def setup_module(module):
+    config.parse_config()
+
+    # Don't actually sleep between retries
+    config.cc.retry_base_delay= 0
+
+
+def test_classify_sorts_errors():
+    assert retry.classify(NetMikoAuthenticationException('x')) == retry.AUTH
+    assert retry.classify(socket.timeout()) == retry.TIMEOUT
+    assert retry.classify(OSError('Pattern not detected in output')) == retry.PROMPT
+    assert retry.classify(retry.CheckFailed('x', '   ')) == retry.EMPTY
+    assert retry.classify(retry.CheckFailed('x', 'junk')) == retry.INVALID
+    assert retry.classify(KeyError('x')) == retry.UNKNOWN
+
+
+def test_backoff_stays_within_bounds():
+    for i in range(10):
+        delay= retry.backoff(i, base=1, maximum=4)
+        assert 0 <= delay <= 4
+
+
+def test_auth_errors_are_not_retried():
+    policy= retry.retry_policy(attempts=5)
+    assert policy.retry(retry.AUTH) is False
+
+
+def test_retries_stop_at_attempt_cap():
+    policy= retry.retry_policy(attempts=3, budgets={retry.TIMEOUT: 10})
+
+    assert policy.retry(retry.TIMEOUT)
+    assert policy.retry(retry.TIMEOUT)
+    assert not policy.retry(retry.TIMEOUT)
+
+
+def test_no_retry_past_deadline():
+    import time
+    policy= retry.retry_policy(attempts=5, deadline= time.time() - 1)
+
+    assert not policy.retry(retry.TIMEOUT)
+
+
+def test_circuit_opens_after_threshold():
+    b= retry.breaker('192.0.2.1')
+
+    for i in range(config.cc.circuit_threshold):
+        b.check()
+        b.failure(retry.TIMEOUT)
+
+    with raises(retry.CircuitOpenError):
+        b.check()
+
+    b.success()
+    b.check()
+
+
+def test_threads_share_one_breaker_per_host():
+    found= []
+    start= threading.Barrier(8)
+
+    def get():
+        start.wait(5)
+        found.append(retry.breaker('192.0.2.2'))
+
+    threads= [threading.Thread(target=get) for i in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join(5)
+
+    assert len(found) == 8
+    assert all(b is found[0] for b in found)
+
+
+def test_deadline_is_capped_by_parent():
+    outer= retry.deadline(1)
+    inner= retry.deadline(100, outer)
+
+    assert inner.remaining() <= 1
+    assert retry.deadline().remaining() is None
+    assert retry.deadline(None, outer).expires == outer.expires
+
+
+def test_expired_deadline_raises():
+    d= retry.deadline(0.01)
+    import time
+    time.sleep(0.02)
+
+    assert d.expired()
+    with raises(retry.DeadlineExceeded):
+        d.check()
@@ -0,0 +1,168 @@
+'''
+Tests for the warm session pool in netcrawl.session_pool
+'''
+
+import threading
+
+from netcrawl import config
+from netcrawl.session_pool import session_pool
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+class fake_connection():
+    def __init__(self):
+        self.alive= True
+
+    def is_alive(self):
+        return self.alive
+
+
+class fake_device():
+    def __init__(self, ip):
+        self.ip= ip
+        self.connection= fake_connection()
+        self.closed= False
+
+    def _end_session(self):
+        self.closed= True
+        self.connection= None
+
+
+def make_pool(monkeypatch, **kwargs):
+    pool= session_pool(**kwargs)
+    opened= []
+
+    def _open(ip, netmiko_platform, **kwargs):
+        opened.append(ip)
+        return fake_device(ip)
+
+    monkeypatch.setattr(pool, '_open', _open)
+    return pool, opened
+
+
+def test_sessions_are_reused(monkeypatch):
+    pool, opened= make_pool(monkeypatch, max_sessions=4)
+
+    for i in range(3):
+        pool.release(pool.acquire('10.0.0.1'))
+
+    assert opened == ['10.0.0.1']
+    assert '10.0.0.1' in pool
+
+
+def test_least_recently_used_is_evicted(monkeypatch):
+    pool, opened= make_pool(monkeypatch, max_sessions=2)
+
+    first= pool.acquire('10.0.0.1')
+    pool.release(first)
+    pool.release(pool.acquire('10.0.0.2'))
+
+    # Touch the first session so the second is the oldest
+    pool.release(pool.acquire('10.0.0.1'))
+    pool.release(pool.acquire('10.0.0.3'))
+
+    assert len(pool) == 2
+    assert '10.0.0.2' not in pool
+    assert '10.0.0.1' in pool
+    assert not first.device.closed
+
+
+def test_dead_sessions_are_replaced(monkeypatch):
+    pool, opened= make_pool(monkeypatch, max_sessions=2)
+
+    session= pool.acquire('10.0.0.1')
+    pool.release(session)
+    session.device.connection.alive= False
+
+    pool.release(pool.acquire('10.0.0.1'))
+
+    assert opened == ['10.0.0.1', '10.0.0.1']
+    assert session.device.closed
+
+
+def test_close_ends_all_sessions(monkeypatch):
+    pool, opened= make_pool(monkeypatch, max_sessions=4)
+
+    sessions= [pool.acquire(ip) for ip in ('10.0.0.1', '10.0.0.2')]
+    for s in sessions: pool.release(s)
+
+    pool.close()
+    assert len(pool) == 0
+    assert all(s.device.closed for s in sessions)
+
+
+def test_concurrent_opens_keep_one_session(monkeypatch):
+    pool= session_pool(max_sessions=4)
+    devices= []
+    both_opening= threading.Barrier(2)
+
+    def _open(ip, netmiko_platform, **kwargs):
+        both_opening.wait(5)
+        devices.append(fake_device(ip))
+        return devices[-1]
+
+    monkeypatch.setattr(pool, '_open', _open)
+
+    used= []
+    def refresh():
+        session= pool.acquire('10.0.0.1')
+        used.append(session)
+        pool.release(session)
+
+    threads= [threading.Thread(target=refresh) for i in range(2)]
+    for t in threads: t.start()
+    for t in threads: t.join(10)
+
+    # The thread which lost closed its session and used the pooled one
+    assert len(pool) == 1
+    assert used[0] is used[1]
+    assert [d.closed for d in devices].count(True) == 1
+    assert not used[0].device.closed
+
+
+def test_dead_session_eviction_keeps_a_replacement(monkeypatch):
+    pool, opened= make_pool(monkeypatch, max_sessions=2)
+
+    dead= pool.acquire('10.0.0.1')
+    pool.release(dead)
+
+    # Another thread already replaced the dead session
+    with pool.lock: pool._evict('10.0.0.1')
+    replacement= pool.acquire('10.0.0.1')
+    pool.release(replacement)
+
+    with pool.lock: pool._evict('10.0.0.1', dead)
+    assert '10.0.0.1' in pool
+    assert not replacement.device.closed
+
+
+def test_slow_disconnect_does_not_block_checkouts(monkeypatch):
+    pool, opened= make_pool(monkeypatch, max_sessions=1)
+    disconnecting= threading.Event()
+    finish= threading.Event()
+
+    pool.release(pool.acquire('10.0.0.1'))
+    slow= pool.sessions['10.0.0.1'].device
+
+    def _end_session():
+        disconnecting.set()
+        finish.wait(5)
+        slow.closed= True
+    slow._end_session= _end_session
+
+    # Opening a second session evicts the first, which hangs on disconnect
+    evictor= threading.Thread(target=lambda: pool.release(pool.acquire('10.0.0.2')))
+    evictor.start()
+    assert disconnecting.wait(5)
+
+    # The pool lock is free while the first session disconnects
+    assert pool.lock.acquire(timeout=1)
+    pool.lock.release()
+
+    finish.set()
+    evictor.join(5)
+    assert slow.closed
+    assert '10.0.0.1' not in pool
@@ -5,11 +5,13 @@ Created on Mar 20, 2017
 '''
 from netcrawl import io_sql, config
 from netcrawl.io_sql import device_db
+from netcrawl.wylog import metrics
 from faker import Faker
 from tests import helpers
 from netcrawl.devices.base import NetworkDevice
 from time import sleep
-import psycopg2
+import psycopg2, json
+from psycopg2.extras import RealDictCursor
 
 from netcrawl.config import cc
 from tests.helpers import fakeDevice, populated_cisco_network_device
@@ -152,3 +154,256 @@ def test_devicedb_get_record():
             
             assert hasattr(f['device'], k)
             assert getattr(f['device'], k) == v
+
+
+def test_transport_history_is_read_back():
+    db= device_db()
+    device= populated_cisco_network_device()
+    device.ip= '198.51.100.7'
+    device.transport= 'telnet'
+    device.tcp_22= False
+    device.tcp_23= True
+    
+    assert db.get_transport_history('198.51.100.8') == {}
+    
+    index= db.add_device_nd(device)
+    try:
+        history= db.get_transport_history('198.51.100.7')
+        assert history == {'transport': 'telnet',
+                           'tcp_22': False,
+                           'tcp_23': True}
+    finally:
+        db.delete_device_record(index)
+
+
+def test_mac_table_refresh():
+    db= device_db()
+    device= populated_cisco_network_device()
+    interf= helpers.populated_cisco_interface()
+    interf.mac_address_table= ['111122223333', '444455556666']
+    device.interfaces.append(interf)
+    
+    index= db.add_device_nd(device)
+    try:
+        interf.mac_address_table= ['111122223333', 'aaaa.bbbb.cccc']
+        assert db.update_mac_table(index, device) == 2
+        
+        with db.conn, db.conn.cursor() as cur:
+            cur.execute('''
+                SELECT mac_address, seen_last_scan
+                FROM mac
+                WHERE device_id = %s;
+                ''', (index, ))
+            seen= dict(cur.fetchall())
+        
+        assert seen == {'111122223333': True,
+                        'AAAABBBBCCCC': True,
+                        '444455556666': False}
+    finally:
+        db.delete_device_record(index)
+
+
+def test_large_mac_table_refresh():
+    db= device_db()
+    device= populated_cisco_network_device()
+    interf= helpers.populated_cisco_interface()
+    interf.mac_address_table= []
+    device.interfaces.append(interf)
+    
+    index= db.add_device_nd(device)
+    try:
+        # More rows than one page of the bulk statement
+        interf.mac_address_table= ['{:012X}'.format(i) for i in range(2500)]
+        assert db.update_mac_table(index, device) == 2500
+        assert db.update_mac_table(index, device) == 2500
+        
+        with db.conn, db.conn.cursor() as cur:
+            cur.execute('''
+                SELECT count(*), count(*) FILTER (WHERE seen_last_scan)
+                FROM mac
+                WHERE device_id = %s;
+                ''', (index, ))
+            assert cur.fetchone() == (2500, 2500)
+    finally:
+        db.delete_device_record(index)
+
+
+def test_reparse_from_stored_output():
+    from netcrawl import core
+    from netcrawl.devices import IosDevice
+    
+    db= device_db()
+    device= IosDevice(ip='198.51.100.9', netmiko_platform='cisco_ios')
+    device.config= next(helpers.get_example_dir('ios_config'))
+    device.device_name= 'lab-dist-01'
+    device._get_interfaces()
+    device._parse_mac_address_table(next(helpers.get_example_dir('mac_table')))
+    macs= sum(len(i.mac_address_table) for i in device.interfaces)
+    
+    index= db.add_device_nd(device)
+    try:
+        record= db.get_stored_output(index)
+        assert record['has_macs'] and not record['has_neighbors']
+        assert core._can_reparse(record)
+        
+        device_id, parsed, error= core._reparse_record(record)
+        assert error is None
+        db.replace_interface_entries(device_id, parsed)
+        
+        with db.conn, db.conn.cursor() as cur:
+            cur.execute('''
+                SELECT interface_name, count(mac_id)
+                FROM interfaces LEFT JOIN mac USING (interface_id)
+                WHERE interfaces.device_id = %s
+                GROUP BY interface_name;
+                ''', (index, ))
+            rows= dict(cur.fetchall())
+        
+        assert len(rows) == len(device.interfaces)
+        assert sum(rows.values()) == macs
+        
+        # MACs can't be rewritten without their table
+        record['raw_mac_address_table']= None
+        assert not core._can_reparse(record)
+    finally:
+        db.delete_device_record(index)
+
+
+def test_unchanged_device_is_only_marked_as_seen():
+    from netcrawl import core
+    
+    class pending_db():
+        def __init__(self): self.devices= []
+        def add_device_pending_neighbors(self, _device): 
+            self.devices.append([n['ip_list'] for n in _device.all_neighbors()])
+    
+    db= device_db()
+    device= populated_cisco_network_device()
+    device.ip= '198.51.100.10'
+    device.neighbors= [{'device_name': 'n1', 'netmiko_platform': 'cisco_ios', 
+                        'ip_list': ['10.0.0.1', '10.1.1.1']},
+                       {'device_name': 'n2', 'netmiko_platform': 'cisco_ios', 
+                        'ip_list': ['10.0.0.2']}]
+    device.fingerprints= device.fingerprint()
+    
+    index= db.add_device_nd(device)
+    try:
+        old= db.get_device_record('device_id', index)['updated']
+        
+        polled= populated_cisco_network_device()
+        polled.ip, polled.device_name, polled.config= device.ip, device.device_name, device.config
+        polled.fingerprints= polled.fingerprint()
+        
+        main= pending_db()
+        assert core._skip_unchanged({'device': polled}, main, db)
+        assert main.devices == [[['10.0.0.1', '10.1.1.1'], ['10.0.0.2']]]
+        assert db.get_device_record('device_id', index)['updated'] > old
+        
+        polled.config+= 'interface Vlan2\n'
+        polled.fingerprints= polled.fingerprint()
+        assert not core._skip_unchanged({'device': polled}, main, db)
+    finally:
+        db.delete_device_record(index)
+
+
+def test_device_timings_are_reported():
+    db= device_db()
+    device= populated_cisco_network_device()
+    device.ip= '198.51.100.11'
+    device.timings= {'connect': 4.0, 'connect:login': 3.5, 
+                     'collect': 20.0, 'collect:show run': 12.0,
+                     'parse': 1.0, 'db_write': 0.5}
+    
+    index= db.add_device_nd(device)
+    try:
+        config.cc.run_number= 987654
+        db.add_device_timings(index, device)
+        
+        slowest= db.slowest_devices(run_number=987654)
+        assert len(slowest) == 1
+        assert slowest[0]['device_id'] == index
+        assert slowest[0]['seconds'] == 25.5
+        assert slowest[0]['collect'] == 20.0
+        
+        steps= db.slowest_steps(run_number=987654)
+        assert [(x['phase'], x['step']) for x in steps] == [
+            ('collect', 'show run'), ('connect', 'login')]
+    finally:
+        db.delete_device_record(index)
+        config.cc.run_number= 0
+
+
+def test_timing_report_picks_the_latest_run_after_a_clean():
+    db= device_db()
+    device= populated_cisco_network_device()
+    device.ip= '198.51.100.12'
+    
+    index= db.add_device_nd(device)
+    try:
+        first= db.start_run('full')
+        config.cc.run_number= first
+        device.timings= {'connect': 1.0}
+        db.add_device_timings(index, device)
+        
+        # Cleaning the main database doesn't restart the run numbers
+        io_sql.main_db(clean=True).close()
+        
+        second= db.start_run('full')
+        assert second > first
+        config.cc.run_number= second
+        device.timings= {'connect': 2.0}
+        db.add_device_timings(index, device)
+        
+        slowest= db.slowest_devices()
+        assert [x['seconds'] for x in slowest] == [2.0]
+    finally:
+        db.delete_device_record(index)
+        config.cc.run_number= 0
+
+
+def test_statement_template():
+    assert io_sql.statement_template('''
+        SELECT * FROM  devices
+        WHERE ip = '10.1.1.1' AND device_id = 42;''') == (
+            'SELECT * FROM devices WHERE ip = ? AND device_id = ?;')
+    
+    # Placeholders and names with digits are kept
+    assert io_sql.statement_template(
+        'SELECT tcp_22 FROM devices WHERE ip = %s') == (
+            'SELECT tcp_22 FROM devices WHERE ip = %s')
+
+
+def test_statements_are_timed_and_slow_ones_explained(tmpdir):
+    db= device_db()
+    metrics.clear()
+    
+    threshold, path= config.cc.sql_slow_threshold, config.cc.sql_slow_path
+    config.cc.sql_slow_threshold= 0
+    config.cc.sql_slow_path= str(tmpdir.join('slow.jsonl'))
+    try:
+        with db.conn, db.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute('SELECT device_id FROM devices WHERE ip = %s', ('198.51.100.12',))
+            assert cur.fetchall() == []
+            
+            # Statements which can't be explained don't abort the transaction
+            cur.execute('SELECT 1; SELECT 2')
+            cur.execute('SELECT 3 AS x')
+            assert cur.fetchone()['x'] == 3
+        
+        h= metrics.get('sql:SELECT device_id FROM devices WHERE ip = %s')
+        assert h.count == 1
+        assert metrics.get('sql:SELECT ? AS x').count == 1
+        
+        with open(config.cc.sql_slow_path) as infile:
+            entries= [json.loads(x) for x in infile]
+        
+        assert entries[0]['parameters'] == "('198.51.100.12',)"
+        assert 'devices' in entries[0]['plan']
+        assert entries[1]['plan'] is None
+        
+        summary= io_sql.statement_summary()
+        assert {x['statement'] for x in summary} >= {
+            'SELECT device_id FROM devices WHERE ip = %s', 'SELECT ?; SELECT ?'}
+    finally:
+        config.cc.sql_slow_threshold, config.cc.sql_slow_path= threshold, path
+        metrics.clear()
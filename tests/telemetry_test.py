@@ -0,0 +1,50 @@
+'''
+Tests for the Prometheus metrics endpoint
+'''
+
+from urllib.request import urlopen
+
+from netcrawl import config, telemetry
+from netcrawl.wylog import metrics
+
+
+def setup_module(module):
+    config.parse_config()
+
+
+def setup_function(function):
+    metrics.clear()
+
+
+def test_render_formats_every_metric():
+    metrics.set_gauge('pending', 12)
+    metrics.set_gauge('worker_state', 1, worker='Worker-1', state='idle')
+    metrics.count('cli.auth_success', 3)
+    metrics.observe('_get_config', 0.3)
+    metrics.observe('_get_config', 30, error=True)
+    
+    lines= telemetry.render().splitlines()
+    
+    assert 'netcrawl_pending 12' in lines
+    assert 'netcrawl_worker_state{state="idle",worker="Worker-1"} 1' in lines
+    assert 'netcrawl_events_total{name="cli.auth_success"} 3' in lines
+    assert 'netcrawl_duration_seconds_bucket{name="_get_config",le="0.25"} 0' in lines
+    assert 'netcrawl_duration_seconds_bucket{name="_get_config",le="0.5"} 1' in lines
+    assert 'netcrawl_duration_seconds_bucket{name="_get_config",le="+Inf"} 2' in lines
+    assert 'netcrawl_duration_seconds_count{name="_get_config"} 2' in lines
+    assert 'netcrawl_errors_total{name="_get_config"} 1' in lines
+
+
+def test_endpoint_serves_metrics():
+    metrics.set_gauge('in_flight', 5)
+    
+    server= telemetry.start(port=0, host='127.0.0.1')
+    try:
+        url= 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urlopen(url, timeout=5) as response:
+            body= response.read().decode('utf-8')
+            assert response.headers['Content-Type'].startswith('text/plain')
+    finally:
+        telemetry.stop(server)
+    
+    assert 'netcrawl_in_flight 5' in body.splitlines()
@@ -5,9 +5,10 @@ Created on Mar 13, 2017
 '''
 
 from time import sleep
+import gzip, json, os
 
 from netcrawl import config
-from netcrawl.wylog import log, log_snip, logging
+from netcrawl.wylog import log, log_snip, logging, sink, lazy, is_enabled, context
 
 
 def setup_module(module):
@@ -32,11 +33,167 @@ def test_log_snip_actually_logs_something(capsys):
     out, err = capsys.readouterr()
     
     assert 'Finished snippet' in out
+
+
+def _log_lines(log_queue, path, count):
+    sink.attach(log_queue)
+    for i in range(count):
+        log('Line {}'.format(i), proc='test_sink', log_path=path, print_out=False)
+
+
+def test_sink_writes_lines_from_all_processes(tmp_path):
+    import multiprocessing
+    
+    path= str(tmp_path / 'sink' / 'log.txt')
+    log_queue= sink.start()
+    try:
+        processes= [multiprocessing.Process(target=_log_lines, args=(log_queue, path, 200)) 
+                    for i in range(4)]
+        for p in processes: p.start()
+        for p in processes: p.join()
+    finally:
+        sink.stop()
+    
+    with open(path) as f: lines= f.read().splitlines()
+    
+    assert len(lines) == 800
+    assert all(line.startswith('test_sink') for line in lines)
+
+
+
+def test_sink_flushes_a_slow_trickle(tmp_path):
+    path= str(tmp_path / 'log.txt')
+    old_interval, config.cc.log_flush_interval= config.cc.log_flush_interval, 0.3
+    try:
+        sink.start()
+        # Lines keep coming faster than the flush interval
+        for i in range(12):
+            log('Line {}'.format(i), proc='test_trickle', log_path=path, print_out=False)
+            sleep(0.1)
+        
+        # Read while the sink is still running
+        with open(path) as f: lines= f.read().splitlines()
+    finally:
+        sink.stop()
+        config.cc.log_flush_interval= old_interval
+    
+    assert len(lines) >= 6
+
+def test_new_log_empties_the_file(tmp_path):
+    path= str(tmp_path / 'log.txt')
+    
+    log('Old', log_path=path, print_out=False)
+    log('New', log_path=path, print_out=False, new_log=True)
+    log('After', log_path=path, print_out=False)
+    
+    with open(path) as f: lines= f.read().splitlines()
+    assert [x.split(',')[1].strip() for x in lines] == ['#4 New', '#4 After']
+
+
+
+
+def test_disabled_levels_are_not_formatted(tmp_path):
+    path= str(tmp_path / 'log.txt')
+    calls= []
+    
+    def expensive():
+        calls.append(1)
+        return 'value'
+    
+    config.cc.debug= False
+    assert not is_enabled(logging.DEBUG)
+    assert is_enabled(logging.NORMAL)
+    assert not log('Debug [{}]', lazy(expensive), log_path=path, v=logging.DEBUG)
+    assert not calls
+    
+    log('Normal [{}] [{}]', lazy(expensive), 2, log_path=path, print_out=False)
+    log(lambda: 'Callable', log_path=path, print_out=False)
+    assert calls == [1]
+    
+    with open(path) as f: lines= f.read().splitlines()
+    assert [x.split(',')[1].strip() for x in lines] == ['#4 Normal [value] [2]', '#4 Callable']
+
+
+def test_json_lines_have_the_context(tmp_path):
+    path= str(tmp_path / 'log.jsonl')
+    old_format, config.cc.log_format= config.cc.log_format, 'json'
+    try:
+        with context(pending_id=7, ip='10.0.0.1', phase='connect'):
+            log('Connecting [{}]', 1, proc='test_json', log_path=path, 
+                print_out=False, duration=0.5)
+        log('Outside', proc='test_json', log_path=path, print_out=False)
+    finally:
+        config.cc.log_format= old_format
+    
+    with open(path) as f: records= [json.loads(x) for x in f]
+    
+    assert records[0]['msg'] == 'Connecting [1]'
+    assert records[0]['proc'] == 'test_json'
+    assert records[0]['pending_id'] == 7
+    assert records[0]['ip'] == '10.0.0.1'
+    assert records[0]['phase'] == 'connect'
+    assert records[0]['duration'] == 0.5
+    assert records[0]['crawl'] == config.cc.run_number
+    assert records[0]['process'] == 'MainProcess'
     
+    assert 'pending_id' not in records[1]
+    assert 'ip' not in records[1]
+
+
+def test_logs_are_rotated_and_gzipped(tmp_path):
+    path= str(tmp_path / 'log.txt')
+    old_max, config.cc.log_max_bytes= config.cc.log_max_bytes, 2000
+    try:
+        sink.start()
+        for i in range(100):
+            log('Line {}'.format(i), proc='test_rotate', log_path=path, print_out=False)
+    finally:
+        sink.stop()
+        config.cc.log_max_bytes= old_max
+    
+    rotated= sorted(x for x in os.listdir(str(tmp_path)) if x != 'log.txt')
+    assert rotated
+    assert all(x.endswith('.gz') for x in rotated)
     
+    lines= []
+    for name in rotated:
+        with gzip.open(str(tmp_path / name), 'rt') as f: lines.extend(f.read().splitlines())
+    with open(path) as f: lines.extend(f.read().splitlines())
     
+    assert len(lines) == 100
+
+
+def test_no_rotation_without_a_sink(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
     
+    path= str(tmp_path / 'log.txt')
+    old_max, config.cc.log_max_bytes= config.cc.log_max_bytes, 2000
     
+    def log_lines(n):
+        for i in range(50):
+            log('Thread {} line {}'.format(n, i), proc='test_threads', 
+                log_path=path, print_out=False)
+    
+    try:
+        with ThreadPoolExecutor(8) as pool: list(pool.map(log_lines, range(8)))
+    finally:
+        sink.stop()
+        config.cc.log_max_bytes= old_max
+    
+    # Other processes may share the file, so only the sink rotates it
+    assert os.listdir(str(tmp_path)) == ['log.txt']
+    with open(path) as f: assert len(f.read().splitlines()) == 400
+
+
+def test_context_drops_fields_set_inside_it():
+    from netcrawl.wylog import set_context, clear_context
+    from netcrawl.wylog.logging import get_context
     
+    clear_context()
+    with context(ip='10.0.0.1'):
+        # Like a polling phase starting
+        set_context(phase='connect', device='core-1')
+        assert get_context() == {'ip': '10.0.0.1', 'phase': 'connect', 
+                                 'device': 'core-1'}
     
-    
\ No newline at end of file
+    assert get_context() == {}
\ No newline at end of file
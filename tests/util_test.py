@@ -5,10 +5,11 @@ Created on Mar 13, 2017
 '''
 
 from faker import Factory
+from netaddr import IPNetwork
 from pytest import raises
 from netcrawl import util
 
-import pytest
+import pytest, re
 
 
 @pytest.mark.parametrize("ip, mask, expected", [
@@ -34,4 +35,50 @@ def test_is_ip_returns_false_on_bs():
     fake= Factory.create()
     for i in range(100):
         assert util.is_ip(fake.bs()) is False
-        
\ No newline at end of file
+
+
+# The implementations the util functions replaced
+def legacy_ucase_letters(raw_input):
+    return ''.join([x.upper() for x in raw_input if re.match(r'\w', x)])
+
+
+def legacy_clean_ip(ip):
+    return ''.join([x for x in ip if re.match(r'[\d\.]', x)])
+
+
+def legacy_network_ip(ip, subnet):
+    if not util.is_ip(subnet): subnet = util.cidr_to_netmask(subnet)
+    return str(IPNetwork('{}/{}'.format(ip, subnet)).network)
+
+
+CDP_ENTRY = '''Device ID: core-01.example.com
+Entry address(es):
+  IP address: 10.0.0.1
+Platform: cisco WS-C6509-E,  Capabilities: Router Switch IGMP
+Interface: GigabitEthernet1/0/1,  Port ID (outgoing port): GigabitEthernet4/1
+Management address(es):
+  IP address: 10.0.0.1
+'''
+
+
+def test_normalization_matches_old_behaviour():
+    for mac in ('0011.2233.44aa', '00:11:22:33:44:aa', ' 00-11_22 '):
+        assert util.ucase_letters(mac) == legacy_ucase_letters(mac)
+    
+    for ip in (' 10.1.2.3 ', '10.1.2.3/24', 'ip: 192.168.0.1\t'):
+        assert util.clean_ip(ip) == legacy_clean_ip(ip)
+    
+    assert util.network_ip('10.1.2.3', '/22') == '10.1.0.0'
+    assert util.network_ip('10.1.2.3', '22') == '10.1.0.0'
+    assert util.parse_ip(CDP_ENTRY) == ['10.0.0.1', '10.0.0.1']
+
+
+def test_network_ip_matches_netaddr():
+    fake= Factory.create()
+    for i in range(200):
+        ip= fake.ipv4()
+        for subnet in ('/{}'.format(i % 33), util.cidr_to_netmask(i % 33)):
+            assert util.network_ip(ip, subnet) == legacy_network_ip(ip, subnet)
+    
+    with raises(TypeError):
+        util.network_ip('10.1.2', '255.255.255.0')